@@ -310,6 +310,9 @@ def search_books():
     publish_date = request.args.get('publish_date')
     if publish_date:
         publish_date = publish_date.strip()
+    keywords = request.args.get('keywords')
+    if keywords:
+        keywords = keywords.strip()
     limit = request.args.get('limit')
     if limit:
         limit = limit.strip()
@@ -319,7 +322,7 @@ def search_books():
     except ValueError:
         abort(400, "limit must be an integer")
 
-    if all(arg is None for arg in [edition_id, work_id, author_name, author_id, title, publish_date, publisher_name]):
+    if all(arg is None for arg in [edition_id, work_id, author_name, author_id, title, publish_date, publisher_name, keywords]):
         html = render_template("book_search.html",
                                valid_search_terms=False)
         response = make_response(html, 400)
@@ -332,6 +335,7 @@ def search_books():
             title=title,
             publish_date=publish_date,
             publisher_name=publisher_name,
+            keywords=keywords,
             limit=limit
         )
         print(results)
@@ -360,6 +364,10 @@ def get_edition_info(edition_id):
     if not result:
         return get_error_page(f"Book with id {edition_id} not found")
 
+    # an old id Open Library redirected: send the browser to the current one
+    if result['edition_id'] != edition_id:
+        return redirect(url_for('get_edition_info', edition_id=result['edition_id']), 301)
+
     # if the current user already has a review, pass in the review_id
     curr_user_reviews = reviews.get_reviews(user_id=current_user.user_id, 
                                            book_id=edition_id)
@@ -380,6 +388,34 @@ def get_edition_info(edition_id):
     response = make_response(html)
     return response
 
+@app.route('/books/isbn/<string:isbn>', methods=['GET'])
+@login_required
+def get_edition_by_isbn(isbn):
+    """
+    Redirects to the book page of the edition with
+    the given ISBN-10 or ISBN-13 (e.g. from a barcode
+    scan). If several editions share the ISBN, the
+    first by edition id is shown.
+    """
+    return _redirect_to_edition(isbn, 'isbn', "ISBN")
+
+@app.route('/books/lccn/<string:lccn>', methods=['GET'])
+@login_required
+def get_edition_by_lccn(lccn):
+    """
+    Redirects to the book page of the edition with
+    the given LCCN (Library of Congress Control Number).
+    """
+    return _redirect_to_edition(lccn, 'lccn', "LCCN")
+
+def _redirect_to_edition(identifier, scheme, name):
+    edition_ids = books.find_editions_by_identifier(identifier, scheme=scheme, limit=1)
+    if edition_ids is None:
+        return get_error_page(f"{identifier} is not a valid {name}")
+    if not edition_ids:
+        return get_error_page(f"Book with {name} {identifier} not found"), 404
+    return redirect(url_for('get_edition_info', edition_id=edition_ids[0]))
+
 @app.route('/books', methods=['GET'])
 @app.route('/books/', methods=['GET'])
 @login_required
@@ -397,7 +433,8 @@ def wrong_route_books():
 def search_author():
     """
     Searches for an author by name, fuller_name, 
-    personal_name, or author_id.
+    personal_name, or author_id, or by keywords
+    (ranked by relevance).
     Returns the author search page with results,
     or search page with invalid terms/no results.
     Limit of search results is default 100.
@@ -408,6 +445,9 @@ def search_author():
     author_id = request.args.get('author_id')
     if author_id:
         author_id = author_id.strip()
+    keywords = request.args.get('keywords')
+    if keywords:
+        keywords = keywords.strip()
 
     limit = request.args.get('limit')
     if limit:
@@ -418,7 +458,7 @@ def search_author():
     except ValueError:
         abort(400, "limit must be an integer")
 
-    if not author_name and not author_id:
+    if not author_name and not author_id and not keywords:
         html = render_template("author_search.html",
                                valid_search_terms=False)
         response = make_response(html, 400)
@@ -427,6 +467,7 @@ def search_author():
         results = books.search_author(
             author_name=author_name,
             author_id=author_id,
+            keywords=keywords,
             limit=limit
         )
 
@@ -456,6 +497,10 @@ def get_author_info(author_id):
 
     print(result)
 
+    # an old id Open Library redirected: send the browser to the current one
+    if result and result['author_id'] != author_id:
+        return redirect(url_for('get_author_info', author_id=result['author_id']), 301)
+
     html = render_template("author_page.html",
                            author=result)
     
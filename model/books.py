@@ -1,8 +1,12 @@
 from sys import argv, stderr, exit
-from sqlalchemy import create_engine, or_, and_, func
+from sqlalchemy import create_engine, or_, and_, tuple_
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import sessionmaker, joinedload, aliased
-from model.database import DB_URL, Base, User, Review, List, Editions, editions_authors, editions_works, Authors, editions_genres, editions_subjects, Places, editions_publish_places, authors_locations, Author_Photos, Publishers, editions_publishers, Editions_Covers, Subjects, Genres, Works, DB_URL
+from sqlalchemy.orm import sessionmaker
+from model.database import DB_URL, Base, User, Review, List, Editions, editions_authors, editions_works, Authors, editions_genres, editions_subjects, Places, editions_publish_places, authors_locations, Author_Photos, Publishers, editions_publishers, Editions_Covers, Subjects, Genres, Works, Identifier, Alias, Editions_Search, Edition_Summary, RATINGS, DB_URL
+from model.ratings import edition_ratings, work_ratings, rating_dict
+from model.text_search import to_tsquery, rank
+from normalization.identifiers import candidates
+from normalization.ol_ids import encode_id, decode_id
 
 """
 This module provides a set of functions to search a database of books
@@ -18,7 +22,11 @@ There are two levels of granularity that can be accomplished for editions:
             'publication_place': list of strings, place(s) of publication,
             'publisher': list of strings, publisher(s) of the edition,
             'publish_date': string, publication date,
-            'edition_cover': integer, cover_id for the edition (OL reference)
+            'edition_cover': integer, cover_id for the edition (OL reference),
+            'average_rating': float, average of all user reviews of the edition,
+            'rating_count': integer, number of user reviews of the edition,
+            'work_average_rating': float, average of all user reviews of the work's editions,
+            'work_rating_count': integer, number of user reviews of the work's editions
         }
  - Another for more detailed information about a given edition:
         edition_details = {
@@ -35,9 +43,16 @@ There are two levels of granularity that can be accomplished for editions:
             'subjects': list of strings, subjects of the edition,
             'edition_cover': integer, cover_id for the edition (OL reference),
             'reviews': Review objects, the top 10 (or some standard limit) user reviews of the edition,
-            'average_rating': float, average of all user reviews of the edition
+            'average_rating': float, average of all user reviews of the edition,
+            'rating_count': integer, number of user reviews of the edition,
+            'rating_histogram': list of integers, number of reviews rating the edition 0, 1, ... 10,
+            'work_average_rating': float, average of all user reviews of the work's editions,
+            'work_rating_count': integer, number of user reviews of the work's editions
         }
 
+The ratings are read from the aggregates kept by the reviews
+(see model/ratings.py), not averaged over the reviews.
+
 For authors, one can search for specific authors or get a specific author. 
 They will be returned in such a dict:
     author_details = {
@@ -55,8 +70,11 @@ They will be returned in such a dict:
 FUNCTIONS
     ** largest search API: layers filters on top of each other **
     search_editions(edition_id, work_id, author_name, author_id, 
-                    title, publisher_name, publish_date, limit):
+                    title, publisher_name, publish_date, keywords, limit):
         returns [simple_editions]
+        keywords is a full text search of the titles and author
+        names (see model/text_search.py for its syntax), and orders
+        the results by relevance
     
     ** smaller search APIs, based on specific inputs **
     search_by_title(title, limit):
@@ -65,6 +83,8 @@ FUNCTIONS
         returns [simple_editions]
     search_by_work(work_id, limit):
         returns [simple_editions]
+    find_editions_by_identifier(identifier, scheme, limit):
+        returns [edition_ids] for an isbn-10/13, lccn or OL edition id
     
     ** get edition details **
     get_edition_info(edition):
@@ -78,11 +98,23 @@ FUNCTIONS
         }
     
     ** authors: search author and get **
-    search_author(author_name, author_id, limit):
-        returns author_details
+    search_author(author_name, author_id, keywords, limit):
+        returns author_details, by relevance to keywords if given
     get_author_info(author_id):
         returns author_details
 
+    the lookups by edition, work or author id (get_edition_info,
+    get_edition_title_cover_authors, get_author_info, search_by_work,
+    search_by_author and find_editions_by_identifier) also accept
+    the old ids of records Open Library has since redirected (merged):
+    when an id is not found, it is looked up in the aliases table and
+    the record it now resolves to is returned
+
+    the ids taken and returned are OL ids (OL123M), which are
+    stored as integer keys (see normalization/ol_ids.py): the
+    functions convert them on the way in and out, and an id
+    that is not an OL id finds nothing
+
     ** get reviews and lists by edition_id **
     get_reviews(edition_id, limit)
         returns review_dict {
@@ -115,24 +147,39 @@ REVIEW_LIMIT = 10
 
 def search_editions(edition_id=None, work_id=None, author_name=None, 
                  author_id=None, title=None, publisher_name=None,
-                 publish_date=None, limit=100): 
+                 publish_date=None, keywords=None, limit=100): 
     """
     search by:
     - title
     - author: name, fuller_name, personal_name, or author id
     - work id 
     - edition id
+    - keywords: words of the title, subtitle or author names,
+      most relevant first
     search will be filtered by a combination of the given parameters
     default limit is 100
     """
-    if all(arg is None for arg in [edition_id, work_id, author_name, author_id, title]):
+    if all(arg is None for arg in [edition_id, work_id, author_name, author_id, title, keywords]):
         return None
 
+    tsquery = None
+    if keywords:
+        tsquery = to_tsquery(keywords)
+        if tsquery is None:
+            return []
+
+    ids = [edition_id, work_id, author_id]
+    keys = [encode_id(i) if i else None for i in ids]
+    if any(i and key is None for i, key in zip(ids, keys)):
+        return []
+    edition_id, work_id, author_id = keys
+
     try:
         Session = sessionmaker(bind=engine)
         session = Session()
 
-        query = session.query(Editions)
+        # the results are read from edition_summary, one row each
+        query = _summary_query(session)
 
         if edition_id:
             query = query.filter(Editions.id == edition_id)
@@ -140,18 +187,22 @@ def search_editions(edition_id=None, work_id=None, author_name=None,
         if work_id:
             query = query.filter(Editions.works.any(id=work_id))
 
+        # the author and publisher filters are EXISTS subqueries
+        # rather than joins, so an edition with two matching authors
+        # or publishers is still one result
         if author_name or author_id:
-            # handle multiple filters
-            AuthorAlias = aliased(Authors)
-            query = query.join(AuthorAlias, Editions.authors)
+            # handle multiple filters, on the same author
+            conditions = []
 
             if author_name:
-                query = query.filter(or_(AuthorAlias.name.ilike(f'%{author_name}%'),
-                                         AuthorAlias.fuller_name.ilike(f'%{author_name}%'),
-                                         AuthorAlias.personal_name.ilike(f'%{author_name}%')))
+                conditions.append(or_(Authors.name.ilike(f'%{author_name}%'),
+                                      Authors.fuller_name.ilike(f'%{author_name}%'),
+                                      Authors.personal_name.ilike(f'%{author_name}%')))
 
             if author_id:
-                query = query.filter(AuthorAlias.id == author_id)
+                conditions.append(Authors.id == author_id)
+
+            query = query.filter(Editions.authors.any(and_(*conditions)))
 
         if title:
             query = query.filter(Editions.title.ilike(f'%{title}%'))
@@ -160,21 +211,17 @@ def search_editions(edition_id=None, work_id=None, author_name=None,
             query = query.filter(Editions.publish_date.ilike(f'%{publish_date}%'))
 
         if publisher_name:
-            PublisherAlias = aliased(Publishers)
-            query = query.join(PublisherAlias, Editions.publishers).filter(PublisherAlias.publisher.ilike(f'%{publisher_name}%'))
+            query = query.filter(Editions.publishers.any(Publishers.publisher.ilike(f'%{publisher_name}%')))
 
-
-        query = query.limit(limit).options(
-            joinedload(Editions.authors),
-            joinedload(Editions.publish_places),
-            joinedload(Editions.publishers),
-            joinedload(Editions.editions_covers)
-        )
+        if tsquery is not None:
+            query = query.join(Editions_Search, Editions_Search.edition_id == Editions.id)\
+                         .filter(Editions_Search.search_vector.op('@@')(tsquery))\
+                         .order_by(rank(Editions_Search.search_vector, tsquery).desc())
 
         query = query.limit(limit)
 
         results = query.all()
-        books = [_edition_to_dict(edition) for edition in results]
+        books = _summaries_to_dicts(session, results)
         session.close()
 
         return books
@@ -203,18 +250,12 @@ def search_by_title(title, limit=100):
         Session = sessionmaker(bind=engine)
         session = Session()
 
-        results = session.query(Editions)\
+        results = _summary_query(session)\
                         .filter(Editions.title.ilike(f'%{title}%'))\
-                        .options(
-                            joinedload(Editions.authors),
-                            joinedload(Editions.publish_places),
-                            joinedload(Editions.publishers),
-                            joinedload(Editions.editions_covers)
-                        ) \
                         .limit(limit)\
                         .all()
 
-        books = [_edition_to_dict(edition) for edition in results]
+        books = _summaries_to_dicts(session, results)
 
         return books
 
@@ -236,31 +277,35 @@ def search_by_author(author_id=None, author_name=None, limit=100):
     """
     if not author_name and not author_id:
         return None
+
+    if author_id:
+        author_id = encode_id(author_id)
+        if author_id is None:
+            return []
     
     try:
         Session = sessionmaker(bind=engine)
         session = Session()
 
         if author_id:
-            results = session.query(Editions)\
-                        .join(editions_authors, Editions.id == editions_authors.c.edition_id)\
-                        .options(joinedload(Editions.authors), 
-                                                joinedload(Editions.publish_places), 
-                                                joinedload(Editions.publishers), 
-                                                joinedload(Editions.editions_covers))\
-                        .filter(editions_authors.c.author_id == author_id)\
+            query = _summary_query(session)\
+                        .join(editions_authors, Editions.id == editions_authors.c.edition_id)
+            results = query.filter(editions_authors.c.author_id == author_id)\
                         .distinct()\
                         .limit(limit)\
                         .all()
+            if not results:
+                target = _resolve_alias(session, author_id)
+                if target:
+                    results = query.filter(editions_authors.c.author_id == target)\
+                                .distinct()\
+                                .limit(limit)\
+                                .all()
             
         else: # author_name
-            results = session.query(Editions)\
+            results = _summary_query(session)\
                             .join(editions_authors, Editions.id == editions_authors.c.edition_id)\
                             .join(Authors, editions_authors.c.author_id == Authors.id)\
-                            .options(joinedload(Editions.authors), 
-                                                    joinedload(Editions.publish_places), 
-                                                    joinedload(Editions.publishers), 
-                                                    joinedload(Editions.editions_covers))\
                             .filter(or_(Authors.name.ilike(f'%{author_name}%'),
                                         Authors.fuller_name.ilike(f'%{author_name}%'),
                                         Authors.personal_name.ilike(f'%{author_name}%')))\
@@ -268,7 +313,7 @@ def search_by_author(author_id=None, author_name=None, limit=100):
                             .limit(limit)\
                             .all()
 
-        books = [_edition_to_dict(edition) for edition in results]
+        books = _summaries_to_dicts(session, results)
 
         return books
 
@@ -290,24 +335,28 @@ def search_by_work(work_id, limit=100):
     """
     if not work_id:
         return None
+
+    work_id = encode_id(work_id)
+    if work_id is None:
+        return []
     
     try:
         Session = sessionmaker(bind=engine)
         session = Session()
 
-        results = session.query(Editions)\
-                        .join(editions_works, Editions.id == editions_works.c.edition_id)\
-                        .filter(editions_works.c.work_id == work_id)\
-                        .options(
-                            joinedload(Editions.authors),
-                            joinedload(Editions.publish_places),
-                            joinedload(Editions.publishers),
-                            joinedload(Editions.editions_covers)
-                        ) \
+        query = _summary_query(session)\
+                        .join(editions_works, Editions.id == editions_works.c.edition_id)
+        results = query.filter(editions_works.c.work_id == work_id)\
                         .limit(limit)\
                         .all()
+        if not results:
+            target = _resolve_alias(session, work_id)
+            if target:
+                results = query.filter(editions_works.c.work_id == target)\
+                                .limit(limit)\
+                                .all()
 
-        books = [_edition_to_dict(edition) for edition in results]
+        books = _summaries_to_dicts(session, results)
 
         return books
 
@@ -321,6 +370,56 @@ def search_by_work(work_id, limit=100):
     finally:
         session.close()
 
+def find_editions_by_identifier(identifier, scheme=None, limit=100):
+    """
+    find the editions with an external identifier: an isbn-10
+    or isbn-13 (with or without hyphens), an lccn or an OL
+    edition id. scheme ('isbn', 'lccn' or 'ol') only tries that
+    kind of identifier. the identifier is canonicalized and
+    looked up in the (scheme, value) index of the identifiers
+    table, with no join, so it is fast enough for barcode scans
+    returns a list of edition ids, or None if the identifier
+    is not valid
+    """
+    if not identifier:
+        return None
+    pairs = candidates(identifier, scheme)
+    if not pairs:
+        return None
+
+    try:
+        Session = sessionmaker(bind=engine)
+        session = Session()
+
+        # OL ids are the editions' own primary key
+        ol_ids = [encode_id(value) for kind, value in pairs if kind == 'ol']
+        if ol_ids:
+            results = session.query(Editions.id)\
+                            .filter(Editions.id == ol_ids[0])\
+                            .all()
+            if not results:
+                target = _resolve_alias(session, ol_ids[0])
+                results = [(target,)] if target else []
+        else:
+            results = session.query(Identifier.edition_id)\
+                            .filter(tuple_(Identifier.scheme, Identifier.value).in_(pairs))\
+                            .distinct()\
+                            .order_by(Identifier.edition_id)\
+                            .limit(limit)\
+                            .all()
+
+        return [decode_id(r[0]) for r in results]
+
+    except SQLAlchemyError as e:
+        session.rollback()
+        print(f"Database error: {e}")
+        return None
+    except Exception as ex:
+        print(f"Error: {ex}")
+        return None
+    finally:
+        session.close()
+
 def get_edition_info(edition_id):
     """
     get book details by an edition_id
@@ -330,9 +429,7 @@ def get_edition_info(edition_id):
         Session = sessionmaker(bind=engine)
         session = Session()
 
-        edition = session.query(Editions)\
-                        .filter_by(id=edition_id)\
-                        .first()
+        edition = _get_record(session, Editions, encode_id(edition_id))
 
         if not edition:
             print(f"Edition {edition_id} not found")
@@ -355,16 +452,21 @@ def get_edition_title_cover_authors(edition_id):
     for use by reviews module: get all the basic information
     about a book, title and cover, to store
     """
+    return edition_title_cover_authors(encode_id(edition_id), edition_id)
+
+def edition_title_cover_authors(key, edition_id=None):
+    """
+    get_edition_title_cover_authors by the key of the edition,
+    for the model modules, which read the keys from the database
+    """
     try:
         Session = sessionmaker(bind=engine)
         session = Session()
 
-        edition = session.query(Editions)\
-                        .filter_by(id=edition_id)\
-                        .first()
+        edition = _get_record(session, Editions, key)
         
         if not edition:
-            print(f"Edition {edition_id} not found")
+            print(f"Edition {edition_id or decode_id(key)} not found")
             return None
         
         cover = session.query(Editions_Covers.cover)\
@@ -378,7 +480,7 @@ def get_edition_title_cover_authors(edition_id):
                                 .all()
 
         return {
-            "edition_id": edition.id,
+            "edition_id": decode_id(edition.id),
             "title": edition.title,
             "cover": cover[0] if cover else None,
             "authors": ', '.join(t[0] for t in authors_names)
@@ -395,14 +497,15 @@ def get_edition_title_cover_authors(edition_id):
         session.close()
 
 
-def search_author(author_name=None, author_id=None, limit=100):
+def search_author(author_name=None, author_id=None, keywords=None, limit=100):
     """
     search author details by name, fuller_name, personal_name,
-    or author_id
+    or author_id, or by keywords (words of the names, most
+    relevant first)
     returns a list of author_details dicts
     limit is default 100
     """
-    if not author_id and not author_name:
+    if not author_id and not author_name and not keywords:
         return None
     
     if author_id:
@@ -412,14 +515,24 @@ def search_author(author_name=None, author_id=None, limit=100):
         Session = sessionmaker(bind=engine)
         session = Session()
 
-        results = session.query(Authors)\
-                        .filter(or_(
-                            Authors.name.ilike(f'%{author_name}%'),
-                            Authors.fuller_name.ilike(f'%{author_name}%'),
-                            Authors.personal_name.ilike(f'%{author_name}%'),
-                            ))\
-                        .limit(limit)\
-                        .all()
+        if keywords:
+            tsquery = to_tsquery(keywords)
+            if tsquery is None:
+                return []
+            results = session.query(Authors)\
+                            .filter(Authors.search_vector.op('@@')(tsquery))\
+                            .order_by(rank(Authors.search_vector, tsquery).desc())\
+                            .limit(limit)\
+                            .all()
+        else:
+            results = session.query(Authors)\
+                            .filter(or_(
+                                Authors.name.ilike(f'%{author_name}%'),
+                                Authors.fuller_name.ilike(f'%{author_name}%'),
+                                Authors.personal_name.ilike(f'%{author_name}%'),
+                                ))\
+                            .limit(limit)\
+                            .all()
 
         authors = [_author_to_dict(author) for author in results]
 
@@ -444,9 +557,11 @@ def get_author_info(author_id):
         Session = sessionmaker(bind=engine)
         session = Session()
 
-        author = session.query(Authors)\
-                        .filter_by(id=author_id)\
-                        .first()
+        author = _get_record(session, Authors, encode_id(author_id))
+
+        if not author:
+            print(f"Author {author_id} not found")
+            return None
 
         return _author_to_dict(author)
 
@@ -460,21 +575,126 @@ def get_author_info(author_id):
     finally:
         session.close()
 
-def _edition_to_dict(edition):
+def _resolve_alias(session, key):
+    """
+    the key a redirected edition, work or author key now stands
+    for, with one probe of the aliases primary key (the redirect
+    chains are followed when the table is built), or None
+    """
+    alias = session.query(Alias.target_id)\
+                    .filter(Alias.id == key)\
+                    .first()
+    return alias[0] if alias else None
+
+def _get_record(session, table, key):
+    """
+    the row of table (Editions, Works or Authors) with the key,
+    or with the key it was redirected to, or None (also for a
+    None key, an id encode_id rejected)
+    """
+    if key is None:
+        return None
+    record = session.query(table)\
+                    .filter_by(id=key)\
+                    .first()
+    if record is None:
+        target = _resolve_alias(session, key)
+        if target:
+            record = session.query(table)\
+                            .filter_by(id=target)\
+                            .first()
+    return record
+
+def _summary_to_dict(summary):
     """
     helper function for creating a simple_edition dict
-    given an edition
+    given the edition_summary row of an edition
     """
     return {
-        'edition_id': edition.id,
-        'title': edition.title,
-        'authors': [(author.name, author.id) for author in edition.authors],
-        'publication_place': [place.place for place in edition.publish_places],
-        'publisher': [publisher.publisher for publisher in edition.publishers],
-        'publish_date': edition.publish_date,
-        'edition_cover': edition.editions_covers[0].cover if edition.editions_covers else None
+        'edition_id': decode_id(summary.edition_id),
+        'title': summary.title,
+        'authors': list(zip(summary.author_names or [], map(decode_id, summary.author_ids or []))),
+        'publication_place': summary.publish_places or [],
+        'publisher': summary.publishers or [],
+        'publish_date': summary.publish_date,
+        'edition_cover': summary.cover
     }
 
+def _summary_query(session):
+    """
+    the query of the (edition id, Edition_Summary) rows of the
+    editions, the summary None for an edition without a row
+    in edition_summary (see _summaries_to_dicts)
+    """
+    return session.query(Editions.id, Edition_Summary)\
+                    .outerjoin(Edition_Summary, Edition_Summary.edition_id == Editions.id)
+
+def _build_summary(session, edition_id):
+    """
+    the Edition_Summary of an edition without a row in
+    edition_summary (the derived tables are not built yet, e.g.
+    after loading with the copies of load_tables.sql alone),
+    read from the catalog tables the way normalization/
+    edition_summary.py builds it. it is not saved
+    """
+    edition = session.query(Editions.title, Editions.publish_date)\
+                    .filter(Editions.id == edition_id)\
+                    .one()
+
+    authors = session.query(Authors.id, Authors.name)\
+                    .join(editions_authors, Authors.id == editions_authors.c.author_id)\
+                    .filter(editions_authors.c.edition_id == edition_id)\
+                    .distinct()\
+                    .all()
+
+    places = session.query(Places.place)\
+                    .join(editions_publish_places, Places.id == editions_publish_places.c.place_id)\
+                    .filter(editions_publish_places.c.edition_id == edition_id)\
+                    .distinct()\
+                    .all()
+
+    publishers = session.query(Publishers.publisher)\
+                        .join(editions_publishers, Publishers.id == editions_publishers.c.publisher_id)\
+                        .filter(editions_publishers.c.edition_id == edition_id)\
+                        .distinct()\
+                        .all()
+
+    cover = session.query(Editions_Covers.cover)\
+                    .filter(Editions_Covers.edition_id == edition_id)\
+                    .order_by(Editions_Covers.id)\
+                    .first()
+
+    return Edition_Summary(
+        edition_id=edition_id,
+        title=edition.title,
+        author_ids=[author.id for author in authors],
+        author_names=[author.name for author in authors],
+        publish_places=[item[0] for item in places],
+        publishers=[item[0] for item in publishers],
+        publish_date=edition.publish_date,
+        cover=cover[0] if cover else None)
+
+def _summaries_to_dicts(session, rows):
+    """
+    the simple_edition dicts of (edition id, Edition_Summary)
+    rows of _summary_query, with the ratings of each edition and
+    of its work, read for all the rows at once from edition_ratings
+    and work_ratings. an edition without a summary row is still
+    found, and its summary read from the catalog tables
+    """
+    summaries = [summary if summary is not None else _build_summary(session, edition_id)
+                 for edition_id, summary in rows]
+    edition_ids = [summary.edition_id for summary in summaries]
+    editions = edition_ratings(session, edition_ids)
+    works = work_ratings(session, edition_ids)
+    books = []
+    for summary in summaries:
+        book = _summary_to_dict(summary)
+        book.update(rating_dict(editions.get(summary.edition_id)))
+        book.update(rating_dict(works.get(summary.edition_id), prefix='work_'))
+        books.append(book)
+    return books
+
 def _edition_details_dict(edition):
     """
     helper function for creating an edition_details dict
@@ -520,17 +740,13 @@ def _edition_details_dict(edition):
                                 .limit(REVIEW_LIMIT)\
                                 .all()
 
-        average_rating = session.query(func.avg(Review.rating))\
-                                .filter(Review.book_id == edition.id)\
-                                .scalar()
-        
-        if average_rating is not None:
-            average_rating = float(f"{average_rating:.2f}")
-        
+        ratings = edition_ratings(session, [edition.id]).get(edition.id)
+        work = work_ratings(session, [edition.id]).get(edition.id)
+
         return {
-            'edition_id': edition.id,
+            'edition_id': decode_id(edition.id),
             'title': edition.title,
-            'authors': authors_names_ids,
+            'authors': [(name, decode_id(key)) for name, key in authors_names_ids],
             'publication_place': [item[0] for item in places],
             'publisher': [item[0] for item in publishers],
             'publish_date': edition.publish_date,
@@ -541,7 +757,9 @@ def _edition_details_dict(edition):
             'subjects': [item[0] for item in subjects],
             'edition_cover': cover[0] if cover else None,
             'reviews': [_review_to_dict_books(review) for review in reviews_results],
-            'average_rating': average_rating
+            **rating_dict(ratings),
+            'rating_histogram': ratings.histogram if ratings else [0] * len(RATINGS),
+            **rating_dict(work, prefix='work_')
         }
 
     except SQLAlchemyError as e:
@@ -590,7 +808,7 @@ def _author_to_dict(author):
                         .first()
         
         return {
-            "author_id": author.id,
+            "author_id": decode_id(author.id),
             "name": author.name,
             "fuller_name": author.fuller_name,
             "personal_name": author.personal_name,
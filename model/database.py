@@ -1,5 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Table, Date, Text
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy import create_engine, event, Column, Integer, BigInteger, String, ForeignKey, Table, Date, Text, Index, DDL, Computed
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
+from sqlalchemy.orm import relationship, sessionmaker, deferred
 from sqlalchemy.ext.declarative import declarative_base
 
 from flask_login import UserMixin
@@ -9,6 +10,25 @@ DB_URL = 'postgresql://gracebu@localhost:5432/all_books'
 
 Base = declarative_base()
 
+# the searches match names and titles with ILIKE '%term%', which
+# a btree index cannot serve. the trigram (pg_trgm) GIN indexes
+# declared with trigram_index can, for terms of 3 characters or more
+def trigram_index(table, column):
+    return Index(f"{table}_{column}_trgm_idx", column,
+                 postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+event.listen(Base.metadata, 'before_create', DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+# the keyword searches (see model/text_search.py) match the
+# search_vector columns through GIN indexes
+def search_index(table):
+    return Index(f"{table}_search_vector_idx", 'search_vector', postgresql_using='gin')
+
+# the text search configuration of the documents and of the
+# queries (normalization/search_index.py repeats it for the
+# editions' documents)
+SEARCH_CONFIG = 'english'
+
 user_follower_association = Table('user_followers', Base.metadata,
     Column('user', Integer, ForeignKey('users.user_id')),
     Column('follower', Integer, ForeignKey('users.user_id'))
@@ -21,6 +41,7 @@ like_association = Table('likes', Base.metadata,
 
 class User(UserMixin, Base):
     __tablename__ = 'users'
+    __table_args__ = (trigram_index('users', 'username'),)
 
     user_id = Column(Integer, primary_key=True)
     username = Column(String)
@@ -67,7 +88,7 @@ class Review(Base):
 
     review_id = Column(Integer, primary_key=True)
     reviewer_id = Column(Integer, ForeignKey('users.user_id'))
-    book_id = Column(String, ForeignKey('editions.id'))
+    book_id = Column(Integer, ForeignKey('editions.id'))
     book_title = Column(String)
     book_cover = Column(Integer)
     author_names = Column(String)
@@ -78,9 +99,29 @@ class Review(Base):
     reviewer = relationship('User', back_populates='reviews')
     book = relationship('Editions', back_populates='reviews')
 
+# the ratings of the reviews of each edition, and of each work
+# through editions_works: how many, their sum and how many of
+# each rating (histogram[r] in python, histogram[r + 1] in sql),
+# kept up to date by the review writes (see model/ratings.py)
+RATINGS = range(0, 11)
+
+class Edition_Ratings(Base):
+    __tablename__ = 'edition_ratings'
+    edition_id = Column(Integer, ForeignKey('editions.id'), primary_key=True)
+    rating_count = Column(Integer, nullable=False)
+    rating_sum = Column(Integer, nullable=False)
+    histogram = Column(ARRAY(Integer), nullable=False)
+
+class Work_Ratings(Base):
+    __tablename__ = 'work_ratings'
+    work_id = Column(Integer, ForeignKey('works.id'), primary_key=True)
+    rating_count = Column(Integer, nullable=False)
+    rating_sum = Column(Integer, nullable=False)
+    histogram = Column(ARRAY(Integer), nullable=False)
+
 list_book_association = Table('list_books', Base.metadata,
     Column('list_id', Integer, ForeignKey('lists.list_id')),
-    Column('book_id', String, ForeignKey('editions.id'))
+    Column('book_id', Integer, ForeignKey('editions.id'))
 )
 
 class List(Base):
@@ -97,9 +138,16 @@ class List(Base):
 
 # ---------------- EDITIONS ----------------
 
+# the ids of editions, works and authors, and every reference to
+# them, are the integer keys of normalization/ol_ids.py (OL123M is
+# 493): 4 bytes instead of a string, in the main tables and the big
+# association tables and their indexes. the model modules take and
+# return OL ids, and convert them at their edges
+
 class Editions(Base):
     __tablename__ = 'editions'
-    id = Column(String, primary_key=True)
+    __table_args__ = (trigram_index('editions', 'title'),)
+    id = Column(Integer, primary_key=True, autoincrement=False)
     created = Column(Date)
     last_modified = Column(Date)
     revision = Column(Integer)
@@ -114,6 +162,7 @@ class Editions(Base):
     edition_name = Column(String)
     volume_number = Column(Integer)
     description = Column(Text)
+    notes = Column(Text)
     number_of_pages = Column(Integer)
     pagination = Column(String)
     translation_of = Column(String)
@@ -136,182 +185,248 @@ class Editions(Base):
     reviews = relationship('Review', back_populates='book')
     lists = relationship('List', secondary='list_books', back_populates='books')
 
+class Editions_Search(Base):
+    # the keyword search document of each edition: title, then
+    # subtitle and full title, then author names, weighted in that
+    # order. it spans three tables, so it is not a generated column:
+    # normalization/load_tables.py builds it after a load and
+    # normalization/delta.py refreshes the editions it changes
+    # (see normalization/search_index.py)
+    __tablename__ = 'editions_search'
+    __table_args__ = (search_index('editions_search'),)
+    edition_id = Column(Integer, ForeignKey('editions.id'), primary_key=True)
+    search_vector = Column(TSVECTOR)
+
+class Edition_Summary(Base):
+    # what a search result shows of an edition, in one row, so a
+    # page of results is read without joining four tables per
+    # edition. author_ids and author_names go in the same order.
+    # built and refreshed like editions_search
+    # (see normalization/edition_summary.py)
+    __tablename__ = 'edition_summary'
+    edition_id = Column(Integer, ForeignKey('editions.id'), primary_key=True)
+    title = Column(String)
+    author_ids = Column(ARRAY(Integer))
+    author_names = Column(ARRAY(String))
+    publish_places = Column(ARRAY(String))
+    publishers = Column(ARRAY(String))
+    publish_date = Column(String)
+    cover = Column(Integer)
+
 editions_authors = Table('editions_authors', Base.metadata,
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('author_id', String, ForeignKey('authors.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('author_id', Integer, ForeignKey('authors.id'))
 )
 
 editions_works = Table('editions_works', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('work_id', String, ForeignKey('works.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('work_id', Integer, ForeignKey('works.id'))
 )
 
+# the ids of the lookup tables (contributors, genres, ... the tables
+# normalize.py writes) are bigint, for the 63 bit ids of a parse
+# with --hash-ids (see normalization/hash_ids.py)
+
 class Contributors(Base):
     # based on fields contributors and contributions
     __tablename__ = 'contributors'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     contributor = Column(String)
     editions = relationship("Editions", secondary="editions_contributors", back_populates="contributors")
 
 editions_contributors = Table('editions_contributors', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('contributor_id', Integer, ForeignKey('contributors.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('contributor_id', BigInteger, ForeignKey('contributors.id'))
 )
 
 class Editions_Covers(Base):
     __tablename__ = 'editions_covers'
     id = Column(Integer, primary_key=True)
     cover = Column(Integer)
-    edition_id = Column(String, ForeignKey('editions.id'))
+    edition_id = Column(Integer, ForeignKey('editions.id'))
     edition = relationship("Editions", foreign_keys=[edition_id], backref="editions_covers") # MAYBE??
 
 class Genres(Base):
     # from editions and authors
     __tablename__ = 'genres'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     genre = Column(String)
     editions = relationship("Editions", secondary="editions_genres", back_populates="genres")
 
 editions_genres = Table('editions_genres', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('genre_id', Integer, ForeignKey('genres.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('genre_id', BigInteger, ForeignKey('genres.id'))
 )
 
 class ISBN_10(Base):
-    __tablename__ = 'isbn_10'
+    # strings: an isbn can start with 0 or end in X
+    __tablename__ = 'editions_isbn_10'
     id = Column(Integer, primary_key=True)
-    isbn_10 = Column(Integer) # CONVERT FROM STRING
-    edition_id = Column(String, ForeignKey('editions.id'))
+    isbn_10 = Column(String)
+    edition_id = Column(Integer, ForeignKey('editions.id'))
     edition = relationship("Editions")
 
 class ISBN_13(Base):
-    __tablename__ = 'isbn_13'
+    __tablename__ = 'editions_isbn_13'
+    id = Column(Integer, primary_key=True)
+    isbn_13 = Column(String)
+    edition_id = Column(Integer, ForeignKey('editions.id'))
+    edition = relationship("Editions")
+
+class Identifier(Base):
+    # every isbn (as isbn-13) and lccn of an edition, in the
+    # canonical form of normalization/identifiers.py, so an
+    # identifier is found with one probe of the (scheme, value)
+    # index, which includes edition_id for an index only scan
+    __tablename__ = 'identifiers'
+    __table_args__ = (
+        Index('identifiers_scheme_value_idx', 'scheme', 'value', postgresql_include=['edition_id']),
+    )
     id = Column(Integer, primary_key=True)
-    isbn_10 = Column(Integer) # CONVERT FROM STRING
-    edition_id = Column(String, ForeignKey('editions.id'))
+    edition_id = Column(Integer, ForeignKey('editions.id'))
+    scheme = Column(String) # 'isbn' or 'lccn'
+    value = Column(String)
     edition = relationship("Editions")
 
+class Alias(Base):
+    # edition, work and author ids that Open Library redirected,
+    # each with the id its redirect chain ends at (resolved by
+    # normalization/aliases.py), so a stale id is resolved with
+    # one probe of the primary key. no foreign key, since the
+    # targets are editions, works or authors (whose keys do not
+    # collide, see normalization/ol_ids.py)
+    __tablename__ = 'aliases'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    target_id = Column(Integer, nullable=False)
+
 class Languages(Base):
     # based on languages in fields in editions: language, languages, translated_from; 
     # and works->’original_languages’
     __tablename__ = 'languages'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     language = Column(String)
     editions = relationship("Editions", secondary="editions_languages", back_populates="languages")
     works = relationship("Works", secondary="works_original_languages", back_populates="original_languages")
 
 editions_languages = Table('editions_languages', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('language_id', Integer, ForeignKey('languages.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('language_id', BigInteger, ForeignKey('languages.id'))
 )
 
 edition_translated_from_language = Table('edition_translated_from_language', Base.metadata,
     # from "translated_from"
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('language_id', Integer, ForeignKey('languages.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('language_id', BigInteger, ForeignKey('languages.id'))
 )
 
 class LC_Classifications(Base):
     # based on fields “lc_classifications” AND “lc_classification” 
     # and, from works, “lc_classifications”
     __tablename__ = 'lc_classifications'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     lc_classification = Column(String)
     editions = relationship("Editions", secondary="editions_lc_class", back_populates="lc_classifications")
     works = relationship("Works", secondary="works_lc_class", back_populates="lc_classifications")
 
 editions_lc_class = Table('editions_lc_class', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('lc_classification_id', Integer, ForeignKey('lc_classifications.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('lc_classification_id', BigInteger, ForeignKey('lc_classifications.id'))
 )
 
 class LCCN(Base):
     __tablename__ = 'lccn'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     lccn = Column(String)
     editions = relationship("Editions", secondary="editions_lccn", back_populates="lccn")
 
 editions_lccn = Table('editions_lccn', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('lccn_id', Integer, ForeignKey('lccn.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('lccn_id', BigInteger, ForeignKey('lccn.id'))
 )
 
 class Places(Base):
     # from editions->publish_places and authors->location
     __tablename__ = 'places'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     place = Column(String)
     editions = relationship("Editions", secondary="editions_publish_places", back_populates="publish_places")
     authors = relationship("Authors", secondary="authors_locations", back_populates="locations")
 
 editions_publish_places = Table('editions_publish_places', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('place_id', Integer, ForeignKey('places.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('place_id', BigInteger, ForeignKey('places.id'))
 )
 
 class Publishers(Base):
     __tablename__ = 'publishers'
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (trigram_index('publishers', 'publisher'),)
+    id = Column(BigInteger, primary_key=True)
     publisher = Column(String)
     editions = relationship("Editions", secondary="editions_publishers", back_populates="publishers")
 
 editions_publishers = Table('editions_publishers', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('publisher_id', Integer, ForeignKey('publishers.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('publisher_id', BigInteger, ForeignKey('publishers.id'))
 )
 
 class Series(Base):
     __tablename__ = 'series'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     series = Column(String)
     editions = relationship("Editions", secondary="editions_series", back_populates="series")
 
 editions_series = Table('editions_series', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('series_id', Integer, ForeignKey('series.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('series_id', BigInteger, ForeignKey('series.id'))
 )
 
 class Subjects(Base):
     # from editions and works
     __tablename__ = 'subjects'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     subject = Column(String)
     editions = relationship("Editions", secondary="editions_subjects", back_populates="subjects")
     works = relationship("Works", secondary="works_subjects", back_populates="subjects")
 
 editions_subjects = Table('editions_subjects', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('subject_id', Integer, ForeignKey('subjects.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('subject_id', BigInteger, ForeignKey('subjects.id'))
 )
 
 class Work_Titles(Base):
     __tablename__ = 'work_titles'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     work_title = Column(String)
     editions = relationship("Editions", secondary="editions_work_titles", back_populates="work_titles")
 
 editions_work_titles = Table('editions_work_titles', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('edition_id', String, ForeignKey('editions.id')),
-    Column('work_title_id', Integer, ForeignKey('work_titles.id'))
+    Column('edition_id', Integer, ForeignKey('editions.id')),
+    Column('work_title_id', BigInteger, ForeignKey('work_titles.id'))
 )
 
 # ---------------- AUTHORS ----------------
 
 class Authors(Base):
     __tablename__ = 'authors'
-    id = Column(String, primary_key=True)
+    __table_args__ = (
+        trigram_index('authors', 'name'),
+        trigram_index('authors', 'fuller_name'),
+        trigram_index('authors', 'personal_name'),
+        search_index('authors'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=False)
     created = Column(Date)
     last_modified = Column(Date)
     revision = Column(Integer)
@@ -324,6 +439,11 @@ class Authors(Base):
     date = Column(String)
     entity_type = Column(String) # Combined entity_type and entiy_type
     bio = Column(Text)
+    # kept up to date by postgres on every write, and only loaded when asked for
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(fuller_name, '') || ' ' || coalesce(personal_name, '')), 'B')",
+        persisted=True)))
 
     # assoc tables
     editions = relationship("Editions", secondary="editions_authors", back_populates="authors")
@@ -332,8 +452,8 @@ class Authors(Base):
 
 authors_locations = Table('authors_locations', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('author_id', String, ForeignKey('authors.id')),
-    Column('location_id', Integer, ForeignKey('places.id'))
+    Column('author_id', Integer, ForeignKey('authors.id')),
+    Column('location_id', BigInteger, ForeignKey('places.id'))
 )
 
 # photos
@@ -341,14 +461,14 @@ class Author_Photos(Base):
     __tablename__ = 'authors_photos'
     id = Column(Integer, primary_key=True)
     photo = Column(Integer)
-    author_id = Column(String, ForeignKey('authors.id'))
+    author_id = Column(Integer, ForeignKey('authors.id'))
     author = relationship("Authors")
 
 # ---------------- WORKS ----------------
 
 class Works(Base):
     __tablename__ = 'works'
-    id = Column(String, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=False)
     created = Column(Date)
     last_modified = Column(Date)
     revision = Column(Integer)
@@ -372,8 +492,8 @@ class Works(Base):
     translated_titles = relationship("Translated_Titles", secondary="works_translated_titles", back_populates="works")
 
 works_authors = Table('works_authors', Base.metadata,
-    Column('author_id', String, ForeignKey('authors.id')),
-    Column('work_id', String, ForeignKey('works.id'))
+    Column('author_id', Integer, ForeignKey('authors.id')),
+    Column('work_id', Integer, ForeignKey('works.id'))
 )
 
 class Works_Covers(Base):
@@ -381,57 +501,57 @@ class Works_Covers(Base):
     # from works.covers
     id = Column(Integer, primary_key=True)
     cover = Column(Integer)
-    work_id = Column(String, ForeignKey('works.id'))
+    work_id = Column(Integer, ForeignKey('works.id'))
     work = relationship("Works")
 
 cover_editions = Table('works_cover_editions', Base.metadata,
     # from works.cover_edition
     Column('id', Integer, primary_key=True),
-    Column('work_id', String, ForeignKey('works.id')),
-    Column('edition_id', String, ForeignKey('editions.id'))
+    Column('work_id', Integer, ForeignKey('works.id')),
+    Column('edition_id', Integer, ForeignKey('editions.id'))
 )
 
 class Dewey_Numbers(Base):
     __tablename__ = 'dewey_numbers'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     dewey_number = Column(String)
     works = relationship("Works", secondary="works_dewey_number", back_populates="dewey_number")
 
 works_dewey_number = Table('works_dewey_number', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('work_id', String, ForeignKey('works.id')),
-    Column('dewey_number_id', Integer, ForeignKey('dewey_numbers.id'))
+    Column('work_id', Integer, ForeignKey('works.id')),
+    Column('dewey_number_id', BigInteger, ForeignKey('dewey_numbers.id'))
 )
 
 works_lc_class = Table('works_lc_class', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('work_id', String, ForeignKey('works.id')),
-    Column('lc_classification_id', Integer, ForeignKey('lc_classifications.id'))
+    Column('work_id', Integer, ForeignKey('works.id')),
+    Column('lc_classification_id', BigInteger, ForeignKey('lc_classifications.id'))
 )
 
 works_original_languages = Table('works_original_languages', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('work_id', String, ForeignKey('works.id')),
-    Column('language_id', Integer, ForeignKey('languages.id'))
+    Column('work_id', Integer, ForeignKey('works.id')),
+    Column('language_id', BigInteger, ForeignKey('languages.id'))
 )
 
 class Other_Work_Titles(Base):
     # from works.other_titles
     __tablename__ = 'other_work_titles'
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     other_title = Column(String)
     works = relationship("Works", secondary="works_other_titles", back_populates="other_titles")
 
 works_other_titles = Table('works_other_titles', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('work_id', String, ForeignKey('works.id')),
-    Column('other_work_title_id', Integer, ForeignKey('other_work_titles.id'))
+    Column('work_id', Integer, ForeignKey('works.id')),
+    Column('other_work_title_id', BigInteger, ForeignKey('other_work_titles.id'))
 )
 
 works_subjects = Table('works_subjects', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('work_id', String, ForeignKey('works.id')),
-    Column('subject_id', Integer, ForeignKey('subjects.id'))
+    Column('work_id', Integer, ForeignKey('works.id')),
+    Column('subject_id', BigInteger, ForeignKey('subjects.id'))
 )
 
 class Translated_Titles(Base):
@@ -443,10 +563,24 @@ class Translated_Titles(Base):
 
 works_translated_titles = Table('works_translated_titles', Base.metadata,
     Column('id', Integer, primary_key=True),
-    Column('work_id', String, ForeignKey('works.id')),
+    Column('work_id', Integer, ForeignKey('works.id')),
     Column('translated_title_id', Integer, ForeignKey('translated_titles.id'))
 )
 
+# postgres does not index foreign keys, and the joins through the
+# association tables go both ways, so every foreign key column that
+# does not lead an index or primary key gets one, named the way
+# normalization/load_tables.py names the ones it adds
+def _foreign_key_indexes(metadata):
+    for table in metadata.tables.values():
+        leading = {index.columns[0].name for index in table.indexes}
+        leading |= {column.name for column in list(table.primary_key.columns)[:1]}
+        for column in table.columns:
+            if column.foreign_keys and column.name not in leading:
+                Index(f"{table.name}_{column.name}_idx", column)
+
+_foreign_key_indexes(Base.metadata)
+
 
 if __name__ == '__main__':
     engine = create_engine(DB_URL)
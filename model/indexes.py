@@ -0,0 +1,112 @@
+import argparse
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateIndex
+from model.database import DB_URL, Base
+
+"""
+builds the indexes declared in model/database.py (the foreign
+key indexes and the pg_trgm indexes of the searches) on a live
+database, without blocking the app:
+
+    python -m model.indexes [--db URL] [--dry-run]
+
+each index is built with CREATE INDEX CONCURRENTLY, which
+lets reads and writes of the table go on while it is built,
+one index at a time since concurrent builds cannot run in a
+transaction. indexes that are already there are skipped, so
+the command can be run again after a failure or once new
+indexes are declared. a concurrent build that fails leaves
+an invalid index behind, which is dropped (concurrently too)
+and built again by the next run.
+
+tables that do not exist yet are skipped: load_tables.py
+keeps the indexes of the tables it loads.
+"""
+
+# maintenance_work_mem in MB for each index build
+DEFAULT_INDEX_MEMORY = 1024
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=DB_URL,
+                        help="database url (default DB_URL in model/database.py)")
+    parser.add_argument('--index-memory', type=int, default=DEFAULT_INDEX_MEMORY,
+                        help=f"maintenance_work_mem in MB for each index build (default {DEFAULT_INDEX_MEMORY})")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="print the indexes that would be built, and build none")
+    return parser.parse_args()
+
+def declared_indexes(metadata):
+    """
+    the indexes declared on the tables of metadata
+    """
+    return [index for table in metadata.sorted_tables
+            for index in sorted(table.indexes, key=lambda index: index.name)]
+
+def is_trigram(index):
+    return 'gin_trgm_ops' in index.dialect_options['postgresql']['ops'].values()
+
+def existing_indexes(conn):
+    """
+    index name -> whether it is valid, for the indexes of the public schema
+    """
+    rows = conn.execute(text("""
+        SELECT c.relname, i.indisvalid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relnamespace = 'public'::regnamespace
+    """))
+    return {name: valid for name, valid in rows}
+
+def create_statement(index, dialect):
+    return str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect)) \
+        .replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+
+def build_indexes(conn, indexes, dry_run=False):
+    """
+    build the indexes missing from the database, on a connection
+    in autocommit mode. returns the names of those built and
+    of those that failed
+    """
+    tables = set(inspect(conn).get_table_names())
+    existing = existing_indexes(conn)
+    built = []
+    failed = []
+    for index in indexes:
+        if index.table.name not in tables or existing.get(index.name):
+            continue
+        statement = create_statement(index, conn.dialect)
+        if dry_run:
+            print(statement)
+            continue
+        try:
+            if index.name in existing:
+                # left invalid by a concurrent build that failed
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+            conn.execute(text(statement))
+            built.append(index.name)
+            print(f"built {index.name}")
+        except SQLAlchemyError as e:
+            failed.append(index.name)
+            print(f"building {index.name} failed: {e}")
+    return built, failed
+
+def main():
+    args = parse_args()
+    engine = create_engine(args.db, isolation_level='AUTOCOMMIT')
+    indexes = declared_indexes(Base.metadata)
+    with engine.connect() as conn:
+        try:
+            if not args.dry_run:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except SQLAlchemyError as e:
+            print(f"cannot create the pg_trgm extension, the trigram indexes are skipped: {e}")
+            indexes = [index for index in indexes if not is_trigram(index)]
+        conn.execute(text(f"SET maintenance_work_mem = '{args.index_memory}MB'"))
+        built, failed = build_indexes(conn, indexes, args.dry_run)
+    if not args.dry_run:
+        print(f"{len(built)} indexes built, {len(failed)} failed")
+
+
+if __name__ == '__main__':
+    main()
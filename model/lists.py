@@ -3,7 +3,8 @@ from sqlalchemy import create_engine, and_
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 from model.database import DB_URL, Base, User, Review, List, Editions
-from model.books import get_edition_title_cover_authors
+from model.books import edition_title_cover_authors
+from normalization.ol_ids import encode_id
 
 engine = create_engine(DB_URL)
 
@@ -23,7 +24,7 @@ def list_to_dict(list):
         "creator_name": list.creator.username,
         "description": list.description,
         "title": list.title,
-        "books": [get_edition_title_cover_authors(edition.id) for edition in list.books],
+        "books": [edition_title_cover_authors(edition.id) for edition in list.books],
         "liked_by": [follower_to_dict(user) for user in list.liked_by]
     }
 
@@ -74,8 +75,9 @@ def get_lists(user_name=None, list_name=None, user_id=None, list_id=None, book_i
                 print("incorrect type for list_name")
                 return None
         if book_id:
-            if type(book_id) is not str:
-                print("incorrect type for book id")
+            book_id = encode_id(book_id)
+            if book_id is None:
+                print("incorrect book id")
                 return None
     except ValueError:
         print("incorrect type for search parameters")
@@ -277,8 +279,9 @@ def add_list_book(user_id, list_id, book_id):
     try:
         user_id = int(user_id)
         list_id = int(list_id)
-        if type(book_id) is not str:
-            print("incorrect type for book id")
+        book_id = encode_id(book_id)
+        if book_id is None:
+            print("incorrect book id")
             return None
     except ValueError:
         print("incorrect type for user or list id")
@@ -328,8 +331,9 @@ def remove_list_book(user_id, list_id, book_id):
     try:
         user_id = int(user_id)
         list_id = int(list_id)
-        if type(book_id) is not str:
-            print("incorrect type for book id")
+        book_id = encode_id(book_id)
+        if book_id is None:
+            print("incorrect book id")
             return None
     except ValueError:
         print("incorrect type for user or list id")
@@ -0,0 +1,163 @@
+import argparse
+from sqlalchemy import create_engine, text
+from model.database import DB_URL, RATINGS, Edition_Ratings, Work_Ratings, editions_works
+
+"""
+the rating aggregates of editions and works: the count, the
+sum and the histogram of the ratings of their reviews, so a
+book page or a page of search results reads its ratings with
+a primary key probe per edition instead of averaging reviews.
+
+create_review, update_review and delete_review (and delete_user,
+for the reviews it deletes) count the ratings they add or take
+back with add_rating, in the transaction that writes the review,
+so the aggregates change exactly when the reviews do. each
+change is an upsert of the row, which concurrent reviews of
+the same edition or work wait for rather than overwrite.
+
+a work's aggregates are those of its editions' reviews, through
+editions_works as it was when each review was written. the dump
+has editions of works that are not in works (the catalog foreign
+keys are NOT VALID), which have no aggregates: their reviews count
+for the edition alone. after a
+load or delta that moves editions between works, or to create
+the aggregates of a database that already has reviews, rebuild
+them from the reviews:
+
+    python -m model.ratings [--db URL]
+"""
+
+_UPDATE = """rating_count = r.rating_count + :sign,
+             rating_sum = r.rating_sum + :sign * :rating,
+             histogram[:slot] = r.histogram[:slot] + :sign"""
+
+# a review of an edition or work without ratings inserts them,
+# with its rating alone
+_ADD_EDITION = text(f"""
+    INSERT INTO edition_ratings AS r (edition_id, rating_count, rating_sum, histogram)
+    VALUES (:edition_id, 1, :rating, CAST(:histogram AS integer[]))
+    ON CONFLICT (edition_id) DO UPDATE SET {_UPDATE}
+""")
+
+_ADD_WORKS = text(f"""
+    INSERT INTO work_ratings AS r (work_id, rating_count, rating_sum, histogram)
+    SELECT DISTINCT ew.work_id, 1, :rating, CAST(:histogram AS integer[])
+    FROM editions_works ew
+    JOIN works w ON w.id = ew.work_id
+    WHERE ew.edition_id = :edition_id
+    ORDER BY ew.work_id
+    ON CONFLICT (work_id) DO UPDATE SET {_UPDATE}
+""")
+
+_REMOVE_EDITION = text(f"""
+    UPDATE edition_ratings r SET {_UPDATE}
+    WHERE r.edition_id = :edition_id
+""")
+
+_REMOVE_WORKS = text(f"""
+    UPDATE work_ratings r SET {_UPDATE}
+    WHERE r.work_id IN (SELECT work_id FROM editions_works WHERE edition_id = :edition_id)
+""")
+
+def add_rating(session, edition_id, rating, sign=1):
+    """
+    count (sign 1) or take back (sign -1) a review's rating in
+    the aggregates of its edition and of the edition's works,
+    in the session's transaction
+    """
+    if rating is None:
+        return
+    histogram = [0] * len(RATINGS)
+    histogram[rating] = 1
+    params = {'edition_id': edition_id, 'rating': rating, 'slot': rating + 1,
+              'sign': sign, 'histogram': histogram}
+    if sign > 0:
+        statements = [_ADD_EDITION, _ADD_WORKS]
+    else:
+        statements = [_REMOVE_EDITION, _REMOVE_WORKS]
+    for statement in statements:
+        session.execute(statement, params)
+
+def rating_dict(aggregate, prefix=''):
+    """
+    the average rating and the number of ratings of an
+    Edition_Ratings or Work_Ratings row (or None), as keys of
+    an edition dict
+    """
+    if aggregate is None or not aggregate.rating_count:
+        return {f'{prefix}average_rating': None, f'{prefix}rating_count': 0}
+    return {
+        f'{prefix}average_rating': float(f"{aggregate.rating_sum / aggregate.rating_count:.2f}"),
+        f'{prefix}rating_count': aggregate.rating_count
+    }
+
+def edition_ratings(session, edition_ids):
+    """
+    edition id -> its Edition_Ratings, for the editions with ratings
+    """
+    rows = session.query(Edition_Ratings)\
+                    .filter(Edition_Ratings.edition_id.in_(edition_ids))\
+                    .all()
+    return {row.edition_id: row for row in rows}
+
+def work_ratings(session, edition_ids):
+    """
+    edition id -> the Work_Ratings of its work, for the editions
+    whose work has ratings (the most rated work, if several)
+    """
+    rows = session.query(editions_works.c.edition_id, Work_Ratings)\
+                    .join(Work_Ratings, Work_Ratings.work_id == editions_works.c.work_id)\
+                    .filter(editions_works.c.edition_id.in_(edition_ids))\
+                    .all()
+    result = {}
+    for edition_id, row in rows:
+        if edition_id not in result or row.rating_count > result[edition_id].rating_count:
+            result[edition_id] = row
+    return result
+
+def _aggregates(key):
+    histogram = ", ".join(f"count(*) FILTER (WHERE rv.rating = {rating})" for rating in RATINGS)
+    return f"{key}, count(*), sum(rv.rating), ARRAY[{histogram}]"
+
+def rebuild(conn):
+    """
+    recompute the aggregates from the reviews, on a connection
+    in a transaction. the reviews written meanwhile wait for it
+    to commit and are then counted as usual
+    """
+    conn.execute(text("TRUNCATE edition_ratings, work_ratings"))
+    conn.execute(text(f"""
+        INSERT INTO edition_ratings (edition_id, rating_count, rating_sum, histogram)
+        SELECT {_aggregates('rv.book_id')}
+        FROM reviews rv
+        WHERE rv.rating IS NOT NULL AND rv.book_id IS NOT NULL
+        GROUP BY rv.book_id
+    """))
+    conn.execute(text(f"""
+        INSERT INTO work_ratings (work_id, rating_count, rating_sum, histogram)
+        SELECT {_aggregates('ew.work_id')}
+        FROM reviews rv
+        JOIN (SELECT DISTINCT edition_id, work_id FROM editions_works) ew ON ew.edition_id = rv.book_id
+        JOIN works w ON w.id = ew.work_id
+        WHERE rv.rating IS NOT NULL
+        GROUP BY ew.work_id
+    """))
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=DB_URL,
+                        help="database url (default DB_URL in model/database.py)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    engine = create_engine(args.db)
+    with engine.begin() as conn:
+        rebuild(conn)
+        editions = conn.execute(text("SELECT count(*) FROM edition_ratings")).scalar()
+        works = conn.execute(text("SELECT count(*) FROM work_ratings")).scalar()
+    print(f"rebuilt the ratings of {editions} editions and {works} works")
+
+
+if __name__ == '__main__':
+    main()
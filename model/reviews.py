@@ -5,7 +5,9 @@ from sqlalchemy import create_engine, and_
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 from model.database import DB_URL, Base, User, Review, List, Editions, Authors
-from model.books import get_edition_title_cover_authors
+from model.books import edition_title_cover_authors
+from normalization.ol_ids import encode_id, decode_id
+from model.ratings import add_rating
 
 engine = create_engine(DB_URL)
 
@@ -23,7 +25,7 @@ def review_to_dict(review):
         "review_id": review.review_id,
         "reviewer_id": review.reviewer_id,
         "reviewer_username": review.reviewer.username if review.reviewer else None,
-        "book_id": review.book_id,
+        "book_id": decode_id(review.book_id),
         "book_name": review.book_title,
         "book_cover": review.book_cover,
         "book_authors": review.author_names,
@@ -39,7 +41,7 @@ def user_review_to_dict(review):
     """
     return {
         "review_id": review.review_id,
-        "book_id": review.book_id,
+        "book_id": decode_id(review.book_id),
         "book_title": review.book_title,
         "author_names": review.author_names,
         "rating": review.rating,
@@ -62,8 +64,9 @@ def get_reviews(user_id=None, book_id=None, review_id=None, limit=100):
         if review_id:
             review_id = int(review_id)
         if book_id:
-            if type(book_id) is not str:
-                print("incorrect type for book id")
+            book_id = encode_id(book_id)
+            if book_id is None:
+                print("incorrect book id")
                 return None
     except ValueError:
         print("incorrect type for search parameters")
@@ -160,8 +163,9 @@ def create_review(book_id, user_id, summary, rating, note=None):
     """
     try:
         user_id = int(user_id)
-        if type(book_id) is not str:
-            print("incorrect type for book id")
+        book_id = encode_id(book_id)
+        if book_id is None:
+            print("incorrect book id")
             return None
     except ValueError:
         print("incorrect type for user id")
@@ -197,7 +201,7 @@ def create_review(book_id, user_id, summary, rating, note=None):
             print("create review failed: incorrect book id")
             return None
         
-        edition_info = get_edition_title_cover_authors(edition.id)
+        edition_info = edition_title_cover_authors(edition.id)
         
         new_review = Review(
             reviewer_id=user.user_id, 
@@ -216,6 +220,7 @@ def create_review(book_id, user_id, summary, rating, note=None):
                 new_review.summary = summary
         
         session.add(new_review)
+        add_rating(session, edition.id, rating)
         session.commit()
 
         print(f"New review created: {new_review.review_id}")
@@ -270,7 +275,10 @@ def update_review(review_id, user_id, summary=None, rating=None):
             print(f"Review {review_id} does not exist.")
             return None
         
-        if rating:
+        if rating and rating != review.rating:
+            # take back the old rating and count the new one
+            add_rating(session, review.book_id, review.rating, -1)
+            add_rating(session, review.book_id, rating)
             review.rating = rating
 
         if summary:
@@ -312,6 +320,7 @@ def delete_review(review_id):
 
         review = session.query(Review).filter(Review.review_id==review_id).first()
         if review:
+            add_rating(session, review.book_id, review.rating, -1)
             session.delete(review)
             session.commit()
             print(f"Review {review_id} deleted successfully.")
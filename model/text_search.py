@@ -0,0 +1,98 @@
+import re
+from sqlalchemy import func
+from model.database import SEARCH_CONFIG
+
+"""
+the keyword (full text) search of editions and authors: turns
+what a user types into a postgres tsquery, matched against the
+search_vector columns of editions_search and authors (see
+model/database.py) and ranked with ts_rank.
+
+the query syntax is the one of a web search:
+    lightness being     both words, anywhere
+    "lightness of"      the words next to each other, in order
+    light*              words starting with light
+    -novel              not the word novel
+    kundera or hrabal   either word
+
+words are stemmed and stop words dropped ('english'), the
+same way as the documents, so 'novels' finds 'novel'. unlike
+websearch_to_tsquery, prefixes are understood, and a query
+with nothing but exclusions is no query at all (None) rather
+than a scan of every row. a query of stop words only is left
+to postgres, which makes it an empty tsquery matching nothing.
+"""
+
+# a quoted phrase (the closing quote may be missing) or a word,
+# either one possibly excluded with a leading -
+_TOKEN = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+_WORD = re.compile(r'\w+')
+
+def _lexemes(text, prefix=False):
+    """
+    the tsquery of the words of text next to each other,
+    the last one as a prefix if prefix, or None if no words
+    """
+    words = _WORD.findall(text)
+    if not words:
+        return None
+    lexemes = [f"'{word}'" for word in words]
+    if prefix:
+        lexemes[-1] += ':*'
+    if len(lexemes) == 1:
+        return lexemes[0]
+    return '(' + ' <-> '.join(lexemes) + ')'
+
+def parse_query(text):
+    """
+    the tsquery (as text, for to_tsquery) of a keyword search,
+    or None if it has no word to look for
+    """
+    if not text:
+        return None
+    # each clause is a list of alternatives (joined by or),
+    # and the clauses must all match
+    clauses = []
+    alternative = False
+    for negated, phrase, word in _TOKEN.findall(text):
+        if word and word.lower() == 'or':
+            alternative = bool(clauses)
+            continue
+        if word.startswith('-') and len(word) > 1:
+            negated, word = '-', word[1:]
+        if word:
+            term = _lexemes(word, prefix=word.endswith('*'))
+        else:
+            term = _lexemes(phrase)
+        if term is None:
+            continue
+        if negated:
+            term = '!' + term
+        if alternative:
+            clauses[-1].append(term)
+        else:
+            clauses.append([term])
+        alternative = False
+
+    # exclusions on their own would match nearly every row
+    if all(term.startswith('!') for alternatives in clauses for term in alternatives):
+        return None
+    return ' & '.join(alternatives[0] if len(alternatives) == 1 else '(' + ' | '.join(alternatives) + ')'
+                      for alternatives in clauses)
+
+def to_tsquery(text):
+    """
+    the tsquery expression of a keyword search, or None (see parse_query)
+    """
+    parsed = parse_query(text)
+    if parsed is None:
+        return None
+    return func.to_tsquery(SEARCH_CONFIG, parsed)
+
+def rank(vector, tsquery):
+    """
+    the relevance of a match, divided by 1 + the log of the
+    document length so that a short title matching every word
+    ranks above a long one that mentions them in passing
+    """
+    return func.ts_rank(vector, tsquery, 1)
@@ -5,6 +5,7 @@ from sqlalchemy.orm import sessionmaker
 from model.database import Base, User, Review, List, user_follower_association, DB_URL
 from model.reviews import user_review_to_dict
 from model.lists import user_list_to_dict
+from model.ratings import add_rating
 import re
 
 engine = create_engine(DB_URL)
@@ -672,6 +673,9 @@ def delete_user(user_id):
 
         user = session.query(User).filter(User.user_id == user_id).first()
         if user:
+            # the user's reviews are deleted with them
+            for review in user.reviews:
+                add_rating(session, review.book_id, review.rating, -1)
             session.delete(user)
             session.commit()
             print(f"User {user_id} deleted successfully.")
@@ -0,0 +1,88 @@
+import argparse
+import compressed
+
+"""
+builds the aliases table from the redirects.csv written by
+the parsers (see parse_redirects.py): each redirected id
+with the id it ends up at once the redirect chain is
+followed, so the app finds the current record of an old
+id with a single probe of the aliases primary key.
+
+a chain ends at the first id that is not redirected, which
+is usually a record of the dump (and may not be, as with
+other references in the dump). chains ending at a deleted
+record, or going round in a cycle, lead nowhere and are
+left out, along with the deleted records themselves.
+"""
+
+def read_redirects(filename):
+    """
+    id -> target id ('' if deleted) of a redirects csv
+    """
+    redirects = {}
+    with compressed.open_read(filename, newline='\n') as file:
+        for line in file:
+            key, _, target = line.rstrip('\n').partition('\t')
+            if key:
+                redirects[key] = target
+    return redirects
+
+def resolve(redirects):
+    """
+    id -> the id its redirect chain ends at, or None if it ends
+    at a deleted record or in a cycle
+    """
+    final = {}
+    for key in redirects:
+        chain = []
+        seen = set()
+        target = key
+        while target in redirects and target not in final:
+            if target in seen:
+                # a cycle: nothing on it or leading to it resolves
+                target = None
+                break
+            seen.add(target)
+            chain.append(target)
+            target = redirects[target] or None
+            if target is None:
+                break
+        if target is not None and target in final:
+            target = final[target]
+        for step in chain:
+            final[step] = target
+    return final
+
+def write_aliases(redirects_file, aliases_file, codec=None):
+    """
+    write the (id, target id) rows of the ids with a target,
+    returning (aliases written, ids left out)
+    """
+    compressed.set_codec(codec)
+    final = resolve(read_redirects(redirects_file))
+    written = 0
+    with compressed.create(aliases_file) as out:
+        for key, target in final.items():
+            if target is not None:
+                out.write(f"{key}\t{target}\n")
+                written += 1
+    return written, len(final) - written
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default="redirects.csv",
+                        help="redirects csv written by the parsers (default redirects.csv)")
+    parser.add_argument('--output', default="aliases.csv",
+                        help="aliases csv to write (default aliases.csv)")
+    parser.add_argument('--compress', choices=list(compressed.CODECS), default=None,
+                        help="write the csv compressed (zstd needs the zstandard package)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    written, dropped = write_aliases(args.input, args.output, args.compress)
+    print(f"{args.output}: {written} aliases, {dropped} deleted or unresolvable ids left out")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+import argparse
+import io
+import time
+from utils import remove_special_char, decode_json
+from ol_ids import encode_id
+from parse_editions import OUTPUTS, extract
+
+"""
+benchmarks the fieldmap extractor for editions against
+the hand written if/else extractor it replaced, on the
+first --records edition lines of the dump. both write to
+in memory files, so this times extraction only (the json
+is decoded once up front), and checks the outputs match.
+"""
+
+def legacy_extract(data, out):
+    """
+    the per field write version of parse_editions, as it
+    was before the fieldmap spec (writing the integer keys
+    of ol_ids.py, as the spec now does)
+    """
+    f_editions = out['editions']
+    f_covers = out['covers']
+    f_authors = out['authors']
+    f_contributors = out['contributors']
+    f_genres = out['genres']
+    f_languages = out['languages']
+    f_lc_classifications = out['lc_classifications']
+    f_lccn = out['lccn']
+    f_publish_places = out['publish_places']
+    f_publishers = out['publishers']
+    f_series = out['series']
+    f_work_titles = out['work_titles']
+    f_works = out['works']
+    f_subjects = out['subjects']
+    f_isbn10 = out['isbn10']
+    f_isbn13 = out['isbn13']
+
+    if 'key' in data:
+        edition = encode_id(data['key'])
+        if edition is not None:
+            f_editions.write(f"{edition}")
+        else:
+            return
+    else:
+        return
+
+    if 'created' in data:
+        f_editions.write(f"\t{remove_special_char(data['created']['value'])}")
+    else:
+        f_editions.write("\t")
+        
+    if 'last_modified' in data:
+        f_editions.write(f"\t{remove_special_char(data['last_modified']['value'])}")
+    else:
+        f_editions.write("\t")
+
+    if 'revision' in data:
+        f_editions.write(f"\t{remove_special_char(data['revision'])}")
+    else:
+        f_editions.write("\t")
+
+    if 'latest_revision' in data:
+        f_editions.write(f"\t{remove_special_char(data['latest_revision'])}")
+    else:
+        f_editions.write("\t")
+
+    if 'title' in data:
+        title = remove_special_char(data['title'])
+        f_editions.write(f"\t{title}")
+    else:
+        f_editions.write("\t")
+
+    if 'subtitle' in data:
+        subtitle = remove_special_char(data['subtitle'])                                            
+        f_editions.write(f"\t{subtitle}")
+    else:
+        f_editions.write("\t")
+
+    if 'title_prefix' in data:
+        f_editions.write(f"\t{remove_special_char(data['title_prefix'])}")
+    else:
+        f_editions.write("\t")
+    
+    if 'full_title' in data:
+        full_title = remove_special_char(data['full_title'])
+        f_editions.write(f"\t{full_title}")
+    else:
+        f_editions.write("\t")
+    
+    if 'copyright_date' in data:
+        f_editions.write(f"\t{remove_special_char(data['copyright_date'])}")
+    else:
+        f_editions.write("\t")
+    
+    if 'publish_date' in data:
+        f_editions.write(f"\t{remove_special_char(data['publish_date'])}")
+    else:
+        f_editions.write("\t")
+        
+    if 'by_statement' in data:
+        f_editions.write(f"\t{remove_special_char(data['by_statement'])}")
+    else:
+        f_editions.write("\t")
+        
+    if 'edition_name' in data:
+        f_editions.write(f"\t{remove_special_char(data['edition_name'])}")
+    else:
+        f_editions.write("\t")
+
+    if 'volume_number' in data:
+        f_editions.write(f"\t{remove_special_char(data['volume_number'])}")
+    else:
+        f_editions.write("\t")
+    
+    try:
+        if 'description' in data:
+            if isinstance(data['description'], dict) and 'value' in data['description']:
+                desc = remove_special_char(data['description']['value'])
+                f_editions.write(f"\t{desc}")
+            else:
+                desc = remove_special_char(data['description'])
+                f_editions.write(f"\t{desc}")
+        else:
+            f_editions.write("\t")
+    except:
+        f_editions.write("\t")
+        print("Error in description\n")
+        print(data)
+    
+    try:
+        if 'notes' in data:
+            if isinstance(data['notes'], dict) and 'value' in data['notes']:
+                notes = remove_special_char(data['notes']['value'])
+
+                f_editions.write(f"\t{notes}")
+            else:
+                notes = remove_special_char(data['notes'])
+                f_editions.write(f"\t{notes}")
+        else:
+            f_editions.write("\t")
+    except:
+        f_editions.write("\t")
+        print("Error in notes\n")
+        print(data)
+    
+    
+    if 'number_of_pages' in data:
+        f_editions.write(f"\t{remove_special_char(data['number_of_pages'])}")
+    else:
+        f_editions.write("\t")
+    
+    if 'pagination' in data:
+        f_editions.write(f"\t{remove_special_char(data['pagination'])}")
+    else:
+        f_editions.write("\t")
+        
+    if 'translation_of' in data:
+        f_editions.write(f"\t{remove_special_char(data['translation_of'])}")
+    else:
+        f_editions.write("\t")
+
+    if 'dewey_decimal_class' in data:
+        f_editions.write(f"\t{remove_special_char(data['dewey_decimal_class'])}")
+    else:
+        f_editions.write("\t")
+        
+    f_editions.write("\n")
+    
+    if 'covers' in data:
+        for c in data['covers']:
+            f_covers.write(f"{edition}\t{remove_special_char(c)}\n")
+    
+    try:
+        if 'authors' in data:
+            for a in data['authors']:
+                if 'key' in a and encode_id(a['key']) is not None:
+                    aid = encode_id(a['key'])
+                    f_authors.write(f"{edition}\t{remove_special_char(aid)}\n")
+    except:
+        print("Error in authors\n")
+        print(data)
+
+    if 'contributors' in data:
+        for c in data['contributors']:
+            if 'name' in c:
+                f_contributors.write(f"{edition}\t{remove_special_char(c['name'])}\n")
+    
+    if 'genres' in data:
+        for g in data['genres']:
+            f_genres.write(f"{edition}\t{remove_special_char(g)}\n")
+    
+    if 'languages' in data:
+        for l in data['languages']:
+            if 'key' in l:
+                f_languages.write(f"{edition}\t{remove_special_char(l['key'])}\n")
+    if 'lc_classifications' in data:
+        for lc in data['lc_classifications']:
+            f_lc_classifications.write(f"{edition}\t{remove_special_char(lc)}\n")
+    
+    if 'lccn' in data:
+        for lc in data['lccn']:
+            f_lccn.write(f"{edition}\t{remove_special_char(lc)}\n")
+    
+    if 'publish_places' in data:
+        for pp in data['publish_places']:
+            f_publish_places.write(f"{edition}\t{remove_special_char(pp)}\n")
+    
+    if 'publishers' in data:
+        for pp in data['publishers']:
+            f_publishers.write(f"{edition}\t{remove_special_char(pp)}\n")
+        
+
+    skipnext = False
+    if 'series' in data:
+        for i in range(len(data['series'])):
+            if skipnext:
+                skipnext = False
+                continue
+            if i==(len(data['series'])-1):
+                f_series.write(f"{edition}\t{remove_special_char(data['series'][i])}\n")
+                continue
+            numbers = sum(c.isdigit() for c in data['series'][i+1])
+            letters = sum(c.isalpha() for c in data['series'][i+1])
+            if numbers > 1 or (numbers==1 and letters < 5 ):
+                f_series.write(f"{edition}\t{remove_special_char(data['series'][i])} {remove_special_char(data['series'][i+1])}\n")
+                skipnext = True
+            else:
+                f_series.write(f"{edition}\t{remove_special_char(data['series'][i])}\n")
+            
+    if 'subjects' in data:
+        for s in data['subjects']:
+            f_subjects.write(f"{edition}\t{remove_special_char(s)}\n")
+            
+    if 'isbn_10' in data:
+        for i10 in data['isbn_10']:
+            f_isbn10.write(f"{edition}\t{remove_special_char(i10)}\n")
+            
+    if 'isbn_13' in data:
+        for i13 in data['isbn_13']:
+            f_isbn13.write(f"{edition}\t{remove_special_char(i13)}\n")
+
+            
+    if 'work_titles' in data:
+        for wt in data['work_titles']:
+            f_work_titles.write(f"{edition}\t{remove_special_char(wt)}\n")
+    
+    if 'works' in data:
+        for w in data['works']:
+            if 'key' in w and encode_id(w['key']) is not None:
+                wk = encode_id(w['key'])
+                f_works.write(f"{edition}\t{remove_special_char(wk)}\n")
+
+def load_records(path, n):
+    records = []
+    with open(path, 'r') as file:
+        for line in file:
+            if not line.startswith("/type/edition\t"):
+                continue
+            try:
+                records.append(decode_json(line.split('\t')[-1]))
+            except Exception:
+                continue
+            if len(records) >= n:
+                break
+    return records
+
+def time_extractor(fn, records, repeat):
+    best = None
+    for _ in range(repeat):
+        out = {name: io.StringIO() for name in OUTPUTS}
+        start = time.perf_counter()
+        for data in records:
+            try:
+                fn(data, out)
+            except Exception:
+                pass
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, {name: buf.getvalue() for name, buf in out.items()}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default="../ol_dump_latest.txt")
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    records = load_records(args.input, args.records)
+    print(f"{len(records)} edition records")
+
+    legacy_seconds, legacy_out = time_extractor(legacy_extract, records, args.repeat)
+    spec_seconds, spec_out = time_extractor(extract, records, args.repeat)
+
+    for name, seconds in [('hand written', legacy_seconds), ('fieldmap', spec_seconds)]:
+        print(f"{name:>12}: {seconds:.3f}s, {len(records) / seconds:.0f} records/s")
+    print(f"speedup: {legacy_seconds / spec_seconds:.2f}x")
+
+    differing = [name for name in OUTPUTS if legacy_out[name] != spec_out[name]]
+    if differing:
+        print("outputs differ for:", ", ".join(differing))
+    else:
+        print("outputs match")
+
+
+if __name__ == '__main__':
+    main()
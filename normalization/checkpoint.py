@@ -0,0 +1,90 @@
+import json
+import os
+import time
+
+"""
+checkpoints of a parse, so a run that dies part way can
+be resumed (--resume) instead of started over.
+
+a checkpoint is taken between lines: every output file is
+flushed and fsynced, and its size is saved along with the
+position in the input. resuming truncates the outputs back
+to those sizes, dropping whatever was written after the
+checkpoint, and continues from that position.
+
+the checkpoint is a json file next to the outputs, written
+atomically, and removed once the run finishes
+"""
+
+# seconds between checkpoints
+CHECKPOINT_SECONDS = 60
+
+def sync(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+def _input_id(path):
+    stat = os.stat(path)
+    return {'input': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+class Checkpoint:
+    """
+    the checkpoint file of one parse of input_path with the
+    given settings (a dict of the options that change the output)
+    """
+    def __init__(self, path, input_path, settings, seconds=CHECKPOINT_SECONDS):
+        self.path = path
+        self.input_path = input_path
+        self.settings = settings
+        self.seconds = seconds
+        self.last = time.monotonic()
+
+    def due(self):
+        return self.seconds > 0 and time.monotonic() - self.last >= self.seconds
+
+    def load(self):
+        """
+        the saved state, or None if there is no checkpoint.
+        raises ValueError if it is for another input or other
+        settings (e.g. --intern)
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as file:
+            saved = json.load(file)
+        if saved['source'] != _input_id(self.input_path):
+            raise ValueError(f"{self.path} is for another input file ({saved['source'].get('input')})")
+        if saved['settings'] != self.settings:
+            raise ValueError(f"{self.path} was taken with {saved['settings']}, not {self.settings}")
+        return saved['state']
+
+    def save(self, state, files=None):
+        """
+        save state, after flushing files (filename -> file)
+        to disk and recording their sizes in state['files']
+        """
+        if files is not None:
+            sizes = {}
+            for filename, file in files.items():
+                sync(file)
+                sizes[filename] = os.fstat(file.fileno()).st_size
+            state = dict(state, files=sizes)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump({'source': _input_id(self.input_path), 'settings': self.settings, 'state': state}, file)
+            sync(file)
+        os.replace(tmp, self.path)
+        self.last = time.monotonic()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def truncate(state):
+    """
+    cut the files saved in state back to their checkpointed size
+    """
+    for filename, size in state.get('files', {}).items():
+        if not os.path.exists(filename) or os.path.getsize(filename) < size:
+            raise ValueError(f"{filename} is shorter than at the checkpoint")
+        os.truncate(filename, size)
@@ -0,0 +1,222 @@
+import io
+import os
+import queue
+import threading
+import zlib
+from dump_reader import open_in_thread
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+compressed intermediate csvs (--compress gzip or zstd).
+
+the scripts keep naming the csvs as before (editions.csv);
+with a codec set, the file behind a name is the name plus
+the codec's suffix (editions.csv.zst). path() is the file
+to write for a name and find() the file to read, whichever
+of the plain and compressed ones is there, so a later step
+reads the csvs of an earlier one however they were written.
+
+the text written to a CompressedWriter is compressed and
+written on a background thread (zlib and zstandard release
+the GIL while compressing), so compression does not slow
+the parser down unless it falls behind. flush() ends the
+gzip member or zstd frame: the file is complete up to there,
+which the checkpoints rely on (see checkpoint.py), and
+files can be concatenated (the shards of parallel.py).
+reading decompresses on a background thread as well (see
+dump_reader.open_in_thread).
+"""
+
+# codec -> file suffix
+CODECS = {'gzip': '.gz', 'zstd': '.zst'}
+# fast levels: these are temporary files
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+# size of each chunk handed to the compressing thread
+CHUNK_SIZE = 1024 * 1024
+# chunks that may wait for the thread before write() blocks
+QUEUE_CHUNKS = 8
+# the csvs are short tab separated values, which compress about
+# this well; used to guess the size of a csv from its compressed file
+EXPANSION = 5
+
+# codec of the files written, see set_codec
+_codec = None
+
+_FLUSH = object()
+
+def available(codec):
+    return codec == 'gzip' or (codec == 'zstd' and zstandard is not None)
+
+def set_codec(codec):
+    """
+    compress the files written from now on with codec ('gzip',
+    'zstd' or None for plain files)
+    """
+    global _codec
+    _codec = codec
+
+def codec():
+    return _codec
+
+def path(filename):
+    """
+    the file to write for filename
+    """
+    return filename + CODECS[_codec] if _codec else filename
+
+def find(filename):
+    """
+    the file holding filename: filename itself or its compressed
+    file, or filename if there is neither
+    """
+    if os.path.exists(filename):
+        return filename
+    for suffix in CODECS.values():
+        if os.path.exists(filename + suffix):
+            return filename + suffix
+    return filename
+
+def is_compressed(filename):
+    return os.path.splitext(filename)[1] in CODECS.values()
+
+def estimated_size(filename):
+    """
+    about how many bytes of csv filename (a path from find) holds
+    """
+    size = os.path.getsize(filename)
+    return size * EXPANSION if is_compressed(filename) else size
+
+def open_read(filename, newline=None):
+    """
+    open the file holding filename as text, decompressing it if needed
+    """
+    filename = find(filename)
+    if not is_compressed(filename):
+        return open(filename, 'r', newline=newline)
+    return io.TextIOWrapper(open_in_thread(filename), encoding='utf-8', newline=newline)
+
+def open_binary(filename):
+    """
+    open the file holding filename as a binary stream of its
+    (decompressed) bytes, e.g. for COPY
+    """
+    filename = find(filename)
+    if not is_compressed(filename):
+        return open(filename, 'rb')
+    return open_in_thread(filename)
+
+def open_write(filename, mode="w"):
+    """
+    a CompressedWriter for filename, or None if no codec is set
+    """
+    if not _codec:
+        return None
+    return CompressedWriter(path(filename), mode, _codec)
+
+def create(filename):
+    """
+    open filename for writing as text, compressed if a codec is set
+    """
+    return open_write(filename) or open(filename, 'w')
+
+def _compressor(codec):
+    if codec == 'gzip':
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+class CompressedWriter:
+    """
+    text file-like object writing what is written to it to
+    the file at path, compressed on a background thread
+    """
+    def __init__(self, path, mode="w", codec='gzip'):
+        self.path = path
+        self.codec = codec
+        self.file = open(path, mode + "b")
+        self.chunks = queue.Queue(QUEUE_CHUNKS)
+        self.buffer = []
+        self.buffered = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._compress, daemon=True)
+        self.thread.start()
+
+    def _compress(self):
+        compressor = None
+        while True:
+            chunk = self.chunks.get()
+            try:
+                # after an error the chunks are only drained
+                if self.error is not None:
+                    pass
+                elif chunk is None or chunk is _FLUSH:
+                    # end the member/frame, if anything was written since the last one
+                    # (a file with nothing written still gets an empty one, for gunzip)
+                    if compressor is None and chunk is None and self.file.tell() == 0:
+                        compressor = _compressor(self.codec)
+                    if compressor is not None:
+                        self.file.write(compressor.flush())
+                        compressor = None
+                    self.file.flush()
+                else:
+                    if compressor is None:
+                        compressor = _compressor(self.codec)
+                    self.file.write(compressor.compress(chunk))
+            except Exception as e:
+                self.error = e
+            finally:
+                self.chunks.task_done()
+            if chunk is None:
+                return
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError(f"compressing {self.path} failed: {self.error}")
+
+    def _push(self):
+        if self.buffer:
+            self.chunks.put(''.join(self.buffer).encode('utf-8'))
+            self.buffer = []
+            self.buffered = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= CHUNK_SIZE:
+            self._check()
+            self._push()
+        return len(text)
+
+    def flush(self):
+        """
+        compress and write everything written so far
+        """
+        self._push()
+        self.chunks.put(_FLUSH)
+        self.chunks.join()
+        self._check()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.thread is None:
+            return
+        try:
+            self._push()
+            self.chunks.put(None)
+            self.thread.join()
+            self._check()
+        finally:
+            self.thread = None
+            self.file.close()
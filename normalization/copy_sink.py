@@ -0,0 +1,252 @@
+import os
+import queue
+import threading
+import pg
+
+"""
+streams parsed rows straight into postgres with
+COPY ... FROM STDIN instead of writing them to csv.
+
+each target table gets its own connection and a CopyWriter,
+a file-like object the parsers write to as usual. written
+text is batched into chunks and handed to a background
+thread running the COPY through a bounded queue, so memory
+stays bounded and the parser blocks (backpressure) when the
+database falls behind.
+
+only the csvs that need no normalization are streamed
+(see COPY_TARGETS), unless the run interns the list fields
+(--intern), which streams the normalization and association
+tables too; otherwise those are still written as csv.
+"""
+
+# size of each chunk handed to the COPY thread
+CHUNK_SIZE = 256 * 1024
+# chunks that may wait in the queue before write() blocks
+QUEUE_CHUNKS = 32
+
+# csv (by file name) -> (table, columns) in model/database.py
+COPY_TARGETS = {
+    'editions.csv': ('editions', ['id', 'created', 'last_modified', 'revision', 'latest_revision',
+                                  'title', 'subtitle', 'title_prefix', 'full_title', 'copyright_date',
+                                  'publish_date', 'by_statement', 'edition_name', 'volume_number',
+                                  'description', 'notes', 'number_of_pages', 'pagination',
+                                  'translation_of', 'dewey_decimal_class']),
+    'works.csv': ('works', ['id', 'created', 'last_modified', 'revision', 'latest_revision', 'title',
+                            'subtitle', 'first_publish_date', 'description', 'number_of_editions']),
+    'authors.csv': ('authors', ['id', 'created', 'last_modified', 'revision', 'latest_revision', 'name',
+                                'fuller_name', 'personal_name', 'birth_date', 'death_date', 'date',
+                                'entity_type', 'bio']),
+    'editions_authors.csv': ('editions_authors', ['edition_id', 'author_id']),
+    'editions_works.csv': ('editions_works', ['edition_id', 'work_id']),
+    'editions_covers.csv': ('editions_covers', ['edition_id', 'cover']),
+    'editions_identifiers.csv': ('identifiers', ['edition_id', 'scheme', 'value']),
+    'editions_isbn_10.csv': ('editions_isbn_10', ['edition_id', 'isbn_10']),
+    'editions_isbn_13.csv': ('editions_isbn_13', ['edition_id', 'isbn_13']),
+    'works_authors.csv': ('works_authors', ['work_id', 'author_id']),
+    'works_covers.csv': ('works_covers', ['work_id', 'cover']),
+    'works_cover_editions.csv': ('works_cover_editions', ['work_id', 'edition_id']),
+    'authors_photos.csv': ('authors_photos', ['author_id', 'photo']),
+    # written by normalize.py or aliases.py (see aliases.py)
+    'aliases.csv': ('aliases', ['id', 'target_id']),
+    # written by --intern (see normalize.GROUPS)
+    'places.csv': ('places', ['id', 'place']),
+    'editions_publish_places_id.csv': ('editions_publish_places', ['edition_id', 'place_id']),
+    'authors_location_id.csv': ('authors_locations', ['author_id', 'location_id']),
+    'subjects.csv': ('subjects', ['id', 'subject']),
+    'editions_subjects_id.csv': ('editions_subjects', ['edition_id', 'subject_id']),
+    'works_subjects_id.csv': ('works_subjects', ['work_id', 'subject_id']),
+    'lccn.csv': ('lccn', ['id', 'lccn']),
+    'editions_lccn_id.csv': ('editions_lccn', ['edition_id', 'lccn_id']),
+    'work_titles.csv': ('work_titles', ['id', 'work_title']),
+    'editions_work_titles_id.csv': ('editions_work_titles', ['edition_id', 'work_title_id']),
+    'contributors.csv': ('contributors', ['id', 'contributor']),
+    'editions_contributors_id.csv': ('editions_contributors', ['edition_id', 'contributor_id']),
+    'genres.csv': ('genres', ['id', 'genre']),
+    'editions_genres_id.csv': ('editions_genres', ['edition_id', 'genre_id']),
+    'languages.csv': ('languages', ['id', 'language']),
+    'editions_languages_id.csv': ('editions_languages', ['edition_id', 'language_id']),
+    'works_orginal_languages_id.csv': ('works_original_languages', ['work_id', 'language_id']),
+    'lc_classifications.csv': ('lc_classifications', ['id', 'lc_classification']),
+    'editions_lc_classifications_id.csv': ('editions_lc_class', ['edition_id', 'lc_classification_id']),
+    'works_lc_classifications_id.csv': ('works_lc_class', ['work_id', 'lc_classification_id']),
+    'publishers.csv': ('publishers', ['id', 'publisher']),
+    'editions_publishers_id.csv': ('editions_publishers', ['edition_id', 'publisher_id']),
+    'series.csv': ('series', ['id', 'series']),
+    'editions_series_id.csv': ('editions_series', ['edition_id', 'series_id']),
+    'dewey_number.csv': ('dewey_numbers', ['id', 'dewey_number']),
+    'works_dewey_number_id.csv': ('works_dewey_number', ['work_id', 'dewey_number_id']),
+    'other_titles.csv': ('other_work_titles', ['id', 'other_title']),
+    'works_other_titles_id.csv': ('works_other_titles', ['work_id', 'other_work_title_id']),
+}
+
+# the main tables have an empty string for every missing field
+MAIN_TABLES = ['editions', 'works', 'authors']
+
+def copy_sql(table, columns, into=None):
+    """
+    the COPY statement for the tab separated csvs the parsers
+    write (same options as load_tables.sql), copying the csv
+    of table into the table into if given
+    """
+    options = "FORMAT csv, DELIMITER E'\\t', QUOTE E'\\b'"
+    if table in MAIN_TABLES:
+        options = f"FORCE_NULL({', '.join(columns)}), " + options
+    return f"COPY {into or table} ({', '.join(columns)}) FROM STDIN WITH ({options})"
+
+class _QueueReader:
+    """
+    the file object COPY reads from, fed by CopyWriter
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = b''
+        self.done = False
+
+    def read(self, size=-1):
+        while not self.pending and not self.done:
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.done = True
+            else:
+                self.pending = chunk
+        if size is None or size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+class LineReader:
+    """
+    file-like object COPY reads the lines of an iterator from
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        self.pending = b''
+
+    def read(self, size=-1):
+        chunks = [self.pending]
+        buffered = len(self.pending)
+        while size < 0 or buffered < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            chunk = line.encode('utf-8')
+            chunks.append(chunk)
+            buffered += len(chunk)
+        data = b''.join(chunks)
+        if size < 0:
+            size = len(data)
+        data, self.pending = data[:size], data[size:]
+        return data
+
+def copy_lines(cur, sql, lines):
+    """
+    run the COPY ... FROM STDIN sql on the lines of an iterator
+    """
+    cur.copy_expert(sql, LineReader(iter(lines)), CHUNK_SIZE)
+
+class CopyWriter:
+    """
+    file-like object that streams what is written to it into
+    one table with COPY, on its own connection and thread
+    """
+    def __init__(self, db_url, table, columns):
+        self.table = table
+        self.conn = pg.connect(db_url)
+        self.chunks = queue.Queue(QUEUE_CHUNKS)
+        self.buffer = []
+        self.buffered = 0
+        self.copied_bytes = 0
+        self.error = None
+        self.reported = False
+        self.thread = threading.Thread(target=self._copy, args=(copy_sql(table, columns),), daemon=True)
+        self.thread.start()
+
+    def _copy(self, sql):
+        try:
+            with self.conn.cursor() as cur:
+                cur.copy_expert(sql, _QueueReader(self.chunks), CHUNK_SIZE)
+            self.conn.commit()
+        except Exception as e:
+            self.error = e
+            self.conn.rollback()
+            # keep draining so the writer never blocks on a dead COPY
+            while self.chunks.get() is not None:
+                pass
+
+    def _put(self, chunk):
+        # the parsers catch and print per record errors, so a dead
+        # COPY is reported once here and raised from close()
+        if self.error is not None:
+            if not self.reported:
+                print(f"COPY into {self.table} failed, dropping its rows: {self.error}")
+                self.reported = True
+            return
+        self.chunks.put(chunk)
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            chunk = ''.join(self.buffer).encode('utf-8')
+            self.buffer = []
+            self.buffered = 0
+            self.copied_bytes += len(chunk)
+            self._put(chunk)
+
+    def close(self):
+        if self.thread is None:
+            return
+        try:
+            self.flush()
+            self.chunks.put(None)
+            self.thread.join()
+            if self.error is not None:
+                raise RuntimeError(f"COPY into {self.table} failed: {self.error}")
+            print(f"copied {self.copied_bytes / 1e6:.1f} MB into {self.table}")
+        finally:
+            self.thread = None
+            self.conn.close()
+
+def copy_opener(db_url):
+    """
+    an opener for parallel.run that streams the COPY_TARGETS
+    into the database and writes every other csv as usual
+    """
+    def opener(filename):
+        target = COPY_TARGETS.get(os.path.basename(filename))
+        if target is None:
+            return None
+        return CopyWriter(db_url, *target)
+    return opener
+
+def prepare(db_url, outputs_paths):
+    """
+    drop the foreign keys on the tables about to be streamed,
+    since referenced rows arrive concurrently on other
+    connections. returns them for restore()
+    """
+    tables = [COPY_TARGETS[os.path.basename(p)][0] for p in outputs_paths
+              if os.path.basename(p) in COPY_TARGETS]
+    conn = pg.connect(db_url)
+    try:
+        constraints = pg.foreign_keys(conn, tables)
+        pg.drop_constraints(conn, constraints)
+    finally:
+        conn.close()
+    return constraints
+
+def restore(db_url, constraints):
+    """
+    add the foreign keys back as NOT VALID: the dump has dangling
+    keys, so the loaded rows are not checked, but new writes are
+    """
+    conn = pg.connect(db_url)
+    try:
+        pg.add_constraints(conn, constraints, not_valid=True)
+    finally:
+        conn.close()
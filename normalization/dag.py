@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+"""
+runs a set of file to file steps, each declaring the
+files it reads and writes. a step waits for the steps
+that write its inputs, independent steps run side by side
+in a process pool, and a step is skipped when the content
+of its inputs (and its arguments) are the same as on its
+last successful run and its outputs are still there.
+
+the input hashes of each step's last run are kept in a
+json state file next to the outputs. a file is only
+re-hashed when its size or modification time changed
+"""
+
+# state file, in the working directory
+STATE_FILE = '.normalize_state.json'
+# read size when hashing the inputs
+HASH_BLOCK = 1024 * 1024
+
+class Step:
+    """
+    one step: func(*args) reads inputs and writes outputs
+    """
+    def __init__(self, name, inputs, outputs, func, args=()):
+        self.name = name
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.func = func
+        self.args = tuple(args)
+
+def file_hash(path, cached=None):
+    """
+    {'size', 'mtime', 'sha256'} of the file at path, reusing
+    cached (an earlier result) if the file looks unchanged
+    """
+    stat = os.stat(path)
+    if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+        return cached
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b''):
+            sha.update(block)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha.hexdigest()}
+
+def _unchanged(step, previous, inputs):
+    if not previous or previous['args'] != repr(step.args):
+        return False
+    old = previous['inputs']
+    if set(old) != set(inputs):
+        return False
+    if any(old[path]['sha256'] != inputs[path]['sha256'] for path in inputs):
+        return False
+    return all(os.path.exists(path) for path in step.outputs)
+
+def _run_step(step, previous, force):
+    """
+    worker: run step unless it is unchanged since previous,
+    returning (ran, state to save, seconds)
+    """
+    start = time.time()
+    cached = previous['inputs'] if previous else {}
+    inputs = {path: file_hash(path, cached.get(path)) for path in step.inputs}
+    if not force and _unchanged(step, previous, inputs):
+        return False, previous, 0.0
+    step.func(*step.args)
+    return True, {'inputs': inputs, 'args': repr(step.args)}, time.time() - start
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as file:
+        return json.load(file)
+
+def save_state(state_file, state):
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(state, file, indent=1)
+    os.replace(tmp, state_file)
+
+def dependencies(steps):
+    """
+    step name -> names of the steps writing its inputs
+    """
+    writers = {path: step.name for step in steps for path in step.outputs}
+    return {step.name: {writers[path] for path in step.inputs if path in writers} - {step.name}
+            for step in steps}
+
+def run(steps, workers=1, state_file=STATE_FILE, force=False):
+    """
+    run steps in dependency order, workers at a time,
+    returning the names of the steps that failed
+    """
+    state = load_state(state_file)
+    deps = dependencies(steps)
+    pending = list(steps)
+    done = set()
+    failed = set()
+    running = {}
+
+    with ProcessPoolExecutor(workers) as pool:
+        while pending or running:
+            for step in list(pending):
+                if deps[step.name] & failed:
+                    print(f"{step.name}: skipped, an input failed")
+                    failed.add(step.name)
+                    pending.remove(step)
+                elif deps[step.name] <= done:
+                    future = pool.submit(_run_step, step, state.get(step.name), force)
+                    running[future] = step.name
+                    pending.remove(step)
+            if not running:
+                for step in pending:
+                    print(f"{step.name}: not run, circular inputs")
+                    failed.add(step.name)
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    ran, step_state, seconds = future.result()
+                except Exception as e:
+                    print(f"{name}: failed: {e}")
+                    failed.add(name)
+                    # its outputs may be partial, so never skip it next time
+                    if state.pop(name, None) is not None:
+                        save_state(state_file, state)
+                    continue
+                if ran:
+                    print(f"{name}: done in {seconds:.1f}s")
+                else:
+                    print(f"{name}: inputs unchanged, skipped")
+                state[name] = step_state
+                save_state(state_file, state)
+                done.add(name)
+    return failed
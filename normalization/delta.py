@@ -0,0 +1,400 @@
+import argparse
+import os
+from itertools import groupby
+import aliases
+import copy_sink
+import parallel
+import parse_dump
+import derived
+import pg
+from dump_reader import iter_lines
+from extsort import sorted_runs, merge_runs
+from hash_ids import CollisionError, value_id
+from interning import LOOKUPS
+from normalize import id_filename, REDIRECTS_FILE, ALIASES_FILE
+from ol_ids import encode_id
+
+"""
+updates a loaded database from a newer ol_dump instead
+of rebuilding it.
+
+1. the key, revision and last_modified columns of the dump
+   lines (no json decoding) are sorted by key and merged
+   with the keys already loaded, sorted the same way, to
+   find the inserted, changed and deleted records
+2. the inserted and changed records are parsed into csvs
+   in the delta directory, by the same parsers as a full
+   load (parse_dump.py)
+3. with --apply, in a single transaction: the association
+   rows of the changed and deleted records are deleted, the
+   deleted records are deleted, the changed records are
+   upserted and their association rows inserted. the list
+   values that normalize.py would put in lookup tables are
+   matched to the existing lookup rows, and new values are
+   added with the next ids (or their hash ids, --hash-ids,
+   for a database loaded from a parse with --hash-ids)
+
+a record type with no records in the dump (e.g. the dump
+is ol_dump_editions) is left as is. editions that OL
+deleted but that are reviewed or on a list are kept.
+
+the aliases table is small, so it is rebuilt from all the
+redirects of the new dump (see aliases.py) rather than
+diffed, unless the dump has no redirects at all. the rows of
+the derived tables (see derived.py) of the changed editions,
+and of the editions of the changed authors, are rebuilt.
+"""
+
+# memory for sorting the dump keys
+SORT_MEMORY = 256 * 1024 * 1024
+
+# association table column -> the main table it references,
+# used to remove the rows pointing at deleted records
+REFERENCES = {'edition_id': 'editions', 'work_id': 'works', 'author_id': 'authors'}
+
+# user tables whose editions are kept when OL deletes them
+USER_REFERENCES = [('reviews', 'book_id'), ('list_books', 'book_id')]
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default="../ol_dump_latest.txt",
+                        help="path to the new ol_dump file")
+    parser.add_argument('--dir', default="delta",
+                        help="directory for the delta csvs (default ./delta)")
+    parser.add_argument('--db', default=None,
+                        help="database url (default DB_URL in model/database.py)")
+    parser.add_argument('--apply', action='store_true',
+                        help="apply the delta to the database (otherwise only write the csvs)")
+    parser.add_argument('--tmpdir', default=None,
+                        help="directory for the sorted runs (default the system temp dir)")
+    parser.add_argument('--hash-ids', action='store_true',
+                        help="give new lookup values their hash ids, for a database "
+                             "parsed with --hash-ids (see hash_ids.py)")
+    return parser.parse_args()
+
+def tables():
+    """
+    main table -> (main csv, direct association csvs, normalized
+    pairwise csvs), from the outputs of parse_dump.py. the csvs
+    that are not loaded (see load_tables.sql) are left out
+    """
+    result = {}
+    for name in copy_sink.MAIN_TABLES:
+        outputs = parse_dump.OUTPUTS[name]
+        csvs = [f for key, f in outputs.items() if key != name]
+        direct = [f for f in csvs if f in copy_sink.COPY_TARGETS]
+        normalized = [f for f in csvs if f in LOOKUPS]
+        result[name] = (outputs[name], direct, normalized)
+    return result
+
+def in_dir(outputs, directory):
+    """
+    outputs with every filename moved into directory
+    """
+    return {name: in_dir(value, directory) if isinstance(value, dict) else os.path.join(directory, value)
+            for name, value in outputs.items()}
+
+# ---------------- finding the delta ----------------
+
+def dump_keys(path):
+    """
+    table\tid\trevision\tdate line of each record of the dump,
+    with the integer key of the record (see ol_ids.py) as id
+    """
+    for line in iter_lines(path):
+        route = parse_dump.PARSERS.get(line[:line.find('\t')])
+        if route is None or route[0] not in copy_sink.MAIN_TABLES:
+            continue
+        columns = line.split('\t', 4)
+        if len(columns) < 5:
+            continue
+        key = encode_id(columns[1])
+        if key is None:
+            continue
+        # last_modified is a timestamp, the tables keep its date
+        yield f"{route[0]}\t{key}\t{columns[2]}\t{columns[3][:10]}\n"
+
+def export_loaded(conn, table, path):
+    """
+    write the id, revision and last_modified of the loaded
+    records to path, in the order python sorts the ids (as
+    text, the way the dump keys are sorted)
+    """
+    sql = (f'COPY (SELECT id, revision, last_modified FROM {table} '
+           f'ORDER BY id::text COLLATE "C") TO STDOUT')
+    with open(path, 'w', newline='\n') as file, conn.cursor() as cur:
+        cur.copy_expert(sql, file)
+
+def read_loaded(path):
+    with open(path, newline='\n') as file:
+        for line in file:
+            columns = ['' if c == '\\N' else c for c in line.rstrip('\n').split('\t')]
+            yield tuple(columns)
+
+def diff(dump_rows, loaded_rows):
+    """
+    merge two iterators of (id, revision, date) sorted by id,
+    yielding ('inserted' | 'changed' | 'deleted', id)
+    """
+    loaded = next(loaded_rows, None)
+    for row in dump_rows:
+        while loaded is not None and loaded[0] < row[0]:
+            yield 'deleted', loaded[0]
+            loaded = next(loaded_rows, None)
+        if loaded is not None and loaded[0] == row[0]:
+            if loaded[1:] != row[1:]:
+                yield 'changed', row[0]
+            loaded = next(loaded_rows, None)
+        else:
+            yield 'inserted', row[0]
+    while loaded is not None:
+        yield 'deleted', loaded[0]
+        loaded = next(loaded_rows, None)
+
+def find_delta(conn, path, directory, tmpdir=None):
+    """
+    write changed_<table>.txt (inserted and changed ids) and
+    deleted_<table>.txt for each table with records in the
+    dump, returning table -> set of the changed ids
+    """
+    runs = sorted_runs(dump_keys(path), SORT_MEMORY, tmpdir)
+    rows = (line.rstrip('\n').split('\t') for line in merge_runs(runs, tmpdir))
+
+    changed = {}
+    # the sorted keys come grouped by table
+    for table, group in groupby(rows, key=lambda row: row[0]):
+        loaded_path = os.path.join(directory, f"loaded_{table}.txt")
+        export_loaded(conn, table, loaded_path)
+        counts = {'inserted': 0, 'changed': 0, 'deleted': 0}
+        changed[table] = set()
+        with open(os.path.join(directory, f"changed_{table}.txt"), 'w') as changed_file, \
+                open(os.path.join(directory, f"deleted_{table}.txt"), 'w') as deleted_file:
+            for status, key in diff((tuple(row[1:]) for row in group), read_loaded(loaded_path)):
+                counts[status] += 1
+                if status == 'deleted':
+                    deleted_file.write(f"{key}\n")
+                else:
+                    changed_file.write(f"{key}\n")
+                    changed[table].add(key)
+        os.remove(loaded_path)
+        print(f"{table}: {counts['inserted']} inserted, {counts['changed']} changed, "
+              f"{counts['deleted']} deleted")
+
+    for table in tables():
+        if table not in changed:
+            print(f"no {table} in the dump, leaving {table} as is")
+    return changed
+
+# ---------------- parsing the changed records ----------------
+
+# table -> ids to parse, for parse_changed
+_changed = {}
+
+def parse_changed(line, out):
+    """
+    parse_dump.parse_line for the records in _changed only,
+    and for every redirect (the aliases are rebuilt)
+    """
+    tab = line.find('\t')
+    route = parse_dump.PARSERS.get(line[:tab])
+    if route is not None and route[0] == 'redirects':
+        parse_dump.parse_line(line, out)
+        return
+    if route is None or route[0] not in _changed:
+        return
+    key = encode_id(line[tab + 1:line.find('\t', tab + 1)])
+    if key is not None and str(key) in _changed[route[0]]:
+        parse_dump.parse_line(line, out)
+
+def parse_delta(path, directory, changed):
+    _changed.clear()
+    _changed.update(changed)
+    parallel.run(parse_changed, in_dir(parse_dump.OUTPUTS, directory), path)
+
+# ---------------- applying the delta ----------------
+
+def _lines(path):
+    if not os.path.exists(path):
+        return
+    with open(path, newline='\n') as file:
+        yield from file
+
+def _pairs(path, hashed=False):
+    """
+    the rows of a pairwise csv the way normalize.py reads them,
+    with the hash id of the value if hashed
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as file:
+        for line in file:
+            columns = line.rstrip().split('\t')
+            if len(columns)!=2:
+                continue
+            if hashed:
+                yield f"{columns[0]}\t{columns[1]}\t{value_id(columns[1])}\n"
+            else:
+                yield f"{columns[0]}\t{columns[1]}\n"
+
+def _association_tables(name, direct, normalized):
+    """
+    (table, columns) of the association tables of a main table
+    """
+    result = [copy_sink.COPY_TARGETS[f] for f in direct]
+    result += [copy_sink.COPY_TARGETS[id_filename(f)] for f in normalized]
+    return result
+
+def _referencing(conn, tables, skip):
+    """
+    foreign keys of tables and foreign keys to tables, except
+    the ones declared on the tables in skip
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid)
+            FROM pg_constraint c
+            WHERE c.contype = 'f' AND (c.conrelid::regclass::text = ANY(%s)
+                                       OR c.confrelid::regclass::text = ANY(%s))
+        """, (list(tables), list(tables)))
+        return [fk for fk in cur.fetchall() if fk[0] not in skip]
+
+def _add_hashed_values(cur, lookup, value):
+    """
+    add the values of delta_pairs missing from lookup with their
+    hash ids, raising CollisionError if an id is taken by another value
+    """
+    cur.execute(f"SELECT p.value, l.{value}, l.id FROM delta_pairs p "
+                f"JOIN {lookup} l ON l.id = p.id WHERE l.{value} <> p.value LIMIT 1")
+    row = cur.fetchone()
+    if row is not None:
+        raise CollisionError(f"hash id collision: {row[0]!r} and {row[1]!r} both have id {row[2]} in {lookup}")
+    cur.execute(f"INSERT INTO {lookup} (id, {value}) SELECT DISTINCT p.id, p.value FROM delta_pairs p "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {lookup} l WHERE l.id = p.id)")
+
+def apply_delta(conn, directory, changed, hashed=False):
+    """
+    apply the delta csvs in directory to the tables in changed,
+    in one transaction
+    """
+    layout = {name: tables()[name] for name in changed}
+    touched = list(layout)
+    for name, (main_csv, direct, normalized) in layout.items():
+        touched += [table for table, _ in _association_tables(name, direct, normalized)]
+        touched += [copy_sink.COPY_TARGETS[LOOKUPS[f]][0] for f in normalized]
+
+    with conn.cursor() as cur:
+        # the dump has dangling references, so the foreign keys
+        # are dropped and added back as NOT VALID, as in a full load
+        constraints = _referencing(conn, set(touched), [table for table, _ in USER_REFERENCES])
+        pg.drop_constraints(conn, constraints, commit=False)
+
+        for name in layout:
+            cur.execute(f"CREATE TEMP TABLE delta_deleted_{name} (id integer) ON COMMIT DROP")
+            copy_sink.copy_lines(cur, f"COPY delta_deleted_{name} (id) FROM STDIN",
+                  _lines(os.path.join(directory, f"deleted_{name}.txt")))
+            if name == 'editions':
+                kept = " OR ".join(f"EXISTS (SELECT 1 FROM {table} u WHERE u.{column} = d.id)"
+                                   for table, column in USER_REFERENCES)
+                cur.execute(f"DELETE FROM delta_deleted_editions d WHERE {kept}")
+                if cur.rowcount:
+                    print(f"keeping {cur.rowcount} deleted editions that users reviewed or listed")
+            cur.execute(f"CREATE TEMP TABLE delta_keys_{name} (id integer) ON COMMIT DROP")
+            copy_sink.copy_lines(cur, f"COPY delta_keys_{name} (id) FROM STDIN",
+                  _lines(os.path.join(directory, f"changed_{name}.txt")))
+            cur.execute(f"INSERT INTO delta_keys_{name} SELECT id FROM delta_deleted_{name}")
+
+        # the derived rows of the changed editions and of the
+        # editions of the changed authors, found before their rows go
+        derived_tables = [module.TABLE for module in derived.MODULES if pg.table_exists(conn, module.TABLE)]
+        if 'editions' in layout:
+            derived.mark(cur, "SELECT id FROM delta_keys_editions")
+        if 'authors' in layout:
+            derived.mark(cur, "SELECT edition_id FROM editions_authors "
+                              "WHERE author_id IN (SELECT id FROM delta_keys_authors)")
+
+        # association rows of the changed and deleted records,
+        # and the rows of other records pointing at deleted ones
+        for name, (main_csv, direct, normalized) in layout.items():
+            for table, columns in _association_tables(name, direct, normalized):
+                cur.execute(f"DELETE FROM {table} WHERE {columns[0]} IN (SELECT id FROM delta_keys_{name})")
+                for column in columns[1:]:
+                    if REFERENCES.get(column) in layout:
+                        cur.execute(f"DELETE FROM {table} WHERE {column} IN "
+                                    f"(SELECT id FROM delta_deleted_{REFERENCES[column]})")
+        for name in layout:
+            cur.execute(f"DELETE FROM {name} WHERE id IN (SELECT id FROM delta_deleted_{name})")
+
+        for name, (main_csv, direct, normalized) in layout.items():
+            _, columns = copy_sink.COPY_TARGETS[main_csv]
+            cur.execute(f"CREATE TEMP TABLE delta_{name} (LIKE {name}) ON COMMIT DROP")
+            copy_sink.copy_lines(cur, copy_sink.copy_sql(name, columns, into=f"delta_{name}"),
+                  _lines(os.path.join(directory, main_csv)))
+            updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c != 'id')
+            cur.execute(f"INSERT INTO {name} ({', '.join(columns)}) "
+                        f"SELECT DISTINCT ON (id) {', '.join(columns)} FROM delta_{name} "
+                        f"ON CONFLICT (id) DO UPDATE SET {updates}")
+            print(f"{name}: upserted {cur.rowcount}")
+
+            for f in direct:
+                table, columns = copy_sink.COPY_TARGETS[f]
+                copy_sink.copy_lines(cur, copy_sink.copy_sql(table, columns), _lines(os.path.join(directory, f)))
+
+            for f in normalized:
+                lookup, (_, value) = copy_sink.COPY_TARGETS[LOOKUPS[f]]
+                table, (key_column, id_column) = copy_sink.COPY_TARGETS[id_filename(f)]
+                cur.execute("CREATE TEMP TABLE IF NOT EXISTS delta_pairs "
+                            "(key integer, value text, id bigint) ON COMMIT DROP")
+                cur.execute("TRUNCATE delta_pairs")
+                pair_columns = ['key', 'value', 'id'] if hashed else ['key', 'value']
+                copy_sink.copy_lines(cur, copy_sink.copy_sql('delta_pairs', pair_columns),
+                                     _pairs(os.path.join(directory, f), hashed))
+                if hashed:
+                    _add_hashed_values(cur, lookup, value)
+                    cur.execute(f"INSERT INTO {table} ({key_column}, {id_column}) "
+                                f"SELECT p.key, p.id FROM delta_pairs p")
+                    continue
+                # new values get the ids after the loaded ones
+                cur.execute(f"""
+                    INSERT INTO {lookup} (id, {value})
+                    SELECT m.max_id + row_number() OVER (ORDER BY v.value), v.value
+                    FROM (SELECT DISTINCT p.value FROM delta_pairs p
+                          WHERE NOT EXISTS (SELECT 1 FROM {lookup} l WHERE l.{value} = p.value)) v,
+                         (SELECT coalesce(max(id), 0) AS max_id FROM {lookup}) m
+                """)
+                cur.execute(f"INSERT INTO {table} ({key_column}, {id_column}) "
+                            f"SELECT p.key, l.id FROM delta_pairs p JOIN {lookup} l ON l.{value} = p.value")
+
+        for table, rows in derived.refresh(cur, derived_tables).items():
+            print(f"{table}: refreshed {rows}")
+
+        pg.add_constraints(conn, constraints, not_valid=True, commit=False)
+
+        redirects = os.path.join(directory, REDIRECTS_FILE)
+        if os.path.exists(redirects) and os.path.getsize(redirects) > 0:
+            aliases_file = os.path.join(directory, ALIASES_FILE)
+            written, _ = aliases.write_aliases(redirects, aliases_file)
+            table, columns = copy_sink.COPY_TARGETS[ALIASES_FILE]
+            cur.execute(f"DELETE FROM {table}")
+            copy_sink.copy_lines(cur, copy_sink.copy_sql(table, columns), _lines(aliases_file))
+            print(f"{table}: replaced with {written} aliases")
+    conn.commit()
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.dir, exist_ok=True)
+    conn = pg.connect(args.db)
+    try:
+        changed = find_delta(conn, args.input, args.dir, args.tmpdir)
+        parse_delta(args.input, args.dir, changed)
+        if args.apply:
+            apply_delta(conn, args.dir, changed, args.hash_ids)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import edition_summary
+import search_index
+
+"""
+the derived tables: tables with one row per edition built from
+the loaded catalog, for the app to read instead of joining the
+catalog tables on every request
+
+    editions_search   the keyword search documents (search_index.py)
+    edition_summary   what a search result shows (edition_summary.py)
+
+each module has the TABLE it fills, the SOURCES tables it is
+built from, build(cur) to fill the empty table from all the
+editions, in bulk, and refresh(cur, editions) to rebuild the
+rows of the editions a query selects.
+
+load_tables.py empties and builds the derived tables of the
+tables it loads. delta.py marks the editions whose rows may
+change before it changes them (mark), and refreshes them in
+its transaction once the new rows are in (refresh).
+"""
+
+MODULES = [search_index, edition_summary]
+
+def mark(cur, editions):
+    """
+    mark the editions whose ids the query editions selects
+    to be refreshed, before their rows change
+    """
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS delta_derived (id integer) ON COMMIT DROP")
+    cur.execute(f"INSERT INTO delta_derived {editions}")
+
+def refresh(cur, tables):
+    """
+    rebuild the rows of the marked editions in the derived
+    tables among tables. returns table -> rows written
+    """
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS delta_derived (id integer) ON COMMIT DROP")
+    result = {}
+    for module in MODULES:
+        if module.TABLE in tables:
+            result[module.TABLE] = module.refresh(cur, "SELECT DISTINCT id FROM delta_derived")
+    cur.execute("TRUNCATE delta_derived")
+    return result
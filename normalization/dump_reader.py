@@ -0,0 +1,194 @@
+import gzip
+import io
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+"""
+helpers for reading the ol_dump line by line,
+either whole or as byte ranges aligned to newlines.
+
+the dump can also be read straight from the .gz (or .zst)
+file that Open Library publishes. decompression runs next
+to the parser, in an external decompressor process when one
+is installed (pigz, gzip, zstd), otherwise in a background
+thread, so the decompressed text never touches the disk.
+"""
+
+# extension -> external decompressors to try, in order of preference
+DECOMPRESSORS = {
+    '.gz': [['pigz', '-dc'], ['gzip', '-dc']],
+    '.zst': [['zstd', '-dc', '-q']],
+}
+
+# size of each decompressed block passed from the background thread
+BLOCK_SIZE = 1024 * 1024
+# blocks that may be buffered ahead of the parser
+QUEUE_BLOCKS = 16
+
+def is_compressed(path):
+    return os.path.splitext(path)[1] in DECOMPRESSORS
+
+def find_chunks(path, n, start=0, end=None):
+    """
+    split the file at path, or its [start, end) byte range
+    (start at the beginning of a line), into at most n byte
+    ranges that each start at the beginning of a line
+    returns a list of (start, end) tuples
+    """
+    if end is None:
+        end = os.path.getsize(path)
+    size = end - start
+    if size <= 0:
+        return []
+
+    bounds = [start]
+    with open(path, 'rb') as file:
+        for i in range(1, n):
+            file.seek(start + size * i // n)
+            # finish the partial line so the range starts on a new one
+            file.readline()
+            pos = file.tell()
+            if pos > bounds[-1] and pos < end:
+                bounds.append(pos)
+    bounds.append(end)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+class _ThreadedReader(io.RawIOBase):
+    """
+    raw stream over a file object that is read (and so decompressed)
+    in a background thread, a bounded number of blocks ahead
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.blocks = queue.Queue(QUEUE_BLOCKS)
+        self.pending = b''
+        self.done = False
+        self.thread = threading.Thread(target=self._pump, daemon=True)
+        self.thread.start()
+
+    def _pump(self):
+        try:
+            while True:
+                block = self.fileobj.read(BLOCK_SIZE)
+                if not block:
+                    break
+                self.blocks.put(block)
+            self.blocks.put(None)
+        except Exception as e:
+            self.blocks.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.pending:
+            if self.done:
+                return 0
+            block = self.blocks.get()
+            if block is None:
+                self.done = True
+                return 0
+            if isinstance(block, Exception):
+                raise block
+            self.pending = block
+        n = min(len(b), len(self.pending))
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.fileobj.close()
+        super().close()
+
+def open_in_thread(path):
+    """
+    a binary reader of the decompressed .gz or .zst file at path,
+    decompressed on a background thread
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.gz':
+        fileobj = gzip.open(path, 'rb')
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(f"reading {path} needs the zstd command or the zstandard package")
+        # intermediates written by compressed.py have a frame per flush
+        fileobj = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True,
+                                                             read_across_frames=True)
+    return io.BufferedReader(_ThreadedReader(fileobj), BLOCK_SIZE)
+
+def _iter_compressed(path):
+    ext = os.path.splitext(path)[1]
+    for command in DECOMPRESSORS[ext]:
+        if shutil.which(command[0]):
+            proc = subprocess.Popen(command + [path], stdout=subprocess.PIPE, bufsize=BLOCK_SIZE)
+            finished = False
+            try:
+                yield from proc.stdout
+                finished = True
+            finally:
+                # if the reader stopped early the decompressor is cut off
+                # mid stream, so only check its status after a full read
+                proc.stdout.close()
+                if proc.wait() != 0 and finished:
+                    raise RuntimeError(f"{command[0]} failed on {path}")
+            return
+
+    with open_in_thread(path) as file:
+        yield from file
+
+def iter_lines(path, start=0, end=None):
+    """
+    yield the decoded lines of the file at path whose
+    first byte falls within [start, end)
+    compressed dumps can only be read whole
+    """
+    if is_compressed(path):
+        if start != 0 or end is not None:
+            raise ValueError(f"cannot read a byte range of compressed file {path}")
+        for raw in _iter_compressed(path):
+            yield raw.decode('utf-8', errors='replace')
+        return
+
+    with open(path, 'rb') as file:
+        file.seek(start)
+        pos = start
+        for raw in file:
+            if end is not None and pos >= end:
+                break
+            pos += len(raw)
+            yield raw.decode('utf-8', errors='replace')
+
+def iter_lines_at(path, start=0, end=None):
+    """
+    yield (offset after the line, decoded line) for the lines
+    of the file at path from offset start, which must be the
+    start of a line, up to the line starting at end. the
+    offsets of a compressed dump count decompressed bytes, so
+    starting part way still means decompressing (but not
+    decoding) everything before start
+    """
+    if is_compressed(path):
+        if end is not None:
+            raise ValueError(f"cannot read a byte range of compressed file {path}")
+        pos = 0
+        for raw in _iter_compressed(path):
+            pos += len(raw)
+            if pos > start:
+                yield pos, raw.decode('utf-8', errors='replace')
+        return
+
+    with open(path, 'rb') as file:
+        file.seek(start)
+        pos = start
+        for raw in file:
+            if end is not None and pos >= end:
+                break
+            pos += len(raw)
+            yield pos, raw.decode('utf-8', errors='replace')
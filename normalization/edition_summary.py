@@ -0,0 +1,66 @@
+"""
+the edition_summary table: what a search result shows of an
+edition (books._summary_to_dict), in one row: its title, the
+names and ids of its authors, its publish places, publishers,
+publish date and first cover. a page of search results is then
+read with one index probe per edition, rather than four joins
+that multiply the rows of each edition before the LIMIT.
+
+it is one of the derived tables (see derived.py): load_tables.py
+builds it whole after loading any of its sources, and delta.py
+refreshes the rows of the editions it changes.
+"""
+
+TABLE = 'edition_summary'
+# the tables the summaries are built from
+SOURCES = ['editions', 'editions_authors', 'authors', 'editions_publish_places', 'places',
+           'editions_publishers', 'publishers', 'editions_covers']
+COLUMNS = ['edition_id', 'title', 'author_ids', 'author_names', 'publish_places',
+           'publishers', 'publish_date', 'cover']
+
+# the lists of an edition, each one aggregated over the rows
+# of the edition, as (alias, select list, from and join). an
+# author, place or publisher listed twice is shown once, and
+# the cover is the first one of the record
+_LISTS = [
+    ('a', "array_agg(au.id) AS ids, array_agg(au.name) AS names",
+     "(SELECT DISTINCT edition_id, author_id FROM editions_authors) x "
+     "JOIN authors au ON au.id = x.author_id"),
+    ('p', "array_agg(pl.place) AS places",
+     "(SELECT DISTINCT edition_id, place_id FROM editions_publish_places) x "
+     "JOIN places pl ON pl.id = x.place_id"),
+    ('pb', "array_agg(pu.publisher) AS publishers",
+     "(SELECT DISTINCT edition_id, publisher_id FROM editions_publishers) x "
+     "JOIN publishers pu ON pu.id = x.publisher_id"),
+    ('c', "(array_agg(x.cover ORDER BY x.id))[1] AS cover",
+     "editions_covers x"),
+]
+
+_SELECT = f"""
+    INSERT INTO {TABLE} ({', '.join(COLUMNS)})
+    SELECT e.id, e.title, a.ids, a.names, p.places, pb.publishers, e.publish_date, c.cover
+    FROM editions e
+"""
+
+def build(cur):
+    """
+    fill the (empty) edition_summary table from all the editions,
+    each list aggregated once for all editions and hash joined
+    """
+    joins = "".join(f" LEFT JOIN (SELECT x.edition_id, {select} FROM {source} "
+                    f"GROUP BY x.edition_id) {alias} ON {alias}.edition_id = e.id"
+                    for alias, select, source in _LISTS)
+    cur.execute(_SELECT + joins)
+    return cur.rowcount
+
+def refresh(cur, editions):
+    """
+    rebuild the rows of the editions whose ids the query
+    editions selects (deleted editions just lose theirs)
+    """
+    cur.execute(f"DELETE FROM {TABLE} WHERE edition_id IN ({editions})")
+    joins = "".join(f" LEFT JOIN LATERAL (SELECT {select} FROM {source} "
+                    f"WHERE x.edition_id = e.id) {alias} ON true"
+                    for alias, select, source in _LISTS)
+    cur.execute(_SELECT + joins + f" WHERE e.id IN ({editions})")
+    return cur.rowcount
@@ -0,0 +1,85 @@
+import heapq
+import os
+import tempfile
+
+"""
+external sort of text lines for data that does not fit in
+memory: the lines are sorted in runs of bounded size that
+are spilled to temporary files, then k-way merged back
+into one sorted stream.
+
+the lines are compared as whole strings, so every line
+must end with a newline and contain no other newline
+"""
+
+# runs merged at once; more runs are first merged in passes
+MERGE_FAN_IN = 256
+# python overhead of a str in a run, on top of its length
+LINE_OVERHEAD = 64
+# read/write buffer of each run file
+RUN_BUFFER = 256 * 1024
+
+def _spill(lines, tmpdir):
+    lines.sort()
+    fd, path = tempfile.mkstemp(suffix='.run', dir=tmpdir)
+    with os.fdopen(fd, 'w', newline='\n', buffering=RUN_BUFFER) as run:
+        run.writelines(lines)
+    return path
+
+def sorted_runs(lines, run_bytes, tmpdir=None):
+    """
+    sort lines into runs of about run_bytes of memory each,
+    returning the paths of the run files
+    """
+    runs = []
+    run = []
+    size = 0
+    for line in lines:
+        run.append(line)
+        size += len(line) + LINE_OVERHEAD
+        if size >= run_bytes:
+            runs.append(_spill(run, tmpdir))
+            run = []
+            size = 0
+    if run:
+        runs.append(_spill(run, tmpdir))
+    return runs
+
+def _open_run(path):
+    return open(path, newline='\n', buffering=RUN_BUFFER)
+
+def _merge_pass(runs, tmpdir):
+    """
+    merge the runs MERGE_FAN_IN at a time into fewer runs
+    """
+    merged = []
+    for i in range(0, len(runs), MERGE_FAN_IN):
+        group = runs[i:i + MERGE_FAN_IN]
+        files = [_open_run(path) for path in group]
+        try:
+            fd, path = tempfile.mkstemp(suffix='.run', dir=tmpdir)
+            with os.fdopen(fd, 'w', newline='\n', buffering=RUN_BUFFER) as out:
+                out.writelines(heapq.merge(*files))
+        finally:
+            for file in files:
+                file.close()
+        for run in group:
+            os.remove(run)
+        merged.append(path)
+    return merged
+
+def merge_runs(runs, tmpdir=None):
+    """
+    yield the lines of the sorted runs in sorted order,
+    removing the run files once they are read
+    """
+    while len(runs) > MERGE_FAN_IN:
+        runs = _merge_pass(runs, tmpdir)
+    files = [_open_run(path) for path in runs]
+    try:
+        yield from heapq.merge(*files)
+    finally:
+        for file in files:
+            file.close()
+        for path in runs:
+            os.remove(path)
@@ -0,0 +1,191 @@
+from utils import remove_special_char
+from metrics import field_error
+from ol_ids import encode_id
+
+"""
+table driven extraction of the OL json records into csv rows.
+
+a spec describes, for one record type, the columns of the
+main table csv and the list fields that each get their own
+pairwise csv:
+
+    spec = {
+        'table': OUTPUTS key of the main table csv,
+        'columns': [(field, unwrap) or (field, unwrap, transform), ...],
+        'lists': [(OUTPUTS key, field, item), ...],
+    }
+
+column unwraps:
+    None    - the field as is
+    'value' - field['value'] (e.g. created, last_modified)
+    'text'  - field['value'] if the field is a {'value': ...} dict,
+              otherwise the field itself; an unreadable text field
+              is written empty instead of dropping the record
+              (and counted in metrics, see field_error)
+
+list items (see ITEMS):
+    None     - each item as is
+    'key'    - item['key'], items without a key are skipped
+    'key_id' - the integer key of item['key'] (see ol_ids.py),
+               items without a valid OL key are skipped
+    'name'   - item['name']
+    'text'   - item['text']
+    'author' - integer key of item['author'], which is a key dict
+               or a key string
+    'series' - the whole list, with trailing numbers joined onto
+               the series they belong to (see join_series)
+    'scalar' - the field is a single value, written as one row
+
+compile_spec turns a spec into one generated function,
+extract(data, out), which builds the main table row as a
+single string and the rows of each list field as another,
+so each output gets one write per record. the rows start
+with the integer key of the record (see ol_ids.py), which it
+returns, or None if the record has no valid OL key.
+"""
+
+# item -> (filter, value) python expressions over the list item x
+# (the keys are computed once, in the filter)
+ITEMS = {
+    None: (None, "x"),
+    'key': ("'key' in x", "x['key']"),
+    'key_id': ("'key' in x and (i := _encode_id(x['key'])) is not None", "i"),
+    'name': ("'name' in x", "x['name']"),
+    'text': ("'text' in x", "x['text']"),
+    'author': ("'author' in x and (i := _author_id(x['author'])) is not None", "i"),
+}
+
+def _author_id(author):
+    if isinstance(author, dict):
+        author = author['key']
+    return encode_id(author)
+
+def join_series(series):
+    """
+    join series entries that are just a volume number
+    (e.g. ['Penguin classics', 'no. 12']) onto the series
+    before them, returning the cleaned values
+    """
+    values = []
+    skipnext = False
+    for i in range(len(series)):
+        if skipnext:
+            skipnext = False
+            continue
+        if i == (len(series) - 1):
+            values.append(remove_special_char(series[i]))
+            continue
+        numbers = sum(c.isdigit() for c in series[i+1])
+        letters = sum(c.isalpha() for c in series[i+1])
+        if numbers > 1 or (numbers == 1 and letters < 5):
+            values.append(f"{remove_special_char(series[i])} {remove_special_char(series[i+1])}")
+            skipnext = True
+        else:
+            values.append(remove_special_char(series[i]))
+    return values
+
+# unwrap -> python expression over the field value v
+UNWRAPS = {
+    None: "{v}",
+    'value': "{v}['value']",
+    'text': "{v}['value'] if isinstance({v}, dict) and 'value' in {v} else {v}",
+}
+
+def _column_code(i, field, unwrap, transform):
+    """
+    code setting c{i} to the value of one main table column
+    """
+    def value(v):
+        expr = f"_clean({UNWRAPS[unwrap].format(v=v)})"
+        return f"_t{i}({expr})" if transform is not None else expr
+
+    if unwrap == 'text':
+        return [f"    if {field!r} in data:",
+                f"        v = data[{field!r}]",
+                "        try:",
+                f"            c{i} = {value('v')}",
+                "        except Exception as e:",
+                f"            c{i} = ''",
+                f"            _field_error({field!r}, data, e)",
+                "    else:",
+                f"        c{i} = ''"]
+
+    return [f"    c{i} = {value(f'data[{field!r}]')} if {field!r} in data else ''"]
+
+def _list_code(output, field, item):
+    """
+    code writing the pairwise rows of one list field
+    (short lists are the norm, where appending to one
+    string is faster than joining a list comprehension)
+    """
+    if item == 'series':
+        loop = ['for s in _join_series(v):',
+                '    rows += f"{key}\\t{s}\\n"']
+    elif item == 'scalar':
+        loop = ['rows = f"{key}\\t{_clean(v)}\\n"']
+    else:
+        cond, value = ITEMS[item]
+        row = f'rows += f"{{key}}\\t{{_clean({value})}}\\n"'
+        if cond:
+            loop = ['for x in v:',
+                    f'    if {cond}:',
+                    f'        {row}']
+        else:
+            loop = ['for x in v:',
+                    f'    {row}']
+
+    return ([f"    if {field!r} in data:",
+             f"        v = data[{field!r}]",
+             "        rows = ''",
+             "        try:"]
+            + [f"            {l}" for l in loop]
+            + ["        except Exception as e:",
+               "            rows = ''",
+               f"            _field_error({field!r}, data, e)",
+               "        if rows:",
+               f"            out[{output!r}].write(rows)"])
+
+def spec_source(spec):
+    """
+    python source of the extract function for spec
+    """
+    code = ["def extract(data, out):",
+            "    if 'key' not in data:",
+            "        return None",
+            "    key = _encode_id(data['key'])",
+            "    if key is None:",
+            "        return None"]
+
+    row = "{key}"
+    for i, column in enumerate(spec['columns']):
+        field, unwrap = column[0], column[1]
+        transform = column[2] if len(column) > 2 else None
+        code += _column_code(i, field, unwrap, transform)
+        row += f"\\t{{c{i}}}"
+
+    # the whole main table row is built as one string
+    code += [f"    out[{spec['table']!r}].write(f\"{row}\\n\")"]
+
+    for output, field, item in spec['lists']:
+        code += _list_code(output, field, item)
+
+    code += ["    return key"]
+    return "\n".join(code) + "\n"
+
+def compile_spec(spec):
+    """
+    compile a spec into its extract(data, out) function
+    """
+    namespace = {
+        '_clean': remove_special_char,
+        '_author_id': _author_id,
+        '_encode_id': encode_id,
+        '_join_series': join_series,
+        '_field_error': field_error,
+    }
+    for i, column in enumerate(spec['columns']):
+        if len(column) > 2:
+            namespace[f"_t{i}"] = column[2]
+
+    exec(compile(spec_source(spec), f"<fieldmap {spec['table']}>", 'exec'), namespace)
+    return namespace['extract']
@@ -0,0 +1,72 @@
+import hashlib
+from extsort import sorted_runs, merge_runs
+import compressed
+
+"""
+normalization table ids derived from the values themselves
+(--hash-ids) instead of numbered in order of appearance.
+
+the id of a value is the first 63 bits of its blake2b hash,
+so it fits a postgres bigint and is the same whichever
+process, machine or dump version sees the value first.
+shards of the dump can then intern on their own, with no
+shared counter, and their tables merge by taking the union
+of the normalization rows (see shards.py).
+
+two values with the same id would be merged into one row.
+with n values that happens with a probability of about
+n^2 / 2^64 (about 1e-6 for 5 million values), so collisions
+are checked rather than avoided: the interners check the
+values they see, and merging checks the union of the
+shards (see union).
+"""
+
+# memory for sorting normalization rows when merging
+SORT_MEMORY = 256 * 1024 * 1024
+
+class CollisionError(ValueError):
+    pass
+
+def value_id(value):
+    """
+    the id of a (stripped) normalization table value
+    """
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+def collision(i, value, other):
+    return CollisionError(f"hash id collision: {value!r} and {other!r} both have id {i}")
+
+def _rows(paths):
+    for path in paths:
+        with compressed.open_read(path, newline='\n') as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    line += '\n'
+                yield line
+
+def union(paths, out, tmpdir=None):
+    """
+    write the distinct (id, value) rows of the normalization
+    table csvs at paths to out, in id order (as text), and
+    return the collisions found: (id, values) for the ids
+    given to more than one value
+    """
+    runs = sorted_runs(_rows(paths), SORT_MEMORY, tmpdir)
+    collisions = []
+    previous = None
+    values = []
+    # equal ids sort next to each other, as "12\t" sorts before "120"
+    for line in merge_runs(runs, tmpdir):
+        i, _, value = line.rstrip('\n').partition('\t')
+        if i != previous:
+            if len(values) > 1:
+                collisions.append((previous, values))
+            previous = i
+            values = [value]
+            out.write(line)
+        elif value not in values:
+            values.append(value)
+    if len(values) > 1:
+        collisions.append((previous, values))
+    return collisions
@@ -0,0 +1,115 @@
+import re
+
+"""
+canonical forms of the external identifiers of an edition,
+shared by the edition parser, which writes them to
+editions_identifiers.csv (the identifiers table), and by
+model/books.py, which looks them up there.
+
+    isbn  - isbn-13 digits. an isbn-10 with a valid check digit
+            is converted (978 prefix, check digit recomputed),
+            an isbn-13 needs a valid check digit. hyphens,
+            blanks and other decoration are ignored
+    lccn  - normalized as the library of congress does: blanks
+            and anything after a slash removed, the serial after
+            a hyphen zero padded to 6 digits, prefix lower case
+    ol    - an OL edition id (OL123M), whose integer key (see
+            ol_ids.py) is the editions primary key, so it is
+            not in the identifiers table
+
+values that are not valid for their scheme are None, and
+are left out of the identifiers table (the raw values are
+still in editions_isbn_10.csv and friends)
+"""
+
+_NOT_ISBN = re.compile(r'[^0-9X]')
+_LCCN = re.compile(r'[a-z]{0,3}(\d{8}|\d{10})')
+_OL_EDITION = re.compile(r'(?:/books/)?(OL\d+M)')
+
+def _isbn_13_check(digits):
+    """
+    check digit of the first 12 digits of an isbn-13
+    """
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return str((10 - total % 10) % 10)
+
+def _isbn_10_valid(digits):
+    if not digits[:9].isdigit() or not (digits[9].isdigit() or digits[9] == 'X'):
+        return False
+    total = sum((10 - i) * int(d) for i, d in enumerate(digits[:9]))
+    total += 10 if digits[9] == 'X' else int(digits[9])
+    return total % 11 == 0
+
+def isbn_13(value):
+    """
+    the isbn-13 of an isbn-10 or isbn-13 string, or None
+    if it is not a valid isbn
+    """
+    digits = _NOT_ISBN.sub('', value.upper())
+    if len(digits) == 10:
+        if not _isbn_10_valid(digits):
+            return None
+        body = '978' + digits[:9]
+        return body + _isbn_13_check(body)
+    if len(digits) == 13 and digits.isdigit() and digits[12] == _isbn_13_check(digits[:12]):
+        return digits
+    return None
+
+def lccn(value):
+    """
+    the normalized lccn (e.g. '85-2 ' -> '85000002'), or None
+    """
+    value = ''.join(value.split()).split('/')[0].lower()
+    if '-' in value:
+        prefix, serial = value.split('-', 1)
+        if not serial.isdigit() or len(serial) > 6:
+            return None
+        value = prefix + serial.zfill(6)
+    return value if _LCCN.fullmatch(value) else None
+
+def ol_edition_id(value):
+    """
+    the edition id of an OL edition id or key (/books/OL123M), or None
+    """
+    match = _OL_EDITION.fullmatch(value.strip())
+    return match.group(1) if match else None
+
+SCHEMES = {'isbn': isbn_13, 'lccn': lccn, 'ol': ol_edition_id}
+
+def candidates(value, scheme=None):
+    """
+    the (scheme, canonical value) pairs an identifier can
+    stand for, in all the schemes or in the given one. a 10
+    digit lccn can also pass as an isbn-10, so there may be
+    more than one
+    """
+    schemes = [scheme] if scheme else list(SCHEMES)
+    result = []
+    for name in schemes:
+        canonical = SCHEMES[name](value)
+        if canonical:
+            result.append((name, canonical))
+    return result
+
+# edition fields -> scheme of their values (see parse_editions)
+FIELDS = [('isbn_10', 'isbn'), ('isbn_13', 'isbn'), ('lccn', 'lccn')]
+
+def write_identifiers(data, key, out):
+    """
+    write the (edition_id, scheme, value) rows of the valid
+    identifiers of an edition record to out, each value once
+    (an edition usually lists its isbn-10 and isbn-13, which
+    are the same isbn)
+    """
+    found = {}
+    for field, scheme in FIELDS:
+        values = data.get(field)
+        if not isinstance(values, list):
+            continue
+        for value in values:
+            if isinstance(value, str):
+                canonical = SCHEMES[scheme](value)
+                if canonical:
+                    found[(scheme, canonical)] = None
+    if found:
+        out.write(''.join(f"{key}\t{scheme}\t{value}\n" for scheme, value in found))
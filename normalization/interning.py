@@ -0,0 +1,256 @@
+import os
+import shutil
+import compressed
+from hash_ids import value_id, collision
+from normalize import GROUPS, id_filename
+
+"""
+assigns the normalization table ids while parsing, so
+the association tables and the normalization tables are
+written directly instead of by a second pass of
+normalize.py over the pairwise csvs.
+
+the parsers still write (key, value) rows for each list
+field; with interning, the sink for a pairwise csv is an
+InternedWriter, which looks the value up in the Interner
+of its normalization table and writes (key, id) to the
+association csv. an Interner gives the next sequence id to
+each value on first sight and writes its row to the
+normalization table right away: values are numbered in the
+order they first appear in the dump. a table of one pairwise
+csv gets the ids normalize.py assigns, but normalize.py numbers
+a table shared by several csvs (places, subjects...) one csv
+after the other, so those have the same values and mappings
+with different id numbers.
+
+in a parallel run every shard (or batch) interns on its own,
+with ids local to the shard, and the Merger folds the shards
+together in order, mapping the local ids to global ones, so
+the output matches a serial run.
+
+with hashed ids (--hash-ids, see hash_ids.py) a HashInterner
+gives each value its hash as id instead, so the ids of every
+shard are already the global ones: merging only drops the
+normalization rows of values another shard wrote first.
+"""
+
+# association rows remapped between writes when merging
+MERGE_ROWS = 10000
+
+# pairwise csv -> its normalization table
+LOOKUPS = {filename: keyfile for keyfile, files in GROUPS.items() for filename in files}
+
+def lookup_path(filename):
+    """
+    the normalization table for a pairwise csv path, next
+    to it, or None if the csv is not normalized
+    """
+    keyfile = LOOKUPS.get(os.path.basename(filename))
+    if keyfile is None:
+        return None
+    return os.path.join(os.path.dirname(filename), keyfile)
+
+def id_path(filename):
+    return os.path.join(os.path.dirname(filename), id_filename(os.path.basename(filename)))
+
+def interned_paths(paths):
+    """
+    the files written in place of paths when interning
+    """
+    result = []
+    for filename in paths:
+        lookup = lookup_path(filename)
+        if lookup is None:
+            result.append(filename)
+            continue
+        result.append(id_path(filename))
+        if lookup not in result:
+            result.append(lookup)
+    return result
+
+def missing_files(paths):
+    """
+    pairwise csvs sharing a normalization table with one of
+    paths but not in paths themselves: interning needs every
+    file of a group in the same run (see parse_dump.py)
+    """
+    names = [os.path.basename(p) for p in paths]
+    missing = []
+    for keyfile, files in GROUPS.items():
+        if any(f in names for f in files):
+            missing += [f for f in files if f not in names]
+    return missing
+
+def read_ids(path):
+    """
+    value -> id of a normalization table csv, to carry on
+    from it (e.g. when resuming a parse)
+    """
+    ids = {}
+    path = compressed.find(path)
+    if os.path.exists(path):
+        with compressed.open_read(path, newline='\n') as file:
+            for line in file:
+                i, _, value = line.rstrip('\n').partition('\t')
+                ids[value] = int(i)
+    return ids
+
+class Interner:
+    """
+    the ids of one normalization table, written to out
+    as (id, value) rows as new values are seen
+    """
+    def __init__(self, out, ids=None):
+        self.out = out
+        self.ids = ids if ids is not None else {}
+
+    def __call__(self, value):
+        # same values as normalize.py, which strips each line
+        # and skips rows with nothing left in the value column
+        value = value.rstrip()
+        if not value:
+            return None
+        i = self.ids.get(value)
+        if i is None:
+            i = len(self.ids) + 1
+            self.ids[value] = i
+            self.out.write(f"{i}\t{value}\n")
+        return i
+
+class HashInterner:
+    """
+    Interner giving each value its hash id (see hash_ids.py).
+    values maps the ids seen so far to their value, to catch
+    collisions
+    """
+    def __init__(self, out, ids=None):
+        self.out = out
+        self.values = {i: value for value, i in ids.items()} if ids else {}
+
+    def __call__(self, value):
+        value = value.rstrip()
+        if not value:
+            return None
+        i = value_id(value)
+        seen = self.values.get(i)
+        if seen is None:
+            self.values[i] = value
+            self.out.write(f"{i}\t{value}\n")
+        elif seen != value:
+            raise collision(i, value, seen)
+        return i
+
+class InternedWriter:
+    """
+    file-like sink for a pairwise csv: the (key, value) rows
+    written to it go to out as (key, id)
+    """
+    def __init__(self, out, interner):
+        self.out = out
+        self.interner = interner
+
+    def write(self, rows):
+        text = ''
+        for row in rows.split('\n'):
+            key, sep, value = row.partition('\t')
+            if not sep:
+                continue
+            i = self.interner(value)
+            if i is not None:
+                text += f"{key}\t{i}\n"
+        if text:
+            self.out.write(text)
+
+    def close(self):
+        self.out.close()
+
+class Lookups:
+    """
+    the interners of one run, shard or batch. open_file(path)
+    opens the association and normalization csvs it writes;
+    with resume, the ids already in the normalization csvs
+    are kept. hashed gives the values their hash ids
+    """
+    def __init__(self, open_file, resume=False, hashed=False):
+        self.open_file = open_file
+        self.resume = resume
+        self.interner = HashInterner if hashed else Interner
+        self.interners = {}
+
+    def open(self, filename):
+        """
+        an opener for parallel.run: an InternedWriter for the
+        pairwise csvs that are normalized, None for the rest
+        """
+        lookup = lookup_path(filename)
+        if lookup is None:
+            return None
+        if lookup not in self.interners:
+            ids = read_ids(lookup) if self.resume else None
+            self.interners[lookup] = self.interner(self.open_file(lookup), ids)
+        return InternedWriter(self.open_file(id_path(filename)), self.interners[lookup])
+
+    def close(self):
+        for interner in self.interners.values():
+            interner.out.close()
+        self.interners = {}
+
+class Merger:
+    """
+    folds the output of the shards of a parallel run, in order,
+    into the association and normalization csvs for paths
+    (carrying on from the ids already in them with resume).
+    with hashed ids the shards' ids are kept as they are
+    """
+    def __init__(self, paths, open_file, resume=False, hashed=False):
+        self.id_files = {id_path(p): lookup_path(p) for p in paths if lookup_path(p) is not None}
+        self.hashed = hashed
+        self.interners = {}
+        self.files = []
+        for lookup in self.id_files.values():
+            if lookup not in self.interners:
+                ids = read_ids(lookup) if resume else None
+                interner = HashInterner if hashed else Interner
+                self.interners[lookup] = interner(self._open(lookup, open_file), ids)
+        self.outs = {filename: self._open(filename, open_file) for filename in self.id_files}
+
+    def _open(self, filename, open_file):
+        file = open_file(filename)
+        self.files.append(file)
+        return file
+
+    def merge(self, read):
+        """
+        add one shard, where read(path) gives the file of the
+        lines the shard wrote to path, or None if it wrote nothing
+        """
+        mappings = {}
+        for lookup, interner in self.interners.items():
+            # local ids count up from 1 in row order
+            mapping = [None]
+            for line in read(lookup) or ():
+                mapping.append(interner(line.rstrip('\n').partition('\t')[2]))
+            mappings[lookup] = mapping
+
+        for filename, lookup in self.id_files.items():
+            shard = read(filename)
+            if shard is None:
+                continue
+            if self.hashed:
+                # the shard's ids need no remapping
+                shutil.copyfileobj(shard, self.outs[filename])
+                continue
+            mapping = mappings[lookup]
+            text = []
+            for line in shard:
+                key, _, local = line.rstrip('\n').rpartition('\t')
+                text.append(f"{key}\t{mapping[int(local)]}\n")
+                if len(text) >= MERGE_ROWS:
+                    self.outs[filename].write(''.join(text))
+                    text = []
+            if text:
+                self.outs[filename].write(''.join(text))
+
+    def close(self):
+        for file in self.files:
+            file.close()
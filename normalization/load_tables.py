@@ -0,0 +1,493 @@
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+import compressed
+import copy_sink
+import derived
+import pg
+from extsort import sorted_runs, merge_runs
+
+"""
+loads the csvs of a parse into the database, in place of
+running load_tables.sql by hand.
+
+1. the csvs in --dir that have a table (copy_sink.COPY_TARGETS,
+   the same csvs and columns as load_tables.sql) are found,
+   plain or compressed (see compressed.py; they are
+   decompressed on the fly as COPY reads them).
+   the primary keys, unique and foreign key constraints and
+   indexes of their tables are saved to a json file in --dir
+   and dropped, so the rows go in without index maintenance
+2. the tables are COPYed side by side, --jobs at a time,
+   each on its own connection, the largest csvs first. with
+   --sort, the association csvs over --sort-mb are sorted
+   by key first (an external sort, as in normalize.py) so
+   the rows of one edition, work or author are stored
+   together and a key lookup reads few pages
+3. the primary keys, unique constraints and indexes are
+   built, again side by side, plus an index on every foreign
+   key column that has none (postgres does not index them,
+   and the searches join on them). the foreign keys are
+   added back NOT VALID: the dump has dangling keys
+   between the two, the tables derived from the loaded ones
+   (see derived.py) are emptied with them and built from
+   them in bulk
+4. every table is ANALYZEd, so the planner has statistics
+   from the start
+
+each step is timed per table. the tables must be empty
+(--truncate empties them first); if the load fails part
+way, running it again picks up the saved constraints and
+indexes from the json file.
+
+with --shadow, the tables of the live catalog are left alone
+while the app keeps using them: the new ones are created
+like them in a shadow schema and loaded, indexed and
+analyzed there (the connections put the shadow schema first
+in their search_path, so the same statements apply). then,
+in one short transaction, the live tables are moved to an
+old schema and the shadow ones to public, and the foreign
+keys of the user tables (reviews, list_books...) that
+pointed at the old tables are pointed at the new ones. the
+app resolves table names through its search_path, so its
+next query sees the new catalog, and the user tables are
+never touched. the old tables are then dropped, or kept
+with --keep-old to switch back by hand
+"""
+
+# keeps the dropped constraints and indexes until they are rebuilt
+SCHEMA_FILE = '.load_schema.json'
+# per job, see --sort-memory and --index-memory
+DEFAULT_SORT_MEMORY = 256
+DEFAULT_INDEX_MEMORY = 1024
+DEFAULT_SORT_MB = 64
+
+# table -> (the tables it is built from, function filling it on a cursor)
+DERIVED = {module.TABLE: (module.SOURCES, module.build) for module in derived.MODULES}
+
+# schemas of the tables being loaded and of the replaced ones, with --shadow
+SHADOW_SCHEMA = 'catalog_shadow'
+OLD_SCHEMA = 'catalog_old'
+# the swap waits this long for the app's queries to let go of the tables,
+# and gives up and tries again rather than hold up the queries behind it
+SWAP_LOCK_TIMEOUT = '5s'
+SWAP_ATTEMPTS = 10
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=".",
+                        help="directory with the csvs (default the current directory)")
+    parser.add_argument('--db', default=None,
+                        help="database url (default DB_URL in model/database.py)")
+    parser.add_argument('--jobs', type=int, default=4,
+                        help="tables loaded and indexed at once, one connection each (default 4)")
+    parser.add_argument('--sort', action='store_true',
+                        help="sort the large association csvs by key before loading them")
+    parser.add_argument('--sort-mb', type=int, default=DEFAULT_SORT_MB,
+                        help=f"csvs over this size in MB are sorted with --sort (default {DEFAULT_SORT_MB})")
+    parser.add_argument('--sort-memory', type=int, default=DEFAULT_SORT_MEMORY,
+                        help=f"memory for each sort in MB (default {DEFAULT_SORT_MEMORY})")
+    parser.add_argument('--tmpdir', default=None,
+                        help="directory for the sorted runs (default the system temp dir)")
+    parser.add_argument('--index-memory', type=int, default=DEFAULT_INDEX_MEMORY,
+                        help=f"maintenance_work_mem in MB for each index build (default {DEFAULT_INDEX_MEMORY})")
+    parser.add_argument('--truncate', action='store_true',
+                        help="empty the tables before loading them")
+    parser.add_argument('--shadow', action='store_true',
+                        help="load into a shadow schema and swap it in, so the app keeps working")
+    parser.add_argument('--keep-old', action='store_true',
+                        help=f"with --shadow, keep the replaced tables in the {OLD_SCHEMA} schema")
+    return parser.parse_args()
+
+def discover(directory):
+    """
+    (path, table, columns) of the csvs in directory that
+    have a table, largest first
+    """
+    found = []
+    for name, (table, columns) in copy_sink.COPY_TARGETS.items():
+        path = compressed.find(os.path.join(directory, name))
+        if os.path.exists(path):
+            found.append((path, table, columns))
+    return sorted(found, key=lambda csv: compressed.estimated_size(csv[0]), reverse=True)
+
+def existing_tables(conn, tables):
+    with conn.cursor() as cur:
+        cur.execute("SELECT t FROM unnest(%s::text[]) t WHERE to_regclass(t) IS NOT NULL", (list(tables),))
+        return {row[0] for row in cur.fetchall()}
+
+def non_empty_tables(conn, tables):
+    result = []
+    with conn.cursor() as cur:
+        for table in tables:
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+            if cur.fetchone()[0]:
+                result.append(table)
+    return result
+
+def save_schema(conn, tables, path):
+    """
+    the constraints and indexes to drop before the load, from
+    the json file of a load that failed part way if there is
+    one (by then they are dropped), or else from the database
+    """
+    if os.path.exists(path):
+        with open(path) as file:
+            schema = json.load(file)
+        print(f"rebuilding the constraints and indexes saved in {path} by an earlier load")
+        return schema
+    schema = {'constraints': pg.table_constraints(conn, tables), 'indexes': pg.indexes(conn, tables)}
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(schema, file, indent=1)
+    os.replace(tmp, path)
+    return schema
+
+def drop_schema(conn, schema):
+    """
+    drop the saved constraints and indexes, the foreign keys
+    first since they depend on the primary keys
+    """
+    constraints = sorted(schema['constraints'], key=lambda c: c[3] != 'f')
+    pg.drop_constraints(conn, [c[:3] for c in constraints], commit=False)
+    with conn.cursor() as cur:
+        for _, name, _, _ in schema['indexes']:
+            cur.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+
+def _connect(db_url, index_memory=None, in_schema=None):
+    """
+    a connection whose unqualified table names are the ones
+    in in_schema (the shadow schema) if given
+    """
+    conn = pg.connect(db_url)
+    with conn.cursor() as cur:
+        if index_memory:
+            cur.execute(f"SET maintenance_work_mem = '{index_memory}MB'")
+        if in_schema:
+            cur.execute(f"SET search_path = {in_schema}, public")
+    conn.commit()
+    return conn
+
+def _serial_columns(cur, table):
+    """
+    the columns of table filled from a sequence they own
+    (serial, not identity, columns)
+    """
+    cur.execute("""
+        SELECT a.attname, pg_get_serial_sequence(%s, a.attname)
+        FROM pg_attribute a
+        WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped
+          AND a.attidentity = ''
+    """, (table, table))
+    return [(column, sequence) for column, sequence in cur.fetchall() if sequence]
+
+def create_shadow_tables(conn, tables):
+    """
+    (re)create the shadow schema with empty copies of tables,
+    without their constraints and indexes
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SHADOW_SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SHADOW_SCHEMA}")
+        for table in tables:
+            shadow = f"{SHADOW_SCHEMA}.{table}"
+            cur.execute(f"CREATE TABLE {shadow} (LIKE public.{table} "
+                        f"INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING GENERATED)")
+            # the copied defaults draw from the live table's sequence, which
+            # goes away with it: serial columns get a sequence of their own
+            for column, _ in _serial_columns(cur, f"public.{table}"):
+                sequence = f"{SHADOW_SCHEMA}.{table}_{column}_seq"
+                cur.execute(f"CREATE SEQUENCE {sequence} OWNED BY {shadow}.{column}")
+                cur.execute(f"ALTER TABLE {shadow} ALTER COLUMN {column} SET DEFAULT nextval('{sequence}')")
+    conn.commit()
+
+def _lines(path):
+    with compressed.open_read(path, newline='\n') as file:
+        yield from file
+
+def copy_table(db_url, path, table, columns, sort, memory, tmpdir, in_schema=None):
+    """
+    COPY one csv into its table, sorted by key if sort.
+    returns (rows, sort seconds, copy seconds)
+    """
+    sort_seconds = 0.0
+    if sort:
+        start = time.monotonic()
+        runs = sorted_runs(_lines(path), memory, tmpdir)
+        sort_seconds = time.monotonic() - start
+    start = time.monotonic()
+    conn = _connect(db_url, in_schema=in_schema)
+    try:
+        with conn.cursor() as cur:
+            if sort:
+                # the runs are merged as COPY reads them
+                copy_sink.copy_lines(cur, copy_sink.copy_sql(table, columns), merge_runs(runs, tmpdir))
+            else:
+                with compressed.open_binary(path) as file:
+                    cur.copy_expert(copy_sink.copy_sql(table, columns), file, copy_sink.CHUNK_SIZE)
+            rows = cur.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return rows, sort_seconds, time.monotonic() - start
+
+def build_derived(db_url, table, in_schema=None):
+    """
+    fill one derived table from the loaded tables.
+    returns (rows, seconds)
+    """
+    start = time.monotonic()
+    conn = _connect(db_url, in_schema=in_schema)
+    try:
+        with conn.cursor() as cur:
+            rows = DERIVED[table][1](cur)
+        conn.commit()
+    finally:
+        conn.close()
+    return rows, time.monotonic() - start
+
+def fk_indexes(schema, tables):
+    """
+    (table, index name, columns) of an index for each foreign
+    key of tables whose columns do not lead an index already
+    """
+    indexed = {(c[0], tuple(c[4])) for c in schema['constraints'] if c[3] in ('p', 'u')}
+    indexed |= {(i[0], tuple(i[3])) for i in schema['indexes']}
+    result = []
+    for table, _, _, kind, columns in schema['constraints']:
+        if kind != 'f' or table not in tables:
+            continue
+        if any(t == table and tuple(cols[:len(columns)]) == tuple(columns) for t, cols in indexed):
+            continue
+        indexed.add((table, tuple(columns)))
+        result.append((table, f"{table}_{'_'.join(columns)}_idx", columns))
+    return result
+
+def build_table(db_url, table, schema, new_indexes, index_memory, in_schema=None):
+    """
+    build the primary key, unique constraints and indexes of
+    one table, and move its sequences past the loaded ids.
+    returns the seconds it took
+    """
+    start = time.monotonic()
+    conn = _connect(db_url, index_memory, in_schema)
+    try:
+        with conn.cursor() as cur:
+            for t, name, definition, kind, _ in schema['constraints']:
+                if t == table and kind in ('p', 'u'):
+                    cur.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}')
+            for t, _, definition, _ in schema['indexes']:
+                if t == table:
+                    if in_schema:
+                        # pg_get_indexdef names the table with its schema
+                        definition = re.sub(r' ON (ONLY )?public\.', r' ON \1', definition, count=1)
+                    cur.execute(definition)
+            for t, name, columns in new_indexes:
+                if t == table:
+                    cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+            # the lookup tables are loaded with their ids
+            for column, sequence in _serial_columns(cur, table):
+                cur.execute(f"SELECT setval(%s, COALESCE(MAX({column}), 0) + 1, false) FROM {table}",
+                            (sequence,))
+        conn.commit()
+    finally:
+        conn.close()
+    return time.monotonic() - start
+
+def analyze_table(db_url, table, in_schema=None):
+    start = time.monotonic()
+    conn = _connect(db_url, in_schema=in_schema)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"ANALYZE {table}")
+        conn.commit()
+    finally:
+        conn.close()
+    return time.monotonic() - start
+
+def swap(conn, tables, referencing, keep_old=False):
+    """
+    move the live tables to the old schema and the shadow
+    tables to public in one transaction, pointing the foreign
+    keys of the other tables (referencing) at the new ones
+    """
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+                cur.execute(f"DROP SCHEMA IF EXISTS {OLD_SCHEMA} CASCADE")
+                cur.execute(f"CREATE SCHEMA {OLD_SCHEMA}")
+                pg.drop_constraints(conn, referencing, commit=False)
+                for table in tables:
+                    cur.execute(f"ALTER TABLE public.{table} SET SCHEMA {OLD_SCHEMA}")
+                    cur.execute(f"ALTER TABLE {SHADOW_SCHEMA}.{table} SET SCHEMA public")
+                # the user rows may point at editions that are gone from the new dump
+                pg.add_constraints(conn, referencing, not_valid=True, commit=False)
+            conn.commit()
+            break
+        except pg.lock_errors() as e:
+            conn.rollback()
+            print(f"swap attempt {attempt}: {str(e).strip()}")
+    else:
+        raise RuntimeError(f"could not lock the tables to swap them in {SWAP_ATTEMPTS} attempts")
+
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA {SHADOW_SCHEMA}")
+        if not keep_old:
+            cur.execute(f"DROP SCHEMA {OLD_SCHEMA} CASCADE")
+    conn.commit()
+
+def _run_jobs(jobs, func, tasks):
+    """
+    func(*task) for each task, jobs at a time. returns a list
+    of (task, result or None, exception or None)
+    """
+    def run(task):
+        try:
+            return task, func(*task), None
+        except Exception as e:
+            return task, None, e
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(run, tasks))
+
+def _seconds(value):
+    return f"{value:.1f}s" if value else "-"
+
+def print_timings(stats, seconds):
+    print(f"{'table':<30} {'rows':>12} {'sort':>8} {'copy':>8} {'index':>8} {'analyze':>8}")
+    for table, s in sorted(stats.items(), key=lambda item: -item[1].get('copy', 0)):
+        rows = s.get('rows', -1)
+        print(f"{table:<30} {rows if rows >= 0 else '?':>12} {_seconds(s.get('sort')):>8} "
+              f"{_seconds(s.get('copy')):>8} {_seconds(s.get('index')):>8} {_seconds(s.get('analyze')):>8}")
+    print(f"loaded {len(stats)} tables in {seconds:.1f}s")
+
+def load(args):
+    db_url = args.db or pg.default_db_url()
+    schema_path = os.path.join(args.dir, SCHEMA_FILE)
+    in_schema = SHADOW_SCHEMA if args.shadow else None
+    start = time.monotonic()
+
+    conn = pg.connect(db_url)
+    try:
+        csvs = discover(args.dir)
+        existing = existing_tables(conn, [table for _, table, _ in csvs])
+        for path, table, _ in csvs:
+            if table not in existing:
+                print(f"skipping {os.path.basename(path)}: there is no {table} table")
+        csvs = [csv for csv in csvs if csv[1] in existing]
+        if not csvs:
+            print(f"no csvs to load in {args.dir}")
+            return
+        tables = [table for _, table, _ in csvs]
+        derived_tables = [table for table in existing_tables(conn, DERIVED)
+                          if set(DERIVED[table][0]) & set(tables)]
+        tables += derived_tables
+
+        if args.shadow:
+            # the live tables keep their constraints and indexes
+            schema = {'constraints': pg.table_constraints(conn, tables), 'indexes': pg.indexes(conn, tables)}
+            create_shadow_tables(conn, tables)
+        else:
+            non_empty = non_empty_tables(conn, tables)
+            if non_empty and not args.truncate:
+                print(f"not loading: {', '.join(non_empty)} already have rows "
+                      f"(use --truncate to empty them, --shadow to replace them while "
+                      f"the app runs, or delta.py to update them)")
+                return
+            schema = save_schema(conn, tables, schema_path)
+            drop_schema(conn, schema)
+            if args.truncate:
+                with conn.cursor() as cur:
+                    cur.execute(f"TRUNCATE {', '.join(tables)}")
+                conn.commit()
+    finally:
+        conn.close()
+    if args.shadow:
+        retry = "the live tables are untouched, run again"
+    else:
+        retry = f"run again with --truncate ({schema_path} keeps the constraints and indexes)"
+
+    stats = {table: {} for table in tables}
+    sort_bytes = args.sort_mb * 1024 * 1024
+    tasks = []
+    for path, table, columns in csvs:
+        # association tables: the ones keyed by a main table id
+        sort = args.sort and columns[0] != 'id' and compressed.estimated_size(path) > sort_bytes
+        tasks.append((db_url, path, table, columns, sort, args.sort_memory * 1024 * 1024, args.tmpdir, in_schema))
+    failed = []
+    for task, result, error in _run_jobs(args.jobs, copy_table, tasks):
+        table = task[2]
+        if error is not None:
+            print(f"COPY into {table} failed: {error}")
+            failed.append(table)
+            continue
+        stats[table]['rows'], stats[table]['sort'], stats[table]['copy'] = result
+        print(f"{table}: {result[0]} rows in {result[2]:.1f}s")
+    if failed:
+        print(f"failed: {', '.join(failed)}. {retry}")
+        return
+
+    tasks = [(db_url, table, in_schema) for table in derived_tables]
+    for task, result, error in _run_jobs(args.jobs, build_derived, tasks):
+        table = task[1]
+        if error is not None:
+            print(f"building {table} failed: {error}")
+            failed.append(table)
+            continue
+        stats[table]['rows'], stats[table]['copy'] = result
+        print(f"{table}: built {result[0]} rows in {result[1]:.1f}s")
+    if failed:
+        print(f"failed: {', '.join(failed)}. {retry}")
+        return
+
+    new_indexes = fk_indexes(schema, set(tables))
+    tasks = [(db_url, table, schema, new_indexes, args.index_memory, in_schema) for table in tables]
+    for task, seconds, error in _run_jobs(args.jobs, build_table, tasks):
+        if error is not None:
+            print(f"building the indexes of {task[1]} failed: {error}")
+            failed.append(task[1])
+        else:
+            stats[task[1]]['index'] = seconds
+    if failed:
+        print(f"failed: {', '.join(failed)}. fix the rows and {retry}")
+        return
+
+    foreign_keys = [c[:3] for c in schema['constraints'] if c[3] == 'f']
+    # with --shadow, the foreign keys of the other tables are moved at the swap
+    referencing = [c[:3] for c in schema['constraints'] if c[3] == 'f' and c[0] not in tables] if args.shadow else []
+    conn = _connect(db_url, in_schema=in_schema)
+    try:
+        pg.add_constraints(conn, [fk for fk in foreign_keys if fk not in referencing], not_valid=True)
+    finally:
+        conn.close()
+
+    tasks = [(db_url, table, in_schema) for table in tables]
+    for task, seconds, error in _run_jobs(args.jobs, analyze_table, tasks):
+        if error is not None:
+            print(f"ANALYZE {task[1]} failed: {error}")
+        else:
+            stats[task[1]]['analyze'] = seconds
+
+    if args.shadow:
+        conn = pg.connect(db_url)
+        try:
+            swap(conn, tables, referencing, args.keep_old)
+        finally:
+            conn.close()
+        kept = f", the old tables are in the {OLD_SCHEMA} schema" if args.keep_old else ""
+        print(f"swapped in the new {', '.join(sorted(tables))}{kept}")
+    else:
+        os.remove(schema_path)
+
+    print_timings(stats, time.monotonic() - start)
+
+def main():
+    load(parse_args())
+
+
+if __name__ == '__main__':
+    main()
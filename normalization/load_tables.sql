@@ -57,6 +57,9 @@ copy editions_isbn_10 (edition_id,isbn_10) from 'editions_isbn_10.csv'  with(for
 --editions_isbn_13 table
 copy editions_isbn_13 (edition_id,isbn_13) from 'editions_isbn_13.csv'  with(format csv, delimiter E'\t', QUOTE E'\b');
 
+-- identifiers table (canonical isbn-13s and lccns, see identifiers.py)
+copy identifiers (edition_id, scheme, value) from 'editions_identifiers.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
+
 -- editions_lccn, lccn tables
 copy lccn (id, lccn) from 'lccn.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
 copy editions_lccn (edition_id, lccn_id) from 'editions_lccn_id.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
@@ -66,9 +69,11 @@ copy places (id, place) from 'places.csv' with(format csv, delimiter E'\t', QUOT
 copy editions_publish_places (edition_id, place_id) from 'editions_publish_places_id.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
 copy authors_locations (author_id, location_id) from 'authors_location_id.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
 
--- authors_photos
-copy photos (id, photo) from 'photos.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
-copy authors_photos (author_id, photo_id) from 'authors_photos_id.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
+-- authors_photos table
+copy authors_photos (author_id, photo) from 'authors_photos.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
+
+-- aliases table (redirected ids and the id they resolve to, see aliases.py)
+copy aliases (id, target_id) from 'aliases.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
 
 -- publishers, editions_publishers tables
 copy publishers (id, publisher) from 'publishers.csv' with(format csv, delimiter E'\t', QUOTE E'\b');
@@ -84,3 +89,9 @@ copy editions_work_titles (edition_id, work_title_id) from 'editions_work_titles
 
 -- editions_works
 COPY editions_works (edition_id, work_id) FROM 'editions_works.csv' WITH (FORMAT csv, DELIMITER E'\t', QUOTE E'\b');
+
+-- editions_search table, built from the tables above (the same statement as search_index.build)
+insert into editions_search (edition_id, search_vector) select e.id, setweight(to_tsvector('english', coalesce(e.title, '')), 'A') || setweight(to_tsvector('english', concat_ws(' ', e.subtitle, e.full_title)), 'B') || setweight(to_tsvector('english', coalesce(n.names, '')), 'C') from editions e left join (select ea.edition_id, string_agg(a.name, ' ') as names from editions_authors ea join authors a on a.id = ea.author_id group by ea.edition_id) n on n.edition_id = e.id;
+
+-- edition_summary table, built from the tables above (the same statement as edition_summary.build)
+insert into edition_summary (edition_id, title, author_ids, author_names, publish_places, publishers, publish_date, cover) select e.id, e.title, a.ids, a.names, p.places, pb.publishers, e.publish_date, c.cover from editions e left join (select x.edition_id, array_agg(au.id) as ids, array_agg(au.name) as names from (select distinct edition_id, author_id from editions_authors) x join authors au on au.id = x.author_id group by x.edition_id) a on a.edition_id = e.id left join (select x.edition_id, array_agg(pl.place) as places from (select distinct edition_id, place_id from editions_publish_places) x join places pl on pl.id = x.place_id group by x.edition_id) p on p.edition_id = e.id left join (select x.edition_id, array_agg(pu.publisher) as publishers from (select distinct edition_id, publisher_id from editions_publishers) x join publishers pu on pu.id = x.publisher_id group by x.edition_id) pb on pb.edition_id = e.id left join (select x.edition_id, (array_agg(x.cover order by x.id))[1] as cover from editions_covers x group by x.edition_id) c on c.edition_id = e.id;
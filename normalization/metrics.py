@@ -0,0 +1,252 @@
+import gzip
+import io
+import json
+import time
+from utils import decode_stats
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+"""
+throughput and error counters of a parse.
+
+the counters are kept per process, like decode_stats in
+utils: each worker counts its own lines and the runner adds
+the workers' deltas into the parent's counters (see
+snapshot, delta and add).
+
+    lines            lines handed to a parser
+    types            lines per type column (/type/edition...)
+    extract_seconds  time in the parsers, less json decoding
+                     and writing
+    write_seconds    time in the write calls of the output
+                     files, which only see the buffered writes
+                     to disk (see open_timed)
+    errors           field -> problems: 'json' for lines that
+                     did not decode, 'record' for lines that
+                     failed otherwise, or the field (e.g.
+                     'description') that could not be read
+
+rejected lines and unreadable fields are written to a gzip
+compressed quarantine file, one json object per line, rather
+than printed. a periodic stats line shows the progress and a
+json report is written when the parse finishes
+"""
+
+# seconds between stats lines
+STATS_SECONDS = 10
+# next to the first output file
+QUARANTINE_FILE = 'rejected.jsonl.gz'
+REPORT_FILE = 'parse_report.json'
+
+counters = {'lines': 0, 'extract_seconds': 0.0, 'write_seconds': 0.0, 'types': {}, 'errors': {}}
+
+# where reject and field_error write, see set_quarantine
+_quarantine = None
+
+def snapshot():
+    """
+    a copy of the counters (and decode_stats) of this process
+    """
+    return {'decode': dict(decode_stats),
+            **{k: dict(v) if isinstance(v, dict) else v for k, v in counters.items()}}
+
+def delta(before):
+    """
+    the counters since the before snapshot, for pool workers
+    that are reused across tasks
+    """
+    now = snapshot()
+    result = {}
+    for k, v in now.items():
+        if isinstance(v, dict):
+            result[k] = {key: n - before[k].get(key, 0) for key, n in v.items()
+                         if n != before[k].get(key, 0)}
+        else:
+            result[k] = v - before[k]
+    return result
+
+def add(deltas):
+    """
+    add a worker's deltas into the counters of this process
+    """
+    for k, v in deltas.items():
+        if k == 'decode':
+            for key, n in v.items():
+                decode_stats[key] += n
+        elif isinstance(v, dict):
+            for key, n in v.items():
+                counters[k][key] = counters[k].get(key, 0) + n
+        else:
+            counters[k] += v
+
+def parse(parse_line, line, out):
+    """
+    parse_line(line, out), counting the line and its time
+    """
+    start = time.perf_counter()
+    written = counters['write_seconds']
+    decoded = decode_stats['seconds']
+    parse_line(line, out)
+    seconds = time.perf_counter() - start
+    counters['extract_seconds'] += (seconds - (counters['write_seconds'] - written)
+                                    - (decode_stats['seconds'] - decoded))
+    counters['lines'] += 1
+    kind = line[:line.find('\t')] if line.startswith('/type/') else 'other'
+    counters['types'][kind] = counters['types'].get(kind, 0) + 1
+
+class _TimedFileIO(io.FileIO):
+    def write(self, b):
+        start = time.perf_counter()
+        try:
+            return super().write(b)
+        finally:
+            counters['write_seconds'] += time.perf_counter() - start
+
+def open_timed(filename, mode="w", buffering=io.DEFAULT_BUFFER_SIZE):
+    """
+    open(filename, mode) for a text output file, adding the
+    time spent writing to disk to write_seconds
+    """
+    raw = _TimedFileIO(filename, mode)
+    return io.TextIOWrapper(io.BufferedWriter(raw, buffering))
+
+class Quarantine:
+    """
+    the gzip compressed quarantine file. flush ends the gzip
+    member so the file is complete up to there (the checkpoints
+    flush it like the csvs); the members read back as one
+    stream, so shards can be concatenated as well
+    """
+    def __init__(self, filename, mode="w"):
+        self.file = open(filename, mode + "b")
+        self.gz = gzip.GzipFile(fileobj=self.file, mode="wb")
+
+    def write(self, text):
+        self.gz.write(text.encode('utf-8'))
+
+    def flush(self):
+        self.gz.close()
+        self.file.flush()
+        self.gz = gzip.GzipFile(fileobj=self.file, mode="wb")
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.gz.close()
+        self.file.close()
+
+def set_quarantine(sink):
+    """
+    send rejected lines to sink (a Quarantine or any file-like
+    object taking text), or print them if sink is None
+    """
+    global _quarantine
+    _quarantine = sink
+
+def _error(field, error, key=None, line=None):
+    counters['errors'][field] = counters['errors'].get(field, 0) + 1
+    if _quarantine is None:
+        print(f"Error in {field}: {error}")
+        if line is not None:
+            print(line)
+        return
+    entry = {'field': field, 'error': str(error), 'key': key}
+    if line is not None:
+        entry['line'] = line.rstrip('\n')
+    _quarantine.write(json.dumps(entry) + '\n')
+
+def reject(line, error):
+    """
+    count and quarantine a line a parser could not handle
+    """
+    field = 'json' if isinstance(error, json.JSONDecodeError) else 'record'
+    key = line.split('\t', 2)[1] if line.count('\t') >= 2 else None
+    _error(field, error, key, line)
+
+def field_error(field, data, error):
+    """
+    count and quarantine a field that could not be read (the
+    record is still written, with the field empty)
+    """
+    key = data.get('key') if isinstance(data, dict) else None
+    _error(field, error, key)
+
+def peak_rss():
+    """
+    (peak RSS of this process, of the largest finished child) in MB
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KB on linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children or None
+
+class Progress:
+    """
+    prints a stats line every seconds while bytes of the input
+    (of total, if known) are parsed
+    """
+    def __init__(self, total=None, seconds=STATS_SECONDS):
+        self.total = total
+        self.seconds = seconds
+        self.start = time.monotonic()
+        self.last = self.start
+        self.bytes = 0
+
+    def update(self, done):
+        """
+        done bytes parsed so far, printing a line when one is due
+        """
+        self.bytes = done
+        now = time.monotonic()
+        if self.seconds > 0 and now - self.last >= self.seconds:
+            self.last = now
+            print(self.line(now - self.start))
+
+    def line(self, elapsed):
+        elapsed = max(elapsed, 1e-9)
+        done = f" ({100 * self.bytes / self.total:.1f}%)" if self.total else ""
+        errors = sum(counters['errors'].values())
+        rss, _ = peak_rss()
+        memory = f", peak rss {rss:.0f} MB" if rss is not None else ""
+        return (f"stats: {elapsed:.0f}s, {self.bytes / 1e6:.1f} MB{done}, {counters['lines']} lines, "
+                f"{counters['lines'] / elapsed:.0f} lines/s, {self.bytes / 1e6 / elapsed:.1f} MB/s, "
+                f"{errors} errors{memory}")
+
+def report(path, seconds, parsed_bytes, workers, decoder):
+    """
+    the final report of a parse, as a dict
+    """
+    seconds = max(seconds, 1e-9)
+    rss, workers_rss = peak_rss()
+    return {
+        'input': path,
+        'workers': workers,
+        'seconds': round(seconds, 3),
+        'lines': counters['lines'],
+        'bytes': parsed_bytes,
+        'lines_per_second': round(counters['lines'] / seconds, 1),
+        'bytes_per_second': round(parsed_bytes / seconds, 1),
+        'types': dict(sorted(counters['types'].items())),
+        # summed over all workers, so they can exceed the wall time
+        'cpu_seconds': {
+            'decode': round(decode_stats['seconds'], 3),
+            'extract': round(counters['extract_seconds'], 3),
+            'write': round(counters['write_seconds'], 3),
+        },
+        'json_decoder': decoder,
+        'json_records': decode_stats['records'],
+        'peak_rss_mb': {'main': rss and round(rss, 1),
+                        'worker': workers_rss and round(workers_rss, 1) if workers > 1 else None},
+        'errors': dict(sorted(counters['errors'].items())),
+    }
+
+def write_report(filename, stats):
+    with open(filename, 'w') as file:
+        json.dump(stats, file, indent=1)
+        file.write('\n')
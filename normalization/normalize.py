@@ -2,27 +2,93 @@
 takes a csv (like edition_series) and splits into
 seriable table + association table
 can merge multiple files : 2 pairwise files +
-generates one place table + 2 assoc tables 
+generates one place table + 2 assoc tables
 (like for author_locations and editions_publish_places)
 """
 
+import argparse
+import os
+import aliases
+import compressed
+import dag
+from extsort import sorted_runs, merge_runs
+
 """
-take one or more files where each row contains 
-two columns as (work/edition/author, value) 
-and create a normalized file for "value" 
+take one or more files where each row contains
+two columns as (work/edition/author, value)
+and create a normalized file for "value"
 and the association table for each of the input files.
+
+parse_dump.py --intern does the same while parsing,
+without writing the pairwise files first (see interning.py)
+
+the unique values are kept in a dict, which for the big
+groups (subjects, publishers...) of the full dump needs far
+more memory than most machines have. groups whose dict could
+exceed the memory ceiling are normalized with an external
+sort instead: the rows are sorted by value in runs spilled
+to disk, and merging the runs brings equal values together,
+so each new value gets the next sequence number as it goes
+by. the ids are then in value order rather than in order of
+first appearance, and the association rows are grouped by
+value instead of being in the order of the input.
+
+the pairwise csvs are read whether the parsers wrote them
+plain or compressed, and with --compress the tables are
+written compressed (see compressed.py).
+
+the redirect chains of redirects.csv are resolved into the
+aliases table as one more step (see aliases.py).
 """
 
+# worst case memory of the unique values dict (every value
+# unique) per byte of pairwise csv, used to pick the path
+DICT_BYTES_PER_BYTE = 4
+# default memory ceiling in MB
+DEFAULT_MEMORY = 4096
+# smallest sorted run, however low the ceiling
+MIN_RUN_BYTES = 16 * 1024 * 1024
+
+# normalization table -> the pairwise csvs whose values it holds
+GROUPS = {
+    'places.csv': ['authors_location.csv', 'editions_publish_places.csv'],
+    'subjects.csv': ['editions_subjects.csv', 'works_subjects.csv'],
+    'lccn.csv': ['editions_lccn.csv'],
+    'work_titles.csv': ['editions_work_titles.csv'],
+    'contributors.csv': ['editions_contributors.csv'],
+    'genres.csv': ['editions_genres.csv'],
+    'languages.csv': ['editions_languages.csv', 'works_orginal_languages.csv'],
+    'lc_classifications.csv': ['editions_lc_classifications.csv', 'works_lc_classifications.csv'],
+    'publishers.csv': ['editions_publishers.csv'],
+    'series.csv': ['editions_series.csv'],
+    'dewey_number.csv': ['works_dewey_number.csv'],
+    'other_titles.csv': ['works_other_titles.csv'],
+}
+
+# written by parse_redirects.py, resolved into the aliases table
+REDIRECTS_FILE = 'redirects.csv'
+ALIASES_FILE = 'aliases.csv'
+
+def id_filename(filename):
+    """
+    the association table csv for a pairwise csv
+    (e.g. editions_series.csv -> editions_series_id.csv)
+    """
+    columns = filename.split(".")
+    if len(columns)!=2:
+        return None
+    return columns[0]+"_id.csv"
+
 def extract_unique_values(files_to_be_normalized, keyfile):
     """
-    extract the unique values for the columns to be normalized 
+    extract the unique values for the columns to be normalized
     and assign a sequence number for each unique value
     """
 
     keys = {} # track the unique values and assign a sequence number
     seq = 1
     for filename in files_to_be_normalized:
-        with open(filename, 'r') as file:
+        with compressed.open_read(filename) as file:
             for line in file:
                 columns = line.rstrip().split('\t')
                 if len(columns)!=2:
@@ -31,9 +97,9 @@ def extract_unique_values(files_to_be_normalized, keyfile):
                     keys[columns[1]] = seq
                     seq += 1
     # the normalization table
-    with open(keyfile,'w') as kf:
+    with compressed.create(keyfile) as kf:
         for k in keys:
-            kf.write(f"{keys[k]}\t{k}\n")    
+            kf.write(f"{keys[k]}\t{k}\n")
     return keys
 
 def normalize(files_to_be_normalized, keys):
@@ -41,11 +107,10 @@ def normalize(files_to_be_normalized, keys):
     create the csv file with the normalized data
     """
     for filename in files_to_be_normalized:
-        columns = filename.split(".")
-        if len(columns)!=2:
+        filename_id = id_filename(filename)
+        if filename_id is None:
             continue
-        filename_id = columns[0]+"_id.csv"
-        with open(filename,"r") as file, open(filename_id,"w") as file_id:
+        with compressed.open_read(filename) as file, compressed.create(filename_id) as file_id:
              for line in file:
                 columns = line.rstrip().split('\t')
                 if len(columns)!=2:
@@ -56,40 +121,107 @@ def normalize(files_to_be_normalized, keys):
                     print("Missing ",columns[1],"\n",line,"\n")
 
 
-unique_values = extract_unique_values(["authors_location.csv","editions_publish_places.csv"], 'testlib/places.csv')
-normalize(["authors_location.csv","editions_publish_places.csv"], unique_values)
-
-unique_value = extract_unique_values(["editions_subjects","works_subjects.csv"],"subjects.csv")
-normalize(["editions_subjects","works_subjects.csv"],unique_values)
-
-unique_value = extract_unique_values(["editions_lccn.csv"],"work_titles")
-normalize(["editions_lccn.csv"],unique_values)
-
-
-unique_value = extract_unique_values(["authors_photos.csv"],"photos.csv")
-normalize(["authors_photos.csv"],unique_values)
-
-unique_value = extract_unique_values(["editions_contributors.csv"],"contributors.csv")
-normalize(["editions_contributors.csv"],unique_values)
-
-
-unique_value = extract_unique_values(["editions_genres.csv"],"genres.csv")
-normalize(["editions_genres.csv"],unique_values)
-
-unique_value = extract_unique_values(["editions_languages.csv","works_orginal_languages.csv"],"languages.csv")
-normalize(["editions_languages.csv","works_orginal_languages.csv"],unique_values)
-
-unique_value = extract_unique_values(["editions_lc_classifications.csv","works_lc_classifications.csv"],"lc_classifications.csv")
-normalize(["editions_lc_classifications.csv","works_lc_classifications.csv"],unique_values)
-
-unique_value = extract_unique_values(["editions_publishers.csv"],"publishers.csv")
-normalize(["editions_publishers.csv"],unique_values)
-
-unique_value = extract_unique_values(["editions_series.csv"],"series.csv")
-normalize(["editions_series.csv"],unique_values)
+def sort_rows(files_to_be_normalized):
+    """
+    the rows of the files as value\tfile index\tkey lines,
+    so that sorting them sorts by value
+    """
+    for index, filename in enumerate(files_to_be_normalized):
+        with compressed.open_read(filename) as file:
+            for line in file:
+                columns = line.rstrip().split('\t')
+                if len(columns)!=2:
+                    continue
+                yield f"{columns[1]}\t{index}\t{columns[0]}\n"
 
-unique_value = extract_unique_values(["works_dewey_number.csv"],"dewey_number.csv")
-normalize(["works_dewey_number.csv"],unique_values)
+def normalize_external(files_to_be_normalized, keyfile, memory, tmpdir=None):
+    """
+    extract_unique_values + normalize with an external sort,
+    using runs of about memory bytes
+    """
+    files = [f for f in files_to_be_normalized if id_filename(f) is not None]
+    runs = sorted_runs(sort_rows(files), max(memory, MIN_RUN_BYTES), tmpdir)
+    print(f"{keyfile}: merging {len(runs)} sorted runs")
+
+    outputs = [compressed.create(id_filename(f)) for f in files]
+    try:
+        with compressed.create(keyfile) as kf:
+            seq = 0
+            previous = None
+            for line in merge_runs(runs, tmpdir):
+                value, index, key = line.rstrip('\n').split('\t')
+                if value != previous:
+                    seq += 1
+                    kf.write(f"{seq}\t{value}\n")
+                    previous = value
+                outputs[int(index)].write(f"{key}\t{seq}\n")
+    finally:
+        for output in outputs:
+            output.close()
+
+def fits_in_memory(files_to_be_normalized, memory):
+    """
+    whether the unique values dict of the files stays under
+    memory bytes even if every value is unique
+    """
+    paths = [compressed.find(f) for f in files_to_be_normalized]
+    size = sum(compressed.estimated_size(p) for p in paths if os.path.exists(p))
+    return size * DICT_BYTES_PER_BYTE <= memory
 
-unique_value = extract_unique_values(["works_other_titles.csv"],"other_titles.csv")
-normalize(["works_other_titles.csv"],unique_values)
+def normalize_group(keyfile, files, memory, tmpdir=None, codec=None):
+    """
+    normalize one group, in memory when it fits
+    """
+    compressed.set_codec(codec)
+    if fits_in_memory(files, memory):
+        unique_values = extract_unique_values(files, keyfile)
+        normalize(files, unique_values)
+    else:
+        normalize_external(files, keyfile, memory, tmpdir)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--memory', type=int, default=DEFAULT_MEMORY,
+                        help=f"memory ceiling in MB: groups that may not fit are "
+                             f"normalized with an external sort (default {DEFAULT_MEMORY})")
+    parser.add_argument('--tmpdir', default=None,
+                        help="directory for the sorted runs (default the system temp dir)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of groups normalized at once (default 1)")
+    parser.add_argument('--force', action='store_true',
+                        help="normalize every group, even if its csvs are unchanged")
+    parser.add_argument('--compress', choices=list(compressed.CODECS), default=None,
+                        help="write the tables compressed (zstd needs the zstandard package)")
+    return parser.parse_args()
+
+def steps(memory, tmpdir=None, codec=None):
+    """
+    one dag step per group: reads the pairwise csvs, writes
+    the normalization table and the association tables
+    (the files on disk, see compressed.py), and the aliases
+    step if the redirects were parsed
+    """
+    compressed.set_codec(codec)
+    result = [dag.Step(keyfile, [compressed.find(f) for f in files],
+                       [compressed.path(f) for f in [keyfile] + [id_filename(f) for f in files if id_filename(f)]],
+                       normalize_group, (keyfile, files, memory, tmpdir, codec))
+              for keyfile, files in GROUPS.items()]
+    redirects = compressed.find(REDIRECTS_FILE)
+    if os.path.exists(redirects):
+        result.append(dag.Step(ALIASES_FILE, [redirects], [compressed.path(ALIASES_FILE)],
+                               aliases.write_aliases, (REDIRECTS_FILE, ALIASES_FILE, codec)))
+    return result
+
+def main():
+    args = parse_args()
+    memory = args.memory * 1024 * 1024
+    if args.compress and not compressed.available(args.compress):
+        print(f"--compress {args.compress} needs the zstandard package (pip install zstandard)")
+        return
+    failed = dag.run(steps(memory, args.tmpdir, args.compress), args.workers, force=args.force)
+    if failed:
+        print(f"failed: {', '.join(sorted(failed))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+the integer keys of editions, works and authors. an Open
+Library id (OL123M, OL45W, OL6A) is its number and its type,
+so it is stored as the integer number * 4 + type (1 for an
+edition, 2 for a work, 3 for an author): OL123M is 493. the
+keys are 4 byte integers rather than strings of up to 12
+bytes, which shrinks the main tables, the big association
+tables (editions_authors, editions_works...) and their indexes,
+and the keys of different types never collide, so the aliases
+table can hold the three together.
+
+the parsers write the keys, and model/ converts them back
+to OL ids in what it returns, so nothing outside the database
+sees them. numbers up to 2^29 (OL536870911M) fit; ids past
+that, or not of that form, are skipped like records without
+a key.
+"""
+
+# type letter -> the low two bits of the key
+TYPES = {'M': 1, 'W': 2, 'A': 3}
+_LETTERS = '?MWA'
+_LIMIT = 1 << 29
+
+def encode_id(ol_id):
+    """
+    the key of an OL id or dump key (/books/OL123M), or None
+    if it is not one (anything but a string, keys included:
+    code that has a key already uses it as it is)
+    """
+    if not isinstance(ol_id, str):
+        return None
+    ol_id = ol_id[ol_id.rfind('/') + 1:]
+    kind = TYPES.get(ol_id[-1:])
+    digits = ol_id[2:-1]
+    if kind is None or not ol_id.startswith('OL') or not (digits.isascii() and digits.isdigit()):
+        return None
+    number = int(digits)
+    if number >= _LIMIT:
+        return None
+    return number << 2 | kind
+
+def decode_id(key):
+    """
+    the OL id of a key, or None
+    """
+    if key is None or not key & 3:
+        return None
+    return f"OL{key >> 2}{_LETTERS[key & 3]}"
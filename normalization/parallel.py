@@ -0,0 +1,563 @@
+import argparse
+import io
+import os
+import shutil
+import time
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from checkpoint import Checkpoint, CHECKPOINT_SECONDS, sync, truncate
+from dump_reader import find_chunks, iter_lines, iter_lines_at, is_compressed
+from interning import Lookups, Merger, lookup_path, interned_paths, missing_files
+from utils import JSON_DECODER
+import compressed
+import metrics
+
+"""
+runs a parse_line(line, out) function over the ol_dump,
+either serially or split into newline aligned byte ranges
+over a process pool. each worker writes its own shard
+of every output file, and the shards are concatenated in
+order at the end so the output matches a serial run.
+
+compressed dumps cannot be split by byte range, so for them
+the parent reads (and decompresses) the lines and hands them
+to the pool in batches; the workers return their output text
+and the parent writes it in batch order.
+
+outputs are given as a dict of name -> filename (dicts can
+be nested), and parse_line receives the same dict with
+every filename replaced by an open file. an opener can
+replace some of those files with other file-like sinks
+(see copy_sink); sinks are only opened in the parent, so
+with workers the batch mode is used for them.
+
+with intern the normalized list fields are written as
+association and normalization tables (see interning); the
+shards and batches each intern on their own and are merged
+in order, the same as the other outputs.
+
+with a checkpoint the run can be resumed after it dies
+(see checkpoint.py). serial and batch runs checkpoint the
+offset of the next line to parse; byte range runs checkpoint
+the chunks whose shards are complete, then, while merging,
+the output files already merged.
+
+the lines are counted and timed by metrics: a stats line is
+printed every few seconds, rejected lines go to the
+quarantine file next to the outputs and a json report is
+written there at the end.
+
+with --compress the csvs are written gzip or zstd compressed
+(see compressed.py), the shards too, which concatenate the
+same way.
+
+with a span only that byte range of the dump is parsed: one
+shard of a multi-machine run (--manifest and --shard, see
+shards.py), whose normalized values get hash ids (--hash-ids)
+so the shards can be merged without renumbering.
+"""
+
+# write buffer for each output csv
+OUTPUT_BUFFER = 1024 * 1024
+# chunks handed out per worker, so slow chunks even out
+CHUNKS_PER_WORKER = 4
+# lines per batch when streaming a compressed dump to the pool
+BATCH_LINES = 20000
+# lines between stats and checkpoint checks of a serial run
+CHECK_LINES = 1000
+
+def parse_args(default_input):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default=default_input,
+                        help="path to the ol_dump file")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of parser processes (default 1, serial)")
+    parser.add_argument('--copy', action='store_true',
+                        help="stream the tables that need no normalization straight "
+                             "into postgres with COPY instead of writing their csvs")
+    parser.add_argument('--db', default=None,
+                        help="database url for --copy (default DB_URL in model/database.py)")
+    parser.add_argument('--intern', action='store_true',
+                        help="write the normalized tables while parsing instead of "
+                             "running normalize.py afterwards (parse_dump.py)")
+    parser.add_argument('--parquet', action='store_true',
+                        help="write the tables as parquet files (needs pyarrow) instead of csv")
+    parser.add_argument('--checkpoint', type=int, default=CHECKPOINT_SECONDS,
+                        help=f"seconds between checkpoints, 0 for none (default {CHECKPOINT_SECONDS})")
+    parser.add_argument('--resume', action='store_true',
+                        help="carry on from the last checkpoint of an interrupted run")
+    parser.add_argument('--compress', choices=list(compressed.CODECS), default=None,
+                        help="write the csvs compressed (zstd needs the zstandard package)")
+    parser.add_argument('--hash-ids', action='store_true',
+                        help="with --intern, give the normalized values hash ids instead of "
+                             "sequence numbers (see hash_ids.py)")
+    parser.add_argument('--manifest', default=None,
+                        help="shard manifest written by shards.py plan: parse one shard "
+                             "of the dump (--shard) with hash ids")
+    parser.add_argument('--shard', type=int, default=None,
+                        help="the shard of --manifest to parse")
+    return parser.parse_args()
+
+def output_paths(outputs):
+    """
+    yield every filename in a (possibly nested) outputs dict
+    """
+    for value in outputs.values():
+        if isinstance(value, dict):
+            yield from output_paths(value)
+        else:
+            yield value
+
+def open_output(filename, opener=None, mode="w"):
+    """
+    the opener's sink for filename if it has one, otherwise the file
+    """
+    sink = opener(filename) if opener is not None else None
+    if sink is None:
+        sink = compressed.open_write(filename, mode)
+    if sink is None:
+        sink = metrics.open_timed(filename, mode, OUTPUT_BUFFER)
+    return sink
+
+def _checkpointed(opened, opener=None, resume=False):
+    """
+    opener falling back to open_output, keeping the files it
+    opens in opened (path on disk -> file) for the checkpoints,
+    and appending to them when resuming
+    """
+    def open_file(filename):
+        sink = opener(filename) if opener is not None else None
+        if sink is None:
+            sink = opened[compressed.path(filename)] = open_output(filename, mode="a" if resume else "w")
+        return sink
+    return open_file
+
+def open_outputs(outputs, suffix='', opener=None):
+    """
+    open every file in outputs for writing, keeping the dict layout
+    """
+    files = {}
+    for name, value in outputs.items():
+        if isinstance(value, dict):
+            files[name] = open_outputs(value, suffix, opener)
+        else:
+            files[name] = open_output(value + suffix, opener)
+    return files
+
+def _buffer_outputs(outputs):
+    """
+    in memory version of open_outputs, keyed by filename
+    """
+    return {filename: io.StringIO() for filename in output_paths(outputs)}
+
+def _nest(outputs, buffers):
+    """
+    lay out buffers (filename -> file) in the shape of outputs
+    """
+    return {name: _nest(value, buffers) if isinstance(value, dict) else buffers[value]
+            for name, value in outputs.items()}
+
+def _chain(first, second):
+    """
+    an opener trying first, then second (which can be None)
+    """
+    if second is None:
+        return first
+    return lambda filename: first(filename) or second(filename)
+
+def close_outputs(files):
+    for value in files.values():
+        if isinstance(value, dict):
+            close_outputs(value)
+        else:
+            value.close()
+
+def _parse_range(path, start, end, parse_line, out):
+    for line in iter_lines(path, start, end):
+        metrics.parse(parse_line, line, out)
+
+def _parse_chunk(task):
+    """
+    worker: parse one byte range into its own shard files
+    """
+    index, path, start, end, parse_line, outputs, intern, hashed, durable, quarantine, codec = task
+    compressed.set_codec(codec)
+    before = metrics.snapshot()
+    suffix = f".part{index}"
+    opened = {quarantine: metrics.Quarantine(quarantine + suffix)}
+    metrics.set_quarantine(opened[quarantine])
+    open_shard = _checkpointed(opened)
+    lookups = opener = None
+    if intern:
+        lookups = Lookups(lambda filename: open_shard(filename + suffix), hashed=hashed)
+        opener = lambda filename: lookups.open(filename[:-len(suffix)])
+    files = open_outputs(outputs, suffix, _checkpointed(opened, opener))
+    try:
+        _parse_range(path, start, end, parse_line, files)
+        if durable:
+            # the shards must be on disk before the chunk is checkpointed
+            for file in opened.values():
+                sync(file)
+    finally:
+        close_outputs(files)
+        if lookups is not None:
+            lookups.close()
+        opened[quarantine].close()
+        metrics.set_quarantine(None)
+    return index, metrics.delta(before)
+
+def _init_batch_worker(parse_line, outputs, intern, hashed, quarantine):
+    global _batch_parse_line, _batch_outputs, _batch_intern, _batch_hashed, _batch_quarantine
+    _batch_parse_line = parse_line
+    _batch_outputs = outputs
+    _batch_intern = intern
+    _batch_hashed = hashed
+    _batch_quarantine = quarantine
+
+def _parse_batch(lines):
+    """
+    worker: parse a batch of lines, returning filename -> text
+    """
+    before = metrics.snapshot()
+    buffers = _buffer_outputs(_batch_outputs)
+    buffers[_batch_quarantine] = io.StringIO()
+    metrics.set_quarantine(buffers[_batch_quarantine])
+    files = buffers
+    if _batch_intern:
+        lookups = Lookups(lambda filename: buffers.setdefault(filename, io.StringIO()), hashed=_batch_hashed)
+        files = {filename: lookups.open(filename) or buf for filename, buf in list(buffers.items())}
+    out = _nest(_batch_outputs, files)
+    for line in lines:
+        metrics.parse(_batch_parse_line, line, out)
+    texts = {filename: buf.getvalue() for filename, buf in buffers.items()}
+    return metrics.delta(before), texts
+
+def _iter_batches(path, start=0, end=None):
+    """
+    yield (lines, offset after the last one) batches from start
+    """
+    lines = iter_lines_at(path, start, end)
+    while True:
+        batch = list(islice(lines, BATCH_LINES))
+        if not batch:
+            return
+        yield [line for _, line in batch], batch[-1][0]
+
+def _open_quarantine(filename, opened, resume):
+    quarantine = opened[filename] = metrics.Quarantine(filename, "a" if resume else "w")
+    metrics.set_quarantine(quarantine)
+    return quarantine
+
+def _run_serial(parse_line, outputs, path, opener, intern, hashed, span, checkpoint, state, progress, quarantine):
+    opened = {}
+    open_file = _checkpointed(opened, opener, resume=state is not None)
+    lookups = None
+    if intern:
+        lookups = Lookups(open_file, resume=state is not None, hashed=hashed)
+        open_file = _chain(lookups.open, open_file)
+    files = open_outputs(outputs, opener=open_file)
+    rejected = _open_quarantine(quarantine, opened, state is not None)
+    start = offset = state['offset'] if state else span[0]
+    try:
+        for offset, line in iter_lines_at(path, start, span[1]):
+            metrics.parse(parse_line, line, files)
+            if metrics.counters['lines'] % CHECK_LINES == 0:
+                progress.update(offset - start)
+                if checkpoint is not None and checkpoint.due():
+                    checkpoint.save({'offset': offset}, opened)
+        progress.update(offset - start)
+    finally:
+        close_outputs(files)
+        if lookups is not None:
+            lookups.close()
+        rejected.close()
+        metrics.set_quarantine(None)
+
+def _run_batches(parse_line, outputs, path, workers, opener, intern, hashed, span,
+                 checkpoint, state, progress, quarantine):
+    opened = {}
+    open_file = _checkpointed(opened, opener, resume=state is not None)
+    merger = None
+    if intern:
+        merger = Merger(output_paths(outputs), open_file, resume=state is not None, hashed=hashed)
+    files = {filename: open_file(filename) for filename in output_paths(outputs)
+             if not (intern and lookup_path(filename))}
+    files[quarantine] = _open_quarantine(quarantine, opened, state is not None)
+    start = state['offset'] if state else span[0]
+
+    def read(texts):
+        return lambda filename: io.StringIO(texts[filename], newline='\n') if filename in texts else None
+
+    def write(result, offset):
+        counted, texts = result.get()
+        for filename, text in texts.items():
+            if filename in files and text:
+                files[filename].write(text)
+        if merger is not None:
+            merger.merge(read(texts))
+        metrics.add(counted)
+        progress.update(offset - start)
+        # everything before offset is written
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save({'offset': offset}, opened)
+
+    try:
+        with Pool(workers, _init_batch_worker, (parse_line, outputs, intern, hashed, quarantine)) as pool:
+            # keep a bounded number of batches in flight, written in order
+            pending = deque()
+            for batch, offset in _iter_batches(path, start, span[1]):
+                pending.append((pool.apply_async(_parse_batch, (batch,)), offset))
+                if len(pending) >= workers * 2:
+                    write(*pending.popleft())
+            while pending:
+                write(*pending.popleft())
+    finally:
+        for file in files.values():
+            file.close()
+        if merger is not None:
+            merger.close()
+        metrics.set_quarantine(None)
+
+def _run_chunks(parse_line, outputs, path, workers, intern, hashed, span, checkpoint, state, progress, quarantine):
+    if state is not None:
+        chunks = [tuple(chunk) for chunk in state['chunks']]
+        done = set(state['done'])
+    else:
+        chunks = find_chunks(path, workers * CHUNKS_PER_WORKER, *span)
+        done = set()
+    durable = checkpoint is not None and checkpoint.seconds > 0
+    tasks = [(i, path, start, end, parse_line, outputs, intern, hashed, durable, quarantine, compressed.codec())
+             for i, (start, end) in enumerate(chunks) if i not in done]
+    progress.total = sum(end - start for _, _, start, end, *_ in tasks)
+    parsed = 0
+    if tasks:
+        with Pool(workers) as pool:
+            for index, counted in pool.imap_unordered(_parse_chunk, tasks):
+                metrics.add(counted)
+                start, end = chunks[index]
+                parsed += end - start
+                progress.update(parsed)
+                done.add(index)
+                if durable:
+                    checkpoint.save({'chunks': chunks, 'done': sorted(done)})
+    merged = set(state.get('merged', [])) if state is not None else set()
+
+    def merged_file(filename):
+        merged.add(filename)
+        if durable:
+            checkpoint.save({'chunks': chunks, 'done': sorted(done), 'merged': sorted(merged)})
+
+    _merge_shards(outputs, len(chunks), intern, merged, merged_file, [quarantine])
+    if intern and 'interned' not in merged:
+        _merge_interned_shards(outputs, len(chunks), durable, hashed)
+        merged_file('interned')
+
+def _merge_shards(outputs, n_chunks, intern=False, merged=(), merged_file=None, extra=()):
+    """
+    concatenate the per chunk shards back into the output files
+    (and the extra files), skipping the files in merged and
+    calling merged_file(filename) once each file is complete
+    """
+    for filename in [*output_paths(outputs), *extra]:
+        if (intern and lookup_path(filename)) or filename in merged:
+            continue
+        # the quarantine is gzip compressed either way
+        disk_path = (lambda name: name) if filename in extra else compressed.path
+        with open(disk_path(filename), 'wb') as out:
+            for index in range(n_chunks):
+                with open(disk_path(f"{filename}.part{index}"), 'rb') as part:
+                    shutil.copyfileobj(part, out, 1024 * 1024)
+            if merged_file is not None:
+                sync(out)
+        if merged_file is not None:
+            merged_file(filename)
+        for index in range(n_chunks):
+            os.remove(disk_path(f"{filename}.part{index}"))
+
+def _merge_interned_shards(outputs, n_chunks, durable=False, hashed=False):
+    """
+    merge the per chunk association and normalization tables,
+    mapping the ids of each chunk to the merged ones. the
+    shards are removed once all of them are merged
+    """
+    opened = {}
+    merger = Merger(output_paths(outputs), _checkpointed(opened), hashed=hashed)
+    shards = []
+    try:
+        for index in range(n_chunks):
+            files = []
+
+            def read(filename):
+                shard = compressed.path(f"{filename}.part{index}")
+                if not os.path.exists(shard):
+                    return None
+                shards.append(shard)
+                file = compressed.open_read(shard, newline='\n')
+                files.append(file)
+                return file
+
+            try:
+                merger.merge(read)
+            finally:
+                for file in files:
+                    file.close()
+        if durable:
+            for file in opened.values():
+                sync(file)
+    finally:
+        merger.close()
+    for shard in shards:
+        os.remove(shard)
+
+def report(path, seconds, parsed_bytes, workers, quarantine):
+    """
+    print the summary of a run and write its json report
+    next to the quarantine file
+    """
+    stats = metrics.report(path, seconds, parsed_bytes, workers, JSON_DECODER)
+    decompressed = " decompressed" if is_compressed(path) else ""
+    print(f"parsed {stats['lines']} lines ({parsed_bytes / 1e6:.1f} MB{decompressed}) "
+          f"in {stats['seconds']:.1f}s with {workers} worker(s): "
+          f"{stats['lines_per_second']:.0f} lines/s, {stats['bytes_per_second'] / 1e6:.1f} MB/s")
+    print(", ".join(f"{kind} {n}" for kind, n in stats['types'].items()))
+    # summed over all workers, so it can exceed the wall time
+    cpu = stats['cpu_seconds']
+    print(f"worker time: json decode ({JSON_DECODER}) {cpu['decode']:.2f}s for "
+          f"{stats['json_records']} records, extract {cpu['extract']:.2f}s, write {cpu['write']:.2f}s")
+    rss = stats['peak_rss_mb']
+    if rss['main'] is not None:
+        worker = f", largest worker {rss['worker']:.0f} MB" if rss['worker'] else ""
+        print(f"peak rss: {rss['main']:.0f} MB{worker}")
+    if stats['errors']:
+        errors = ", ".join(f"{field} {n}" for field, n in stats['errors'].items())
+        print(f"errors: {errors} (see {quarantine})")
+    stats['quarantine'] = quarantine
+    filename = os.path.join(os.path.dirname(quarantine), metrics.REPORT_FILE)
+    metrics.write_report(filename, stats)
+    print(f"report written to {filename}")
+
+def run(parse_line, outputs, path, workers=1, opener=None, intern=False,
+        checkpoint=None, resume=False, hashed=False, span=None):
+    """
+    parse the dump at path with parse_line, writing to outputs.
+    with a checkpoint (which needs plain files, so no opener)
+    the run saves its progress, and with resume it carries on
+    from the checkpoint's state after truncating the outputs.
+    span is the (start, end) byte range to parse, by default
+    the whole dump. returns whether the run finished
+    """
+    start_time = time.time()
+    if checkpoint is not None and opener is not None:
+        raise ValueError("checkpoints need the outputs to be plain files")
+
+    state = None
+    if resume:
+        try:
+            state = checkpoint.load()
+            if state is not None:
+                truncate(state)
+        except ValueError as e:
+            print(f"cannot resume: {e}")
+            return False
+        if state is None:
+            print(f"no checkpoint at {checkpoint.path}, starting from the beginning")
+        else:
+            print(f"resuming from {checkpoint.path}")
+
+    first = next(output_paths(outputs))
+    quarantine = os.path.join(os.path.dirname(first), metrics.QUARANTINE_FILE)
+    if span is None:
+        span = (0, None)
+    total = None
+    if not is_compressed(path):
+        end = os.path.getsize(path) if span[1] is None else span[1]
+        total = end - (state or {}).get('offset', span[0])
+    progress = metrics.Progress(total)
+    args = (intern, hashed, span, checkpoint, state, progress, quarantine)
+    if state is not None and 'chunks' in state:
+        _run_chunks(parse_line, outputs, path, workers, *args)
+    elif workers <= 1:
+        _run_serial(parse_line, outputs, path, opener, *args)
+    elif is_compressed(path) or opener is not None or state is not None:
+        _run_batches(parse_line, outputs, path, workers, opener, *args)
+    else:
+        _run_chunks(parse_line, outputs, path, workers, *args)
+
+    if checkpoint is not None:
+        checkpoint.remove()
+    report(path, time.time() - start_time, progress.bytes, workers, quarantine)
+    return True
+
+def cli(parse_line, outputs, default_input):
+    """
+    command line entry point shared by the parse scripts
+    """
+    args = parse_args(default_input)
+    paths = list(output_paths(outputs))
+    span = None
+    if args.manifest:
+        import shards
+        if args.shard is None:
+            print("--manifest needs the --shard to parse")
+            return
+        if not args.intern or args.copy or args.parquet:
+            print("--manifest needs --intern, and does not work with --copy or --parquet")
+            return
+        try:
+            span = shards.shard_span(args.manifest, args.shard, args.input)
+        except ValueError as e:
+            print(f"cannot parse shard {args.shard}: {e}")
+            return
+        # the shards must agree on the ids without talking to each other
+        args.hash_ids = True
+        shards.remove_done(os.path.dirname(paths[0]))
+    if args.hash_ids and not args.intern:
+        print("--hash-ids needs --intern")
+        return
+    if args.intern:
+        missing = missing_files(paths)
+        if missing:
+            print(f"--intern needs {', '.join(missing)} from the same run, use parse_dump.py")
+            return
+        paths = interned_paths(paths)
+
+    if args.compress:
+        if not compressed.available(args.compress):
+            print(f"--compress {args.compress} needs the zstandard package (pip install zstandard)")
+            return
+        compressed.set_codec(args.compress)
+
+    if args.parquet:
+        import parquet_sink
+        if not parquet_sink.available():
+            print("--parquet needs pyarrow (pip install pyarrow)")
+        elif args.copy or args.resume:
+            print("--parquet does not work with --copy or --resume")
+        else:
+            run(parse_line, outputs, args.input, args.workers, parquet_sink.parquet_opener(), args.intern,
+                hashed=args.hash_ids)
+        return
+
+    if not args.copy:
+        checkpoint = None
+        if args.checkpoint > 0 or args.resume:
+            checkpoint = Checkpoint(paths[0] + '.checkpoint', args.input,
+                                    {'intern': args.intern, 'compress': args.compress,
+                                     'hash_ids': args.hash_ids, 'shard': args.shard}, args.checkpoint)
+        finished = run(parse_line, outputs, args.input, args.workers, intern=args.intern,
+                       checkpoint=checkpoint, resume=args.resume, hashed=args.hash_ids, span=span)
+        if finished and args.manifest:
+            shards.write_done(os.path.dirname(paths[0]), args.manifest, args.shard, args.compress)
+        return
+
+    if args.resume:
+        print("--resume does not work with --copy, the rows are already in the database")
+        return
+    import copy_sink
+    constraints = copy_sink.prepare(args.db, paths)
+    try:
+        run(parse_line, outputs, args.input, args.workers, copy_sink.copy_opener(args.db), args.intern,
+            hashed=args.hash_ids)
+    finally:
+        copy_sink.restore(args.db, constraints)
@@ -0,0 +1,154 @@
+import os
+from datetime import datetime
+from copy_sink import COPY_TARGETS, MAIN_TABLES
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+"""
+writes the parsed tables as parquet files (with --parquet)
+instead of csv, for analytics that scan whole tables with
+a columnar reader rather than going through postgres.
+
+like copy_sink, each output is replaced by a file-like
+ParquetWriter that the parsers write their tab separated
+rows to. the rows are buffered and converted to typed arrow
+columns one row group at a time, so memory stays bounded.
+
+the tables and columns are the ones of COPY_TARGETS (the
+tables in the database). the csvs not loaded as they are
+(the pairwise csvs normalize.py reads, the isbns) are
+written as (edition_id/work_id/author_id, value) tables.
+"""
+
+# rows per parquet row group
+ROW_GROUP_ROWS = 100000
+COMPRESSION = 'zstd'
+
+# integer columns; every other column is a string, except
+# for the timestamps and the ids (see column_type)
+INT_COLUMNS = {'revision', 'latest_revision', 'volume_number', 'number_of_pages',
+               'number_of_editions', 'cover', 'photo'}
+TIMESTAMP_COLUMNS = {'created', 'last_modified'}
+
+# prefix of a pairwise csv -> its key column
+PAIRWISE_KEYS = {'editions': 'edition_id', 'works': 'work_id', 'authors': 'author_id'}
+
+def available():
+    return pa is not None
+
+def column_type(table, column):
+    if column in TIMESTAMP_COLUMNS:
+        return pa.timestamp('us')
+    if column in INT_COLUMNS:
+        return pa.int64()
+    # the integer keys of the main tables (see ol_ids.py), the
+    # ids of the normalization tables and the references to them
+    if column == 'id' or column.endswith('_id'):
+        return pa.int64()
+    return pa.string()
+
+def table_columns(filename):
+    """
+    (table, columns) written for a csv file name, or None
+    """
+    name = os.path.basename(filename)
+    if name in COPY_TARGETS:
+        return COPY_TARGETS[name]
+    table = name[:-len('.csv')] if name.endswith('.csv') else name
+    key = PAIRWISE_KEYS.get(table.split('_')[0])
+    if key is None:
+        return None
+    return table, [key, 'value']
+
+def _int(value):
+    try:
+        i = int(value)
+    except ValueError:
+        return None
+    return i if -2**63 <= i < 2**63 else None
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def _array(values, arrow_type, empty_is_null):
+    if arrow_type == pa.int64():
+        return pa.array([_int(v) if v else None for v in values], arrow_type)
+    if arrow_type == pa.timestamp('us'):
+        return pa.array([_timestamp(v) if v else None for v in values], arrow_type)
+    if empty_is_null:
+        values = [v if v else None for v in values]
+    return pa.array(values, arrow_type)
+
+class ParquetWriter:
+    """
+    file-like object writing the tab separated rows written
+    to it into a parquet file of the given table and columns
+    """
+    def __init__(self, path, table, columns, row_group_rows=ROW_GROUP_ROWS):
+        self.path = path
+        self.table = table
+        self.columns = columns
+        self.row_group_rows = row_group_rows
+        # empty fields are NULLs in the main tables (FORCE_NULL in copy_sql)
+        self.empty_is_null = table in MAIN_TABLES
+        self.schema = pa.schema([(c, column_type(table, c)) for c in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression=COMPRESSION)
+        self.rows = []
+        self.bad_rows = 0
+
+    def write(self, text):
+        for row in text.split('\n'):
+            if row:
+                self.rows.append(row)
+        if len(self.rows) >= self.row_group_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        n = len(self.columns)
+        fields = []
+        for row in self.rows:
+            values = row.split('\t')
+            if len(values) != n:
+                self.bad_rows += 1
+                continue
+            fields.append(values)
+        self.rows = []
+        if not fields:
+            return
+        arrays = [_array(values, field.type, self.empty_is_null)
+                  for values, field in zip(zip(*fields), self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema),
+                                row_group_size=self.row_group_rows)
+
+    def close(self):
+        if self.writer is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.writer.close()
+            self.writer = None
+        if self.bad_rows:
+            print(f"{self.path}: skipped {self.bad_rows} rows without {len(self.columns)} columns")
+
+def parquet_opener():
+    """
+    an opener for parallel.run writing every output csv as
+    a parquet file next to where the csv would be
+    """
+    def opener(filename):
+        target = table_columns(filename)
+        if target is None:
+            return None
+        path = filename[:-len('.csv')] + '.parquet' if filename.endswith('.csv') else filename + '.parquet'
+        return ParquetWriter(path, *target)
+    return opener
@@ -0,0 +1,46 @@
+import parallel
+import parse_editions
+import parse_works
+import parse_author
+import parse_redirects
+
+"""
+reads the ol_dump once and routes each line on its
+type column (the first tab field) to the edition, work,
+author or redirect parser, so all the csvs are written in
+one pass instead of one full read of the dump per parse script
+"""
+
+# dump type -> (OUTPUTS key, parser)
+PARSERS = {
+    '/type/edition': ('editions', parse_editions.parse_line),
+    '/type/work': ('works', parse_works.parse_line),
+    '/type/author': ('authors', parse_author.parse_line),
+    '/type/redirect': ('redirects', parse_redirects.parse_line),
+    '/type/delete': ('redirects', parse_redirects.parse_line),
+}
+
+OUTPUTS = {
+    'editions': parse_editions.OUTPUTS,
+    'works': parse_works.OUTPUTS,
+    'authors': parse_author.OUTPUTS,
+    'redirects': parse_redirects.OUTPUTS,
+}
+
+def parse_line(line, out):
+    """
+    dispatch one line of the dump to the parser for its type
+    """
+    route = PARSERS.get(line[:line.find('\t')])
+    if route is None:
+        return
+    name, parse = route
+    parse(line, out[name])
+
+
+def main():
+    parallel.cli(parse_line, OUTPUTS, "../ol_dump_latest.txt")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+from utils import decode_json
+from metrics import reject
+from ol_ids import encode_id
+import parallel
+
+"""
+takes the ol_dump and writes the /type/redirect and
+/type/delete records of editions, works and authors as
+(key, target key) rows, with the integer keys of ol_ids.py,
+the target left empty for a deleted record. a redirect's target can
+itself be redirected or deleted; aliases.py follows the
+chains and writes the aliases table
+"""
+
+OUTPUTS = {
+    'redirects': "redirects.csv",
+}
+
+def parse_line(line, out):
+    """
+    parse one line of the ol_dump into the redirect output
+    files, given as an OUTPUTS-shaped dict of open files
+    """
+    try:
+        if line.startswith("/type/delete\t"):
+            columns = line.split('\t', 2)
+            key = encode_id(columns[1])
+            if key is not None:
+                out['redirects'].write(f"{key}\t\n")
+            return
+        if not line.startswith("/type/redirect\t"):
+            return
+
+        columns = line.split('\t')
+        key = encode_id(columns[1])
+        if key is None:
+            return
+        location = decode_json(columns[-1]).get('location')
+        target = encode_id(location)
+        if target is None:
+            raise ValueError(f"redirect without an OL location: {location!r}")
+        out['redirects'].write(f"{key}\t{target}\n")
+
+    except Exception as e:
+        reject(line, e)
+
+
+def main():
+    parallel.cli(parse_line, OUTPUTS, "../ol_dump_latest.txt")
+
+
+if __name__ == '__main__':
+    main()
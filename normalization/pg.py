@@ -0,0 +1,107 @@
+import os
+import sys
+
+"""
+postgres helpers shared by the scripts that write
+straight into the database
+"""
+
+def default_db_url():
+    """
+    the DB_URL from model/database.py
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    from model.database import DB_URL
+    return DB_URL
+
+def connect(db_url=None):
+    import psycopg2
+    conn = psycopg2.connect(db_url or default_db_url())
+    conn.set_client_encoding('UTF8')
+    return conn
+
+def lock_errors():
+    """
+    the errors of a statement that gave up waiting for a lock
+    (lock_timeout) or was cancelled to break a deadlock
+    """
+    import psycopg2.errors
+    return (psycopg2.errors.LockNotAvailable, psycopg2.errors.DeadlockDetected)
+
+def table_exists(conn, table):
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+        return cur.fetchone()[0]
+
+def foreign_keys(conn, tables):
+    """
+    the foreign key constraints declared on the given tables,
+    as a list of (table, constraint name, definition)
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid)
+            FROM pg_constraint c
+            WHERE c.contype = 'f' AND c.conrelid::regclass::text = ANY(%s)
+        """, (list(tables),))
+        return cur.fetchall()
+
+def table_constraints(conn, tables):
+    """
+    the primary key, unique and foreign key constraints declared
+    on tables, and the foreign keys to tables from other tables,
+    as a list of (table, constraint name, definition, type, columns)
+    with type 'p', 'u' or 'f'
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid), c.contype::text,
+                   ARRAY(SELECT a.attname FROM unnest(c.conkey) WITH ORDINALITY k(attnum, n)
+                         JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+                         ORDER BY k.n)
+            FROM pg_constraint c
+            WHERE c.contype IN ('p', 'u', 'f')
+              AND (c.conrelid::regclass::text = ANY(%s)
+                   OR (c.contype = 'f' AND c.confrelid::regclass::text = ANY(%s)))
+        """, (list(tables), list(tables)))
+        return [tuple(row) for row in cur.fetchall()]
+
+def indexes(conn, tables):
+    """
+    the indexes on tables that do not back a constraint, as a
+    list of (table, index name, definition, columns)
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT i.indrelid::regclass::text, i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid),
+                   ARRAY(SELECT a.attname FROM unnest(i.indkey::int2[]) WITH ORDINALITY k(attnum, n)
+                         JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                         ORDER BY k.n)
+            FROM pg_index i
+            WHERE i.indrelid::regclass::text = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM pg_constraint c
+                              WHERE c.conrelid = i.indrelid AND c.conindid = i.indexrelid)
+        """, (list(tables),))
+        return [tuple(row) for row in cur.fetchall()]
+
+def drop_constraints(conn, constraints, commit=True):
+    with conn.cursor() as cur:
+        for table, name, _ in constraints:
+            cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS "{name}"')
+    if commit:
+        conn.commit()
+
+def add_constraints(conn, constraints, not_valid=False, commit=True):
+    """
+    recreate dropped constraints. NOT VALID foreign keys skip the
+    check of the rows already loaded (the dump has dangling keys)
+    but are enforced for new writes
+    """
+    suffix = " NOT VALID" if not_valid else ""
+    with conn.cursor() as cur:
+        for table, name, definition in constraints:
+            cur.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}{suffix}')
+    if commit:
+        conn.commit()
@@ -0,0 +1,57 @@
+"""
+the editions_search table: the keyword search document of each
+edition (see model/text_search.py), built from its title, its
+subtitle and full title, and the names of its authors, weighted
+in that order.
+
+the document spans editions, editions_authors and authors, so
+it cannot be a generated column (as authors.search_vector is).
+it is one of the derived tables (see derived.py): load_tables.py
+builds it whole after loading any of those tables, and delta.py
+refreshes the rows of the editions it changes.
+"""
+
+TABLE = 'editions_search'
+# the tables the documents are built from
+SOURCES = ['editions', 'editions_authors', 'authors']
+# the text search configuration of the documents: the same as
+# SEARCH_CONFIG in model/database.py, which the authors' documents
+# and the queries use (the scripts here do not import the model)
+SEARCH_CONFIG = 'english'
+
+_VECTOR = f"""
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(e.title, '')), 'A')
+    || setweight(to_tsvector('{SEARCH_CONFIG}', concat_ws(' ', e.subtitle, e.full_title)), 'B')
+    || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(n.names, '')), 'C')
+"""
+
+def build(cur):
+    """
+    fill the (empty) editions_search table from all the editions
+    """
+    cur.execute(f"""
+        INSERT INTO {TABLE} (edition_id, search_vector)
+        SELECT e.id, {_VECTOR}
+        FROM editions e
+        LEFT JOIN (SELECT ea.edition_id, string_agg(a.name, ' ') AS names
+                   FROM editions_authors ea JOIN authors a ON a.id = ea.author_id
+                   GROUP BY ea.edition_id) n ON n.edition_id = e.id
+    """)
+    return cur.rowcount
+
+def refresh(cur, editions):
+    """
+    rebuild the rows of the editions whose ids the query
+    editions selects (deleted editions just lose theirs)
+    """
+    cur.execute(f"DELETE FROM {TABLE} WHERE edition_id IN ({editions})")
+    cur.execute(f"""
+        INSERT INTO {TABLE} (edition_id, search_vector)
+        SELECT e.id, {_VECTOR}
+        FROM editions e
+        LEFT JOIN LATERAL (SELECT string_agg(a.name, ' ') AS names
+                           FROM editions_authors ea JOIN authors a ON a.id = ea.author_id
+                           WHERE ea.edition_id = e.id) n ON true
+        WHERE e.id IN ({editions})
+    """)
+    return cur.rowcount
@@ -0,0 +1,211 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import compressed
+import metrics
+import parse_dump
+from dump_reader import find_chunks, is_compressed
+from hash_ids import union
+from interning import interned_paths
+from normalize import GROUPS
+from parallel import output_paths
+
+"""
+splits the parse of one ol_dump over several machines.
+
+    shards.py plan --input ol_dump_latest.txt --shards 4
+        writes shards.json, the manifest: the dump's size and
+        the newline aligned byte range of each shard
+    parse_dump.py --intern --manifest shards.json --shard 2
+        on each machine, in a directory of its own, with a
+        copy of the dump: parses the shard's byte range
+        (--workers, --compress and --resume work as usual)
+        and writes shard.json there when it is done
+    shards.py merge --manifest shards.json --output DIR DIRS...
+        puts the shard directories together into DIR, ready
+        for load_tables.py
+
+the shards need no coordination because the normalized values
+get hash ids (see hash_ids.py): every shard gives a value the
+same id, so the association tables of the shards are simply
+concatenated in shard order, and the normalization tables are
+the union of the shards' rows (sorted by id). an id given to
+two different values fails the merge.
+"""
+
+MANIFEST_FILE = 'shards.json'
+# written next to the csvs of a finished shard
+DONE_FILE = 'shard.json'
+# bytes at the start of each shard hashed to check the dump is the same
+CHECK_BYTES = 64 * 1024
+# copy buffer when concatenating shards
+COPY_BUFFER = 1024 * 1024
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    plan = commands.add_parser('plan', help="split a dump into shards")
+    plan.add_argument('--input', default="../ol_dump_latest.txt",
+                      help="path to the (uncompressed) ol_dump file")
+    plan.add_argument('--shards', type=int, required=True,
+                      help="number of shards (machines)")
+    plan.add_argument('--output', default=MANIFEST_FILE,
+                      help=f"manifest to write (default {MANIFEST_FILE})")
+    merge = commands.add_parser('merge', help="merge the csvs of the parsed shards")
+    merge.add_argument('--manifest', default=MANIFEST_FILE,
+                       help=f"the manifest the shards were parsed with (default {MANIFEST_FILE})")
+    merge.add_argument('--output', default='.',
+                       help="directory for the merged csvs (default the current one)")
+    merge.add_argument('--tmpdir', default=None,
+                       help="directory for sorting the normalization tables (default the system temp dir)")
+    merge.add_argument('dirs', nargs='+',
+                       help="the directories of the shards, in any order")
+    return parser.parse_args()
+
+def _check(path, start):
+    """
+    hash of the bytes of the dump at path from start
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return hashlib.blake2b(file.read(CHECK_BYTES), digest_size=16).hexdigest()
+
+def plan(path, n):
+    """
+    the manifest splitting the dump at path into n shards
+    """
+    if is_compressed(path):
+        raise ValueError(f"{path} is compressed, and a compressed dump cannot be split")
+    shards = [{'start': start, 'end': end, 'check': _check(path, start)}
+              for start, end in find_chunks(path, n)]
+    manifest = {'input': os.path.basename(path), 'size': os.path.getsize(path), 'shards': shards}
+    manifest['id'] = hashlib.blake2b(json.dumps(manifest, sort_keys=True).encode(),
+                                     digest_size=16).hexdigest()
+    return manifest
+
+def read_manifest(path):
+    with open(path) as file:
+        return json.load(file)
+
+def shard_span(manifest_path, index, path):
+    """
+    the (start, end) byte range of shard index of the dump
+    at path. raises ValueError if the dump is not the one
+    the manifest was made for
+    """
+    manifest = read_manifest(manifest_path)
+    if not 0 <= index < len(manifest['shards']):
+        raise ValueError(f"{manifest_path} has shards 0 to {len(manifest['shards']) - 1}")
+    shard = manifest['shards'][index]
+    if is_compressed(path) or os.path.getsize(path) != manifest['size'] \
+            or _check(path, shard['start']) != shard['check']:
+        raise ValueError(f"{path} is not the dump {manifest_path} was made for ({manifest['input']})")
+    return shard['start'], shard['end']
+
+def remove_done(directory):
+    """
+    unmark directory, before parsing a shard into it again
+    """
+    done = os.path.join(directory or '.', DONE_FILE)
+    if os.path.exists(done):
+        os.remove(done)
+
+def write_done(directory, manifest_path, index, codec):
+    """
+    mark the shard parsed into directory as complete
+    """
+    manifest = read_manifest(manifest_path)
+    with open(os.path.join(directory or '.', DONE_FILE), 'w') as file:
+        json.dump({'manifest': manifest['id'], 'shard': index, 'compress': codec}, file)
+
+def shard_dirs(manifest, dirs):
+    """
+    the shard directories in shard order, and the codec they
+    were written with. raises ValueError unless every shard
+    of the manifest is there once, complete
+    """
+    found = {}
+    codecs = set()
+    for directory in dirs:
+        done = os.path.join(directory, DONE_FILE)
+        if not os.path.exists(done):
+            raise ValueError(f"{directory} has no finished shard ({DONE_FILE})")
+        with open(done) as file:
+            shard = json.load(file)
+        if shard['manifest'] != manifest['id']:
+            raise ValueError(f"{directory} was parsed with another manifest")
+        if shard['shard'] in found:
+            raise ValueError(f"{directory} and {found[shard['shard']]} are both shard {shard['shard']}")
+        found[shard['shard']] = directory
+        codecs.add(shard['compress'])
+    missing = [str(i) for i in range(len(manifest['shards'])) if i not in found]
+    if missing:
+        raise ValueError(f"missing shards: {', '.join(missing)}")
+    if len(codecs) > 1:
+        raise ValueError("the shards were not all written with the same --compress")
+    return [found[i] for i in range(len(manifest['shards']))], codecs.pop()
+
+def concatenate(paths, output):
+    """
+    concatenate the files at paths (those that exist) into output
+    """
+    with open(output, 'wb') as out:
+        for path in paths:
+            if os.path.exists(path):
+                with open(path, 'rb') as part:
+                    shutil.copyfileobj(part, out, COPY_BUFFER)
+
+def merge(manifest, dirs, output, tmpdir=None):
+    """
+    merge the csvs of the shard directories into output,
+    returning the hash id collisions found (see hash_ids.union)
+    """
+    dirs, codec = shard_dirs(manifest, dirs)
+    compressed.set_codec(codec)
+    os.makedirs(output, exist_ok=True)
+    collisions = []
+    for filename in interned_paths(list(output_paths(parse_dump.OUTPUTS))):
+        if filename in GROUPS:
+            with compressed.create(os.path.join(output, filename)) as out:
+                found = union([os.path.join(d, filename) for d in dirs
+                               if os.path.exists(compressed.find(os.path.join(d, filename)))], out, tmpdir)
+            collisions += [(filename, i, values) for i, values in found]
+        else:
+            name = compressed.path(filename)
+            concatenate([os.path.join(d, name) for d in dirs], os.path.join(output, name))
+    # gzip members concatenate too
+    concatenate([os.path.join(d, metrics.QUARANTINE_FILE) for d in dirs],
+                os.path.join(output, metrics.QUARANTINE_FILE))
+    return collisions
+
+def main():
+    args = parse_args()
+    if args.command == 'plan':
+        try:
+            manifest = plan(args.input, args.shards)
+        except ValueError as e:
+            print(f"cannot plan shards: {e}")
+            return
+        with open(args.output, 'w') as file:
+            json.dump(manifest, file, indent=1)
+        print(f"wrote {args.output}: {len(manifest['shards'])} shards of {manifest['input']}")
+        return
+
+    manifest = read_manifest(args.manifest)
+    try:
+        collisions = merge(manifest, args.dirs, args.output, args.tmpdir)
+    except ValueError as e:
+        print(f"cannot merge: {e}")
+        return
+    for filename, i, values in collisions:
+        print(f"{filename}: id {i} is given to {' and '.join(repr(v) for v in values)}")
+    if collisions:
+        print(f"merge failed: {len(collisions)} hash id collisions, the ids of these values are ambiguous")
+    else:
+        print(f"merged {len(args.dirs)} shards into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
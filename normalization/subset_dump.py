@@ -0,0 +1,148 @@
+import argparse
+import gzip
+import hashlib
+from dump_reader import iter_lines
+from utils import decode_json
+
+"""
+builds a small ol_dump for development and benchmarks: a
+sample of the editions, picked by a hash of the edition key
+so the same percent always gives the same subset, plus the
+records they reference, so that loading the subset leaves
+no dangling keys in editions_works or editions_authors.
+
+the works pulled in reference authors and cover editions of
+their own, so the references are followed until nothing new
+turns up: each pass over the dump reads the editions and
+works found in the pass before (only their lines are json
+decoded) and collects what they reference. authors reference
+nothing, so they are only picked up by the last pass, which
+writes the selected records in dump order. references to
+records that are not in the dump at all stay dangling, as
+they do with the full dump, and are counted.
+"""
+
+# record types in the subset, by the suffix of their key (OL123M)
+TYPES = {'/type/edition': 'M', '/type/work': 'W', '/type/author': 'A'}
+# fields holding references, per record type (see parse_editions and parse_works)
+REFERENCES = {
+    '/type/edition': ['works', 'authors'],
+    '/type/work': ['authors', 'cover_editions'],
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default="../ol_dump_latest.txt",
+                        help="path to the ol_dump file")
+    parser.add_argument('--output', default="ol_dump_subset.txt",
+                        help="subset dump to write (gzip compressed if it ends in .gz)")
+    parser.add_argument('--percent', type=float, default=1.0,
+                        help="percent of the editions to sample (default 1)")
+    parser.add_argument('--salt', default='',
+                        help="changes which editions are sampled, for another subset of the same size")
+    return parser.parse_args()
+
+def sampled(key_id, percent, salt=''):
+    """
+    whether the edition with key_id (e.g. OL123M) is in the sample
+    """
+    digest = hashlib.blake2b((salt + key_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') < percent / 100 * 2**64
+
+def key_id(item):
+    """
+    the id (last part of the key) of a reference, which is a key
+    string, a {'key': ...} dict or a works author {'author': ...}
+    """
+    if isinstance(item, dict):
+        item = item.get('author', item)
+        if isinstance(item, dict):
+            item = item.get('key')
+    if isinstance(item, str):
+        return item.split('/')[-1]
+    return None
+
+def references(kind, data):
+    """
+    the ids referenced by a decoded record of type kind
+    """
+    refs = set()
+    for field in REFERENCES.get(kind, []):
+        values = data.get(field)
+        if not isinstance(values, list):
+            continue
+        for item in values:
+            ref = key_id(item)
+            if ref:
+                refs.add(ref)
+    return refs
+
+def _records(path):
+    """
+    yield (type, id, line) for the subset's record types in the dump
+    """
+    for line in iter_lines(path):
+        columns = line.split('\t', 2)
+        if len(columns) < 3 or columns[0] not in TYPES:
+            continue
+        yield columns[0], columns[1].split('/')[-1], line
+
+def select(path, percent, salt=''):
+    """
+    the ids of the sampled editions and of everything they
+    reference, directly or through the works, and the number
+    of passes over the dump it took
+    """
+    selected = set()
+    frontier = None
+    passes = 0
+    while frontier is None or frontier:
+        passes += 1
+        found = set()
+        for kind, key, line in _records(path):
+            if frontier is None:
+                if kind != '/type/edition' or not sampled(key, percent, salt):
+                    continue
+            elif key not in frontier:
+                continue
+            selected.add(key)
+            try:
+                data = decode_json(line[line.rfind('\t') + 1:])
+            except ValueError:
+                continue
+            found |= references(kind, data)
+        found -= selected
+        selected |= found
+        # editions and works have references of their own to follow
+        frontier = {key for key in found if not key.endswith(TYPES['/type/author'])}
+        print(f"pass {passes}: {len(selected)} records selected, {len(frontier)} to follow")
+    return selected, passes
+
+def write_subset(path, output, selected):
+    """
+    write the selected records to output in dump order,
+    returning the number written per type
+    """
+    counts = {kind: 0 for kind in TYPES}
+    written = set()
+    opener = gzip.open if output.endswith('.gz') else open
+    with opener(output, 'wt', encoding='utf-8', newline='\n') as out:
+        for kind, key, line in _records(path):
+            if key in selected:
+                out.write(line)
+                counts[kind] += 1
+                written.add(key)
+    return counts, len(selected - written)
+
+def main():
+    args = parse_args()
+    selected, passes = select(args.input, args.percent, args.salt)
+    counts, missing = write_subset(args.input, args.output, selected)
+    print(f"wrote {args.output} in {passes + 1} passes: "
+          + ", ".join(f"{n} {kind.split('/')[-1]}s" for kind, n in counts.items()))
+    if missing:
+        print(f"{missing} referenced records are not in the dump")
+
+
+if __name__ == '__main__':
+    main()
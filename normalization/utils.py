@@ -1,9 +1,58 @@
+import json
+import time
+
 """
 helper functions when parsing the OL json
 """
 
+# use a faster json decoder when one is installed. anything it
+# rejects (lone surrogates, huge ints, NaN...) is retried with the
+# stdlib decoder, so the parsed data is the same either way
+try:
+    import orjson
+    _fast_loads = orjson.loads
+    JSON_DECODER = 'orjson'
+except ImportError:
+    try:
+        import msgspec
+        _fast_loads = msgspec.json.Decoder().decode
+        JSON_DECODER = 'msgspec'
+    except ImportError:
+        _fast_loads = None
+        JSON_DECODER = 'json'
+
+# time spent decoding json in this process, see decode_json
+decode_stats = {'records': 0, 'seconds': 0.0}
+
+def decode_json(s):
+    """
+    decode a json record, adding the time taken to decode_stats
+    """
+    start = time.perf_counter()
+    try:
+        if _fast_loads is None:
+            return json.loads(s)
+        try:
+            return _fast_loads(s)
+        except Exception:
+            return json.loads(s)
+    finally:
+        decode_stats['records'] += 1
+        decode_stats['seconds'] += time.perf_counter() - start
+
+def is_ol_key(key_column):
+    """
+    whether the key column of a dump line (e.g. /books/OL1M)
+    is an Open Library id, checked before decoding the json
+    """
+    return key_column[key_column.rfind('/') + 1:].startswith('OL')
+
 def remove_special_char(s):
     if not isinstance(s,str):
         return s
+    # most values have nothing to replace, so check before copying
+    if ('\\' not in s and '\t' not in s and '\r' not in s and '\n' not in s
+            and '\x08' not in s and '\uf076' not in s):
+        return s
     tmp_s = s.replace('\\t', ' ').replace('\\r',' ').replace('\\n',' ')
     return tmp_s.replace('\t', ' ').replace('\r',' ').replace('\n',' ').replace('\x08',' ').replace('\uf076',' ')
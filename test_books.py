@@ -88,6 +88,24 @@ def test_search_by_work():
 #     for book in result:
 #         print(book)
 
+def test_search_keywords():
+    print("test_search_keywords")
+    # ranked: the edition titled exactly this comes first
+    for keywords in ['the unbearable lightness of being', '"unbearable lightness" kundera',
+                     'unbear* -joke', 'soseki or kundera']:
+        result = books.search_editions(keywords=keywords, limit=5)
+        print(keywords, [(book['edition_id'], book['title']) for book in result])
+    # nothing but stop words
+    print(books.search_editions(keywords='the of'))
+    print()
+
+def test_search_author_keywords():
+    print("test_search_author_keywords")
+    result = books.search_author(keywords='natsume soseki', limit=5)
+    for author in result:
+        print(author['author_id'], author['name'])
+    print()
+
 def test_get_edition_title_cover_authors():
     # edition_id = 'OL33968511M' # kundera
     edition_id = 'OL44230154M'
@@ -113,5 +131,35 @@ def test_get_edition_info(edition_id):
     print()
 
 
+def test_find_editions_by_identifier():
+    print("test_find_editions_by_identifier")
+    # the same isbn as isbn-10 and isbn-13, with and without hyphens
+    for isbn in ['0-06-093213-9', '9780060932138', '978-0-06-093213-8']:
+        result = books.find_editions_by_identifier(isbn, scheme='isbn')
+        print(isbn, result)
+    # wrong check digit
+    print(books.find_editions_by_identifier('0060932130', scheme='isbn'))
+    print(books.find_editions_by_identifier(kundera))
+
+def test_get_redirected_edition():
+    print("test_get_redirected_edition")
+    # an edition redirected by Open Library: the aliases table
+    # resolves it to the edition it was merged into
+    from sqlalchemy.orm import sessionmaker
+    from model.database import Alias
+    from normalization.ol_ids import TYPES, decode_id
+    session = sessionmaker(bind=books.engine)()
+    # the low two bits of a key are its type (see normalization/ol_ids.py)
+    alias = session.query(Alias).filter(Alias.id.op('&')(3) == TYPES['M']).first()
+    session.close()
+    if alias is None:
+        print("no redirected editions loaded")
+        return
+    alias_id, target_id = decode_id(alias.id), decode_id(alias.target_id)
+    result = books.get_edition_info(alias_id)
+    print(alias_id, '->', target_id, result and result['edition_id'] == target_id)
+    print(books.find_editions_by_identifier(alias_id))
+    print()
+
 if __name__ == '__main__':
     test_get_edition_info('OL33968511M')
\ No newline at end of file
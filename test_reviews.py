@@ -1,4 +1,5 @@
 import model.reviews as review
+import model.books as books
 
 # user_id = 1 # grace
 sanshiro = 'OL33968511M'
@@ -78,6 +79,37 @@ def test_delete_review(review_id):
     print(id)
     print()
 
+def test_ratings(book_id):
+    print("test_ratings")
+    book = books.get_edition_info(book_id)
+    print(book['average_rating'], book['rating_count'], book['rating_histogram'])
+    print(book['work_average_rating'], book['work_rating_count'])
+    print()
+
+def test_review_of_missing_work(user_id):
+    print("test_review_of_missing_work")
+    # an edition whose work is not in works (the dump has dangling
+    # keys): the review is written and rates the edition alone
+    from sqlalchemy import text
+    from normalization.ol_ids import decode_id
+    with books.engine.connect() as conn:
+        edition_id = conn.execute(text("""
+            SELECT ew.edition_id FROM editions_works ew
+            JOIN editions e ON e.id = ew.edition_id
+            WHERE NOT EXISTS (SELECT 1 FROM works w WHERE w.id = ew.work_id)
+            LIMIT 1
+        """)).scalar()
+    if edition_id is None:
+        print("no editions of missing works loaded")
+        return
+    book_id = decode_id(edition_id)
+    new_review = review.create_review(book_id, user_id, "missing work", 7)
+    print(new_review is not None)
+    test_ratings(book_id)
+    if new_review:
+        review.delete_review(new_review['review_id'])
+    print()
+
 def test_get_reviews():
     book_id = three_body
     user_id = 1
@@ -103,5 +135,7 @@ if __name__ == '__main__':
     # test_update_review_rating(4, 8)
 
     # test_delete_review(6)
+    # test_ratings(sanshiro)
+    # test_review_of_missing_work(user_id=1)
 
     test_get_reviews()